@@ -0,0 +1,267 @@
+import asyncio
+import json
+import logging
+import random
+import time
+import urllib.request
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from batch_scheduler import GenerationResult
+from config import (
+    EARLY_STOP,
+    FAKE_LOAD_SECONDS,
+    FAKE_TOKEN_DELAY_MS,
+    INFERENCE_BACKEND,
+    INFERENCE_MAX_BATCH_SIZE,
+    MODEL_NAME,
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    OPENAI_TIMEOUT,
+    STREAM_WAIT_FOR_THINK,
+)
+from utils import StopStringScanner
+
+logger = logging.getLogger(__name__)
+
+# Запрос остановился по стоп-метке, но число сгенерированных токенов неизвестно
+# (сервер не прислал usage до того, как поток закрыли): в сэкономленные токены он не идёт
+STOP_TOKENS_UNKNOWN = object()
+
+
+class TextChunkStreamer:
+    """
+    Асинхронный итератор по кускам текста для бэкендов без стримеров transformers.
+    Бэкенд пишет из потока планировщика (put_text / end), хендлер читает через async for.
+    Создаётся внутри работающего event loop.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def put_text(self, text: str):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, text)
+
+    def end(self):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        text = await self.queue.get()
+        if text is None:
+            raise StopAsyncIteration
+        return text
+
+
+class InferenceBackend:
+    """
+    Бэкенд генерации: получает пачку GenerationRequest от BatchScheduler
+    и возвращает GenerationResult в том же порядке.
+    """
+
+    name = "base"
+
+    def __init__(self):
+        # Сколько запросов завершилось по стоп-метке и сколько токенов бюджета это сэкономило
+        self.stop_stats = {"requests": 0, "early_stops": 0, "saved_tokens": 0, "uncounted_stops": 0}
+
+    def generate_batch(self, requests):
+        raise NotImplementedError
+
+    def create_streamer(self):
+        """
+        Стример для потоковой выдачи одного запроса (передаётся в GenerationRequest.streamer).
+        """
+        return TextChunkStreamer()
+
+    def invalidate_session(self, user_id: int):
+        """
+        История игрока переписана — сбросить закэшированное состояние его диалога, если оно есть.
+        """
+
+    def _record_stops(self, requests, stopped_at):
+        """
+        stopped_at — для каждого запроса число сгенерированных токенов на момент остановки по метке,
+        STOP_TOKENS_UNKNOWN, если запрос остановлен, но токены не посчитаны, или None.
+        """
+        early_stops = sum(s is not None for s in stopped_at)
+        uncounted = sum(s is STOP_TOKENS_UNKNOWN for s in stopped_at)
+        saved = sum(r.max_new_tokens - s for r, s in zip(requests, stopped_at) if isinstance(s, int))
+        self.stop_stats["requests"] += len(requests)
+        self.stop_stats["early_stops"] += early_stops
+        self.stop_stats["saved_tokens"] += saved
+        self.stop_stats["uncounted_stops"] += uncounted
+        if early_stops:
+            logger.info(
+                f"Ранняя остановка по стоп-метке: {early_stops} из {len(requests)}, сэкономлено {saved} токенов"
+                + (f" (у {uncounted} число токенов неизвестно)" if uncounted else "")
+            )
+
+
+class OpenAICompatibleBackend(InferenceBackend):
+    """
+    Генерация на внешнем сервере с OpenAI-совместимым API (/v1/completions): vLLM, llama.cpp server и т.п.
+    Сервер сам склеивает запросы в пачки, поэтому запросы пачки отправляются параллельно.
+    Ответ всегда читается потоком: так работают и стример, и ранняя остановка по стоп-меткам
+    (соединение закрывается, и сервер прекращает генерацию).
+    """
+
+    name = "openai"
+
+    def __init__(self, base_url=OPENAI_BASE_URL, model_name=MODEL_NAME, api_key=OPENAI_API_KEY, timeout=OPENAI_TIMEOUT):
+        super().__init__()
+        self.base_url = base_url.rstrip("/")
+        self.model_name = model_name
+        self.api_key = api_key
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=INFERENCE_MAX_BATCH_SIZE, thread_name_prefix="openai-backend")
+        logger.info(f"Генерация на сервере {self.base_url}, модель {self.model_name}")
+
+    def generate_batch(self, requests):
+        outcomes = list(self._pool.map(self._complete, requests))
+        self._record_stops(requests, [stopped_at for _, stopped_at in outcomes])
+        return [result for result, _ in outcomes]
+
+    def _complete(self, request):
+        started = time.perf_counter()
+        payload = {
+            "model": self.model_name,
+            "prompt": request.prompt,
+            "max_tokens": request.max_new_tokens,
+            "temperature": 0.7,
+            "top_p": 0.95,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        }
+        http_request = urllib.request.Request(
+            f"{self.base_url}/completions",
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {self.api_key}"},
+        )
+        stops = request.stop_strings if EARLY_STOP else None
+        scanner = StopStringScanner(stops, STREAM_WAIT_FOR_THINK) if stops else None
+        text, chunks, usage, finish_reason, stopped_at = "", 0, None, None, None
+        first_token_at = None
+        with urllib.request.urlopen(http_request, timeout=self.timeout) as response:
+            for line in response:
+                line = line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:") :].strip()
+                if data == "[DONE]":
+                    break
+                event = json.loads(data)
+                usage = event.get("usage") or usage
+                for choice in event.get("choices", []):
+                    chunk = choice.get("text", "")
+                    if chunk:
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                        text += chunk
+                        chunks += 1
+                        if request.streamer is not None:
+                            request.streamer.put_text(chunk)
+                    finish_reason = choice.get("finish_reason") or finish_reason
+                if scanner is not None and scanner.feed(text[len(scanner.text) :]):
+                    # Кусок потока может нести несколько токенов: считать их можно только по usage
+                    stopped_at = usage["completion_tokens"] if usage else STOP_TOKENS_UNKNOWN
+                    break
+        if request.streamer is not None:
+            request.streamer.end()
+
+        finished = time.perf_counter()
+        first_token_at = first_token_at or finished
+        if stopped_at is not None:
+            stop_reason = "stop_string"
+        else:
+            stop_reason = "length" if finish_reason == "length" else "eos"
+        result = GenerationResult(
+            text=text,
+            # Без usage (сервер его не прислал) считаем кусок потока за токен
+            prompt_tokens=usage["prompt_tokens"] if usage else None,
+            generated_tokens=usage["completion_tokens"] if usage else chunks,
+            stop_reason=stop_reason,
+            queue_seconds=started - request.enqueued_at,
+            prefill_seconds=first_token_at - started,
+            decode_seconds=finished - first_token_at,
+        )
+        return result, stopped_at
+
+
+class FakeBackend(InferenceBackend):
+    """
+    Детерминированная заглушка без модели для нагрузочного тестирования бота на CPU.
+    Ответ зависит только от промпта; «токен» — слово, каждое занимает FAKE_TOKEN_DELAY_MS миллисекунд.
+    """
+
+    name = "fake"
+    WORDS = (
+        "летописец внимает владыка держава войско храм зерно караван посол "
+        "крепость река боги народ золото совет граница жрецы урожай"
+    ).split()
+
+    def __init__(self, token_delay_ms=FAKE_TOKEN_DELAY_MS, load_seconds=FAKE_LOAD_SECONDS):
+        super().__init__()
+        self.token_delay = token_delay_ms / 1000
+        # Имитация загрузки весов — для проверки поведения бота, пока модель не готова
+        time.sleep(load_seconds)
+        logger.info("Используется детерминированная заглушка вместо модели")
+
+    def generate_batch(self, requests):
+        started = time.perf_counter()
+        pieces = [self._pieces(r) for r in requests]
+        # Пачка генерируется «одновременно»: время — по самому длинному ответу
+        for step in range(max(len(p) for p in pieces)):
+            time.sleep(self.token_delay)
+            for request, request_pieces in zip(requests, pieces):
+                if request.streamer is not None and step < len(request_pieces):
+                    request.streamer.put_text(request_pieces[step])
+        for request in requests:
+            if request.streamer is not None:
+                request.streamer.end()
+        finished = time.perf_counter()
+
+        self._record_stops(requests, [None] * len(requests))
+        return [
+            GenerationResult(
+                text="".join(request_pieces),
+                prompt_tokens=len(request.prompt.split()),
+                generated_tokens=len(request_pieces),
+                stop_reason="length" if len(request_pieces) >= request.max_new_tokens else "eos",
+                queue_seconds=started - request.enqueued_at,
+                prefill_seconds=0.0,
+                decode_seconds=finished - started,
+            )
+            for request, request_pieces in zip(requests, pieces)
+        ]
+
+    def _pieces(self, request):
+        """
+        Куски ответа по «токену»: короткие рассуждения в <think>, как у модели-рассуждателя, затем ответ.
+        """
+        rng = random.Random(zlib.crc32(request.prompt.encode("utf-8")))
+        think = [rng.choice(self.WORDS) for _ in range(rng.randint(2, 6))]
+        answer = [rng.choice(self.WORDS) for _ in range(rng.randint(8, 40))]
+        answer[0] = answer[0].capitalize()
+        answer[-1] += "."
+        pieces = ["<think>", *[" " + w for w in think], " </think>\n\n", answer[0], *[" " + w for w in answer[1:]]]
+        return pieces[: request.max_new_tokens]
+
+
+def create_backend(name: str = INFERENCE_BACKEND) -> InferenceBackend:
+    """
+    Бэкенд по имени из INFERENCE_BACKEND: transformers, openai или fake.
+    transformers и torch импортируются только для локальной модели.
+    """
+    if name == "transformers":
+        from transformers_backend import TransformersBackend
+
+        return TransformersBackend()
+    if name == "openai":
+        return OpenAICompatibleBackend()
+    if name == "fake":
+        return FakeBackend()
+    raise ValueError(f"Неизвестный бэкенд генерации: {name}")
@@ -0,0 +1,243 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from metrics import LLM_ERRORS, LLM_QUEUE_DEPTH, record_generation
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета от самого срочного: ход игрока, событие администратора, аспект при регистрации, фоновая работа
+PRIORITY_CLASSES = ("turn", "event", "registration", "background")
+
+
+class GenerationRequest:
+    """
+    Один запрос на генерацию: промпт, бюджет новых токенов и future, в которую придёт результат.
+    prefix — начало промпта, KV-состояние которого стоит закэшировать (необязательно).
+    session — пара (user_id, текст диалога) для KV-кэша диалога игрока (необязательно).
+    streamer — стример transformers для потоковой выдачи токенов (необязательно).
+    stop_strings — метки, на которых генерацию можно закончить досрочно (необязательно).
+    priority — класс приоритета из PRIORITY_CLASSES.
+    """
+
+    def __init__(
+        self,
+        prompt: str,
+        max_new_tokens: int,
+        prefix: str = None,
+        session=None,
+        streamer=None,
+        stop_strings=None,
+        priority: str = "background",
+    ):
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Неизвестный класс приоритета: {priority}")
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.prefix = prefix
+        self.session = session
+        self.streamer = streamer
+        self.stop_strings = stop_strings
+        self.priority = priority
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class GenerationResult:
+    """
+    Результат генерации одного запроса: только новый текст (без промпта) и метаданные.
+    stop_reason — "stop_string" (стоп-метка), "eos" (модель закончила сама) или "length" (исчерпан бюджет).
+    Тайминги в секундах: ожидание в очереди, префилл (до первого токена) и декодирование.
+    token_ids — id сгенерированных токенов без промпта и паддинга (None, если бэкенд их не отдаёт).
+    """
+
+    def __init__(
+        self,
+        text,
+        prompt_tokens,
+        generated_tokens,
+        stop_reason,
+        queue_seconds,
+        prefill_seconds,
+        decode_seconds,
+        token_ids=None,
+    ):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.generated_tokens = generated_tokens
+        self.stop_reason = stop_reason
+        self.queue_seconds = queue_seconds
+        self.prefill_seconds = prefill_seconds
+        self.decode_seconds = decode_seconds
+        self.token_ids = token_ids
+
+    def summary(self) -> str:
+        """
+        Краткая строка метаданных для логов.
+        """
+        # Внешний сервер может не сообщить длину промпта
+        prompt_tokens = "?" if self.prompt_tokens is None else self.prompt_tokens
+        return (
+            f"промпт {prompt_tokens} ток., ответ {self.generated_tokens} ток., остановка: {self.stop_reason}, "
+            f"очередь {self.queue_seconds:.2f} с, префилл {self.prefill_seconds:.2f} с, "
+            f"декодирование {self.decode_seconds:.2f} с"
+        )
+
+
+class BatchScheduler:
+    """
+    Планировщик пакетного инференса с классами приоритета.
+    Запросы из всех хендлеров складываются в общую очередь, а единственный рабочий поток
+    забирает их пачками (не больше max_batch_size, ожидая попутчиков не дольше max_wait_ms)
+    и прогоняет каждую пачку одним вызовом generate_batch(список GenerationRequest).
+    Пока пачка генерируется, новые запросы копятся в очереди и уходят следующей пачкой.
+    Из очереди первым берётся запрос самого срочного класса (PRIORITY_CLASSES), при равенстве — самый старый.
+    Чтобы фоновые запросы не голодали, каждые aging_seconds ожидания поднимают запрос на один класс.
+    class_limits ограничивает, сколько запросов класса может быть в одной пачке.
+    Потоковые запросы (со стримером) генерируются по одному: стример transformers
+    поддерживает только пачку из одного промпта.
+    """
+
+    def __init__(
+        self,
+        generate_batch,
+        max_batch_size: int = 8,
+        max_wait_ms: int = 50,
+        aging_seconds: float = 30,
+        class_limits: dict = None,
+    ):
+        self.generate_batch = generate_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.aging_seconds = aging_seconds
+        self.class_limits = class_limits or {}
+        self._pending = []
+        self._condition = threading.Condition()
+        # Метрики по классам: сколько запросов поставлено и ожидание в очереди последних из них
+        self.submitted = {name: 0 for name in PRIORITY_CLASSES}
+        self.waits = {name: deque(maxlen=1000) for name in PRIORITY_CLASSES}
+        self._thread = threading.Thread(target=self._loop, name="batch-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt: str, max_new_tokens: int, **options) -> Future:
+        """
+        Ставит промпт в очередь и сразу возвращает future с GenerationResult.
+        options — необязательные поля GenerationRequest (prefix, session, streamer, stop_strings, priority).
+        """
+        request = GenerationRequest(prompt, max_new_tokens, **options)
+        with self._condition:
+            self._pending.append(request)
+            self.submitted[request.priority] += 1
+            self._condition.notify()
+        return request.future
+
+    def _rank(self, request, now):
+        # Меньше — срочнее; ожидание постепенно поднимает запрос к классам выше
+        rank = PRIORITY_CLASSES.index(request.priority)
+        if self.aging_seconds > 0:
+            rank -= (now - request.enqueued_at) / self.aging_seconds
+        return rank, request.enqueued_at
+
+    def _take(self, batch):
+        """
+        Забирает из очереди самый срочный запрос, который можно добавить в пачку, или возвращает None.
+        Вызывается под self._condition.
+        """
+        now = time.perf_counter()
+        counts = {}
+        for request in batch:
+            counts[request.priority] = counts.get(request.priority, 0) + 1
+        best = None
+        for request in self._pending:
+            if batch and request.streamer is not None:
+                continue
+            limit = self.class_limits.get(request.priority)
+            if batch and limit is not None and counts.get(request.priority, 0) >= limit:
+                continue
+            if best is None or self._rank(request, now) < self._rank(best, now):
+                best = request
+        if best is not None:
+            self._pending.remove(best)
+        return best
+
+    def _collect_batch(self):
+        # Блокируемся до первого запроса, затем добираем попутчиков до дедлайна
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            batch = [self._take([])]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size and batch[0].streamer is None:
+                request = self._take(batch)
+                if request is not None:
+                    batch.append(request)
+                    continue
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                self._condition.wait(timeout)
+            depth = self._depth()
+        for name, value in depth.items():
+            LLM_QUEUE_DEPTH.set(value, priority=name)
+        started = time.perf_counter()
+        for request in batch:
+            self.waits[request.priority].append(started - request.enqueued_at)
+        return [r for r in batch if r.future.set_running_or_notify_cancel()]
+
+    def _depth(self) -> dict:
+        # Вызывается под self._condition
+        depth = {name: 0 for name in PRIORITY_CLASSES}
+        for request in self._pending:
+            depth[request.priority] += 1
+        return depth
+
+    def stats(self) -> dict:
+        """
+        Метрики очереди по классам: глубина сейчас, всего поставлено, среднее и p95 ожидания (в секундах)
+        по последним 1000 запросам класса.
+        """
+        with self._condition:
+            depth = self._depth()
+        stats = {}
+        for name in PRIORITY_CLASSES:
+            waits = sorted(self.waits[name])
+            stats[name] = {
+                "depth": depth[name],
+                "submitted": self.submitted[name],
+                "wait_mean": sum(waits) / len(waits) if waits else 0.0,
+                "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+            }
+        return stats
+
+    def _loop(self):
+        while True:
+            batch = self._collect_batch()
+            if not batch:
+                continue
+            started = time.perf_counter()
+            try:
+                results = self.generate_batch(batch)
+            except Exception as e:
+                logger.error(f"Ошибка пакетной генерации: {str(e)}", exc_info=True)
+                for request in batch:
+                    LLM_ERRORS.inc(priority=request.priority)
+                    request.future.set_exception(e)
+                    if request.streamer is not None:
+                        request.streamer.end()
+                continue
+            elapsed = time.perf_counter() - started
+            classes = ", ".join(sorted({r.priority for r in batch}))
+            logger.info(
+                f"Пачка из {len(batch)} запросов ({classes}) сгенерирована за {elapsed:.2f} с "
+                f"(макс. ожидание в очереди {started - min(r.enqueued_at for r in batch):.2f} с)"
+            )
+            for request, result in zip(batch, results):
+                request.future.set_result(result)
+            # Сбой метрик не должен останавливать поток планировщика
+            try:
+                for request, result in zip(batch, results):
+                    record_generation(request, result)
+            except Exception as e:
+                logger.warning(f"Не удалось записать метрики генерации: {str(e)}")
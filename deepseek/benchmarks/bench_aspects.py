@@ -0,0 +1,89 @@
+"""
+Точность и скорость определения аспектов сообщения на размеченном наборе aspect_fixtures.json:
+прежний выбор «первый аспект, чья основа встретилась» против взвешенного AspectScorer (top-k).
+Метрики: точность первого аспекта (он есть среди правильных) и микро-точность/полнота
+по множеству аспектов; «описание» означает, что аспект не найден.
+
+Запуск из каталога deepseek:
+    python benchmarks/bench_aspects.py [--top-k 2] [--threshold 1] [--repeat 200]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "aspect_fixtures.json")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top-k", type=int, default=None, help="по умолчанию RAG_TOP_ASPECTS")
+    parser.add_argument("--threshold", type=float, default=None, help="по умолчанию RAG_MIN_ASPECT_SCORE")
+    parser.add_argument("--repeat", type=int, default=200, help="повторов набора для замера времени")
+    return parser.parse_args()
+
+
+def first_synonym_wins(text, synonyms):
+    """
+    Прежний выбор аспекта из detect_aspect_and_country.
+    """
+    for aspect, words in synonyms.items():
+        for word in words:
+            if word in text:
+                return [aspect]
+    return ["описание"]
+
+
+def evaluate(predict, fixtures, repeat):
+    hits = true_positive = predicted = relevant = 0
+    for fixture in fixtures:
+        labels = set(fixture["aspects"])
+        aspects = predict(fixture["text"].lower())
+        hits += aspects[0] in labels
+        true_positive += len(labels & set(aspects))
+        predicted += len(aspects)
+        relevant += len(labels)
+
+    latencies = []
+    for _ in range(repeat):
+        for fixture in fixtures:
+            text = fixture["text"].lower()
+            started = time.perf_counter()
+            predict(text)
+            latencies.append(time.perf_counter() - started)
+    return hits / len(fixtures), true_positive / predicted, true_positive / relevant, statistics.mean(latencies)
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("BOT_TOKEN", "benchmark")
+    from config import RAG_MIN_ASPECT_SCORE, RAG_TOP_ASPECTS
+    from rag_retriever import ASPECT_SYNONYMS, aspect_scorer
+
+    top_k = args.top_k or RAG_TOP_ASPECTS
+    threshold = RAG_MIN_ASPECT_SCORE if args.threshold is None else args.threshold
+    with open(FIXTURES, encoding="utf-8") as f:
+        fixtures = json.load(f)
+
+    def scored(text):
+        return aspect_scorer.top(text, top_k, threshold) or ["описание"]
+
+    print(f"Сообщений в наборе: {len(fixtures)}, top-k: {top_k}, порог: {threshold}")
+    for name, predict in (
+        ("первая основа", lambda text: first_synonym_wins(text, ASPECT_SYNONYMS)),
+        ("взвешенный", scored),
+    ):
+        top1, precision, recall, mean = evaluate(predict, fixtures, args.repeat)
+        print(
+            f"{name:14}: первый аспект верен {top1:.0%}, точность {precision:.0%}, полнота {recall:.0%}, "
+            f"{mean * 1e6:.1f} мкс на сообщение"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Бенчмарк пакетного инференса на маленькой модели (запускается на CPU).
+
+Сравнивает пропускную способность прежнего пути (один model.generate на запрос,
+запросы строго по очереди) и BatchScheduler (запросы копятся и уходят пачками).
+
+Запуск из каталога deepseek:
+    python benchmarks/bench_batching.py [--model sshleifer/tiny-gpt2] [--requests 32] [--batch 8]
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="sshleifer/tiny-gpt2")
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--wait-ms", type=int, default=20)
+    parser.add_argument("--tokens", type=int, default=64)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("BOT_TOKEN", "benchmark")
+    os.environ["MODEL_NAME"] = args.model
+    os.environ["INFERENCE_BACKEND"] = "transformers"
+    os.environ["INFERENCE_MAX_BATCH_SIZE"] = str(args.batch)
+    os.environ["INFERENCE_MAX_WAIT_MS"] = str(args.wait_ms)
+
+    from batch_scheduler import GenerationRequest
+    from model_handler import model_handler
+
+    model_handler.load()
+    backend = model_handler.backend
+
+    prompts = [f"Игрок: Летописец, поведай о судьбе державы номер {i}.\nАссистент:" for i in range(args.requests)]
+
+    # Прогрев, чтобы не мерить загрузку весов и первую компиляцию ядер
+    backend.generate_batch([GenerationRequest(prompts[0], 4)])
+
+    started = time.perf_counter()
+    for prompt in prompts:
+        backend._generate_padded([GenerationRequest(prompt, args.tokens)])
+    sequential = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.requests) as pool:
+        futures = list(pool.map(lambda p: model_handler.scheduler.submit(p, args.tokens), prompts))
+        for future in futures:
+            future.result()
+    batched = time.perf_counter() - started
+
+    print(f"Модель: {args.model}, запросов: {args.requests}, бюджет: {args.tokens} токенов")
+    print(f"По одному:  {sequential:.2f} с, {args.requests / sequential:.2f} запр/с")
+    print(f"Пачками {args.batch}: {batched:.2f} с, {args.requests / batched:.2f} запр/с")
+    print(f"Ускорение: x{sequential / batched:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Бенчмарк рассылки «всем странам» на Telegram без сети (fake_telegram) с задержкой ответа API
+и подстроенными сбоями: бот заблокирован, чат не найден, временные сетевые ошибки,
+RetryAfter и ошибка сервера, которая не проходит.
+Сравниваются прежний последовательный цикл (ошибки молча пропускаются) и Broadcaster:
+время рассылки, наибольшее число сообщений за секунду (лимит Telegram — около 30) и отчёт о доставке.
+
+Запуск из каталога deepseek:
+    python benchmarks/bench_broadcast.py [--players 200] [--latency 0.1]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+TEXT = "⚡️ <b>В вашей стране случилось новое событие:</b>\n\nРазлив реки смыл посевы."
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.1, help="время ответа API Telegram, с")
+    return parser.parse_args()
+
+
+def make_errors():
+    from aiogram.exceptions import (
+        TelegramBadRequest,
+        TelegramForbiddenError,
+        TelegramNetworkError,
+        TelegramRetryAfter,
+        TelegramServerError,
+    )
+
+    return {
+        7: [lambda m: TelegramForbiddenError(m, "Forbidden: bot was blocked by the user")],
+        13: [lambda m: TelegramNetworkError(m, "Connection reset")] * 2,
+        21: [lambda m: TelegramRetryAfter(m, "Too Many Requests", 1)],
+        34: [lambda m: TelegramBadRequest(m, "Bad Request: chat not found")],
+        55: [lambda m: TelegramServerError(m, "Internal Server Error")] * 10,
+    }
+
+
+def peak_rate(session):
+    """
+    Наибольшее число запросов к API за любое окно в одну секунду.
+    """
+    times = [at for at, _ in session.calls]
+    peak, start = 0, 0
+    for end, at in enumerate(times):
+        while at - times[start] >= 1.0:
+            start += 1
+        peak = max(peak, end - start + 1)
+    return peak
+
+
+async def sequential(bot, chat_ids):
+    # Как было в admin_do_send_message
+    success = 0
+    for chat_id in chat_ids:
+        try:
+            await bot.send_message(chat_id, TEXT, parse_mode="HTML")
+            success += 1
+        except Exception:
+            continue
+    return f"доставлено {success}, остальные ошибки не видны"
+
+
+async def engine(bot, chat_ids):
+    from broadcast import Broadcaster
+
+    report = await Broadcaster(bot, backoff=0.2).send(chat_ids, TEXT)
+    return report.summary().replace("\n", "; ")
+
+
+async def run(args):
+    from aiogram import Bot
+
+    from fake_telegram import RecordingSession
+
+    chat_ids = list(range(1, args.players + 1))
+    print(f"Игроков: {args.players}, задержка API: {args.latency * 1000:.0f} мс")
+    for name, variant in (("последовательно", sequential), ("Broadcaster", engine)):
+        session = RecordingSession(latency=args.latency, errors=make_errors())
+        bot = Bot(token="42:benchmark", session=session)
+        started = time.perf_counter()
+        outcome = await variant(bot, chat_ids)
+        elapsed = time.perf_counter() - started
+        print(f"{name:15}: {elapsed:6.2f} с, пик {peak_rate(session)} сообщ./с, {outcome}")
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("BOT_TOKEN", "benchmark")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
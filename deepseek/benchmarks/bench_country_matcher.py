@@ -0,0 +1,124 @@
+"""
+Бенчмарк поиска стран в сообщении игрока при сотнях стран с синонимами:
+прежний перебор вариантов с тремя формами `form in text` против автомата Ахо — Корасик (CountryMatcher).
+Также меряется полная сборка автомата и дополнение его одной новой страной.
+
+Запуск из каталога deepseek:
+    python benchmarks/bench_country_matcher.py [--countries 300] [--synonyms 2] [--messages 2000]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SYLLABLES = (
+    "ба ва га да жа за ка ла ма на па ра са та фа ха ша бе ве ге де ле ме не ре се те "
+    "ки ли ми ни ри си ти ко ло мо но ро со то ку лу му ну ру су ту"
+).split()
+WORDS = "владыка приказывает войску выступить к границам и заключить союз с послами о торговле зерном".split()
+ENDINGS = ("", "а", "у", "ом", "е", "ии")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--countries", type=int, default=300)
+    parser.add_argument("--synonyms", type=int, default=2)
+    parser.add_argument("--messages", type=int, default=2000)
+    return parser.parse_args()
+
+
+def make_world(rng, countries, synonyms):
+    """
+    Варианты поиска как у get_all_country_synonyms_and_names: (ключ, каноническое название).
+    """
+    names = set()
+    while len(names) < countries:
+        names.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(3, 4))))
+    variants = [(name, name.capitalize()) for name in sorted(names)]
+    for name in sorted(names):
+        for i in range(synonyms):
+            variants.append((f"{rng.choice(SYLLABLES)}{name} царство {i}", name.capitalize()))
+    return variants
+
+
+def make_messages(rng, variants, count):
+    messages = []
+    for _ in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(8, 30))]
+        for _ in range(rng.randint(0, 2)):
+            variant = rng.choice(variants)[0]
+            words.insert(rng.randrange(len(words) + 1), variant + rng.choice(ENDINGS))
+        messages.append(" ".join(words))
+    return messages
+
+
+def find_country_loop(variants, ut):
+    """
+    Прежний поиск из detect_aspect_and_country.
+    """
+    for var, canonical in variants:
+        if not var:
+            continue
+        lowers = [var, var[:-1], var[:-2]] if len(var) > 3 else [var]
+        for form in lowers:
+            if form and form in ut:
+                return canonical
+    return None
+
+
+def timed(function, messages):
+    latencies = []
+    results = []
+    for message in messages:
+        started = time.perf_counter()
+        results.append(function(message))
+        latencies.append(time.perf_counter() - started)
+    return results, statistics.mean(latencies)
+
+
+def main():
+    args = parse_args()
+    from text_matching import CountryMatcher
+
+    rng = random.Random(0)
+    variants = make_world(rng, args.countries, args.synonyms)
+    messages = make_messages(rng, variants, args.messages)
+    canonical = dict(variants)
+
+    started = time.perf_counter()
+    matcher = CountryMatcher((var, var) for var, _ in variants)
+    matcher.find_all("")  # суффиксные ссылки строятся при первом поиске
+    build = time.perf_counter() - started
+
+    loop_results, loop_mean = timed(lambda m: find_country_loop(variants, m), messages)
+
+    def find_first(message):
+        mentions = matcher.find_all(message)
+        return canonical[mentions[0][2]] if mentions else None
+
+    matcher_results, matcher_mean = timed(find_first, messages)
+
+    started = time.perf_counter()
+    matcher.add("новаястрана", "новаястрана")
+    matcher.find_all("")
+    extend = time.perf_counter() - started
+
+    found = sum(r is not None for r in matcher_results)
+    same = sum(a == b for a, b in zip(loop_results, matcher_results))
+    print(f"Стран: {args.countries}, вариантов поиска: {len(variants)}, сообщений: {args.messages}")
+    print(f"Перебор вариантов : {loop_mean * 1e6:9.1f} мкс на сообщение")
+    print(f"Ахо — Корасик     : {matcher_mean * 1e6:9.1f} мкс на сообщение (x{loop_mean / matcher_mean:.1f})")
+    print(f"Сборка автомата: {build * 1000:.1f} мс, добавление страны: {extend * 1000:.2f} мс")
+    print(
+        f"Страна найдена в {found} сообщениях; совпадает с перебором в {same} из {args.messages} "
+        "(перебор берёт первый вариант по порядку, автомат — первое упоминание в тексте)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Микробенчмарк задержки базы на одно игровое сообщение: те же запросы, что делает
+handle_game_dialog (страна, описание, RAG-контекст, история и её обновление),
+с новым соединением на каждый запрос (как раньше) и через пул постоянных соединений в WAL.
+Отдельным проходом считается, сколько SQL-выражений уходит в базу на сообщение и на RAG-поиск
+(мир игры читается из памяти, см. world_state).
+
+Запуск из каталога deepseek:
+    python benchmarks/bench_db.py [--countries 50] [--messages 300]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEXTS = (
+    "Приказываю усилить войско у южной границы.",
+    "Что известно о религии соседей?",
+    "Как живёт народ Египта?",
+    "Построить новый храм в столице.",
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--countries", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=300)
+    return parser.parse_args()
+
+
+class ConnectPerQuery:
+    """
+    Прежнее поведение: новое соединение (и новый поток aiosqlite) на каждый запрос.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @asynccontextmanager
+    async def acquire(self):
+        import aiosqlite
+
+        async with aiosqlite.connect(self.path) as db:
+            yield db
+
+
+async def fill(database, countries):
+    await database.init_db()
+    for user_id in range(1, countries + 1):
+        name = "Египет" if user_id == 1 else f"Держава{user_id}"
+        await database.set_user_country(user_id, name)
+        await database.set_user_country_desc(user_id, f"Земли у великой реки, народ {user_id}.")
+        for code in database.ASPECT_CODES:
+            await database.set_user_aspect(user_id, code, f"{code} страны {name}")
+        await database.add_country_synonym(name, f"{name.lower()}ское царство")
+
+
+async def handle_message(database, get_rag_context, user_id, text):
+    await database.get_user_country(user_id)
+    await database.get_user_country_desc(user_id)
+    await get_rag_context(user_id, text)
+    await database.get_history(user_id)
+    await database.update_history(user_id, text, "Летописец внимает.", 4)
+
+
+class CountingPool:
+    """
+    Обёртка над пулом, считающая выполненные SQL-выражения (через trace callback sqlite3).
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.statements = 0
+
+    def _count(self, statement):
+        self.statements += 1
+
+    @asynccontextmanager
+    async def acquire(self):
+        async with self.pool.acquire() as db:
+            await db.set_trace_callback(self._count)
+            try:
+                yield db
+            finally:
+                await db.set_trace_callback(None)
+
+
+async def count_statements(database, get_rag_context, pool, args):
+    """
+    Среднее число SQL-выражений на сообщение: всего и внутри get_rag_context.
+    """
+    counting = database.db_pool = CountingPool(pool)
+    total = rag = 0
+    for i in range(len(TEXTS) * 5):
+        user_id, text = 1 + i % args.countries, TEXTS[i % len(TEXTS)]
+        before = counting.statements
+        await get_rag_context(user_id, text)
+        rag += counting.statements - before
+        counting.statements = before
+        await handle_message(database, get_rag_context, user_id, text)
+        total += counting.statements - before
+    database.db_pool = pool
+    return total / (len(TEXTS) * 5), rag / (len(TEXTS) * 5)
+
+
+async def measure(pool, args):
+    import database
+    from rag_retriever import get_rag_context
+
+    database.db_pool = pool
+    await fill(database, args.countries)
+    latencies = []
+    for i in range(args.messages):
+        started = time.perf_counter()
+        await handle_message(database, get_rag_context, 1 + i % args.countries, TEXTS[i % len(TEXTS)])
+        latencies.append(time.perf_counter() - started)
+    statements = await count_statements(database, get_rag_context, pool, args)
+    if hasattr(pool, "close"):
+        await pool.close()
+    latencies.sort()
+    return statistics.mean(latencies), latencies[int(len(latencies) * 0.95)], statements
+
+
+async def run(args):
+    from db_pool import ConnectionPool
+
+    workdir = tempfile.mkdtemp()
+    results = [
+        ("соединение на запрос", await measure(ConnectPerQuery(os.path.join(workdir, "before.db")), args)),
+        ("пул соединений, WAL", await measure(ConnectionPool(os.path.join(workdir, "after.db")), args)),
+    ]
+    print(f"Стран: {args.countries}, сообщений: {args.messages}")
+    for name, (mean, p95, (total, rag)) in results:
+        print(
+            f"{name:22}: в среднем {mean * 1000:.2f} мс, p95 {p95 * 1000:.2f} мс на сообщение, "
+            f"SQL-выражений {total:.1f} (из них RAG {rag:.1f})"
+        )
+    print(f"Ускорение: x{results[0][1][0] / results[1][1][0]:.2f}")
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("BOT_TOKEN", "benchmark")
+    # Логи RAG-поиска перечисляют все страны и заглушили бы вывод
+    import logging
+
+    logging.disable(logging.INFO)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
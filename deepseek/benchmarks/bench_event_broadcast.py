@@ -0,0 +1,91 @@
+"""
+Бенчмарк записи события «всем странам» в историю при 10, 100 и 1000 странах:
+- прежняя рассылка: add_event_to_history_all внутри цикла по странам (N² записей);
+- по одному игроку: add_event_to_history для каждого (N транзакций);
+- пачкой: add_event_to_history_many, один executemany в одной транзакции.
+Telegram не участвует — меряется только работа с базой.
+
+Запуск из каталога deepseek:
+    python benchmarks/bench_event_broadcast.py [--countries 10 100 1000] [--quadratic-limit 100]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+EVENT = "В столице случилось землетрясение, храмы разрушены."
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--countries", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument(
+        "--quadratic-limit",
+        type=int,
+        default=100,
+        help="прежнюю рассылку (N² записей) мерить только до этого числа стран",
+    )
+    return parser.parse_args()
+
+
+async def per_user(database, user_ids):
+    for user_id in user_ids:
+        await database.add_event_to_history(user_id, EVENT)
+
+
+async def old_broadcast(database, user_ids):
+    # Как было в confirm_event_send: на каждую страну — событие всем странам по одной
+    for _ in user_ids:
+        await per_user(database, user_ids)
+
+
+async def bulk(database, user_ids):
+    await database.add_event_to_history_many(user_ids, EVENT)
+
+
+async def measure(variant, countries):
+    import database
+    from db_pool import ConnectionPool
+
+    database.db_pool = ConnectionPool(os.path.join(tempfile.mkdtemp(), "broadcast.db"))
+    await database.init_db()
+    for user_id in range(1, countries + 1):
+        await database.set_user_country(user_id, f"Держава{user_id}")
+    user_ids = list(range(1, countries + 1))
+
+    started = time.perf_counter()
+    await variant(database, user_ids)
+    elapsed = time.perf_counter() - started
+
+    async with database.db_pool.acquire() as db:
+        async with db.execute("SELECT COUNT(*) FROM turns WHERE role = 'event'") as cursor:
+            written = (await cursor.fetchone())[0]
+    await database.db_pool.close()
+    return elapsed, written
+
+
+async def run(args):
+    variants = (("прежняя рассылка", old_broadcast), ("по одному игроку", per_user), ("пачкой", bulk))
+    for countries in args.countries:
+        print(f"Стран: {countries}")
+        for name, variant in variants:
+            if variant is old_broadcast and countries > args.quadratic_limit:
+                print(f"  {name:17}: пропущено ({countries * countries} записей)")
+                continue
+            elapsed, written = await measure(variant, countries)
+            print(f"  {name:17}: {elapsed * 1000:9.1f} мс, записей {written}")
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("BOT_TOKEN", "benchmark")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Хранилище состояний FSM: задержка get_state / get_data / set_state в хендлере для MemoryStorage
+и SQLiteStorage (чтения из памяти, запись пачкой в фоне) и проверка, что незаконченные
+состояния переживают перезапуск. База — временная.
+
+Запуск из каталога deepseek:
+    python benchmarks/bench_fsm_storage.py [--users 1000] [--ops 20000]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--ops", type=int, default=20000)
+    return parser.parse_args()
+
+
+def key(user_id):
+    from aiogram.fsm.storage.base import StorageKey
+
+    return StorageKey(bot_id=42, chat_id=user_id, user_id=user_id)
+
+
+async def measure(storage, args):
+    """
+    Средняя задержка одной операции в микросекундах: чтение состояния и данных, запись состояния.
+    """
+    from handlers.fsm import RegisterCountry
+
+    results = {}
+    started = time.perf_counter()
+    for i in range(args.ops):
+        await storage.set_state(key(i % args.users), RegisterCountry.waiting_for_desc)
+    results["set_state"] = (time.perf_counter() - started) / args.ops * 1e6
+    for name, method in (("get_state", storage.get_state), ("get_data", storage.get_data)):
+        started = time.perf_counter()
+        for i in range(args.ops):
+            await method(key(i % args.users))
+        results[name] = (time.perf_counter() - started) / args.ops * 1e6
+    return results
+
+
+async def run(args):
+    from aiogram.fsm.storage.memory import MemoryStorage
+
+    from database import init_db
+    from db_pool import db_pool
+    from fsm_storage import SQLiteStorage
+
+    await db_pool.open()
+    await init_db()
+
+    memory = await measure(MemoryStorage(), args)
+    storage = SQLiteStorage()
+    await storage.start()
+    sqlite = await measure(storage, args)
+    await storage.update_data(key(1), {"country": "Египет"})
+    started = time.perf_counter()
+    await storage.close()
+    flush = time.perf_counter() - started
+
+    # «Перезапуск»: новое хранилище поднимает состояния из базы
+    restarted = SQLiteStorage()
+    started = time.perf_counter()
+    await restarted.start()
+    load = time.perf_counter() - started
+    state, data = await restarted.get_state(key(1)), await restarted.get_data(key(1))
+    await restarted.close()
+    await db_pool.close()
+
+    print(f"Пользователей: {args.users}, операций: {args.ops}")
+    for name in ("set_state", "get_state", "get_data"):
+        print(f"{name:10}: MemoryStorage {memory[name]:.2f} мкс, SQLiteStorage {sqlite[name]:.2f} мкс")
+    print(
+        f"Запись {args.users} состояний одной транзакцией: {flush * 1000:.1f} мс, "
+        f"загрузка при старте: {load * 1000:.1f} мс"
+    )
+    print(f"После перезапуска: состояние {state}, данные {data}")
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("BOT_TOKEN", "benchmark")
+    os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "chats.db")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
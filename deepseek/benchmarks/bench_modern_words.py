@@ -0,0 +1,82 @@
+"""
+Бенчмарк проверки текста на современные слова (style_checker) на длинных описаниях стран:
+прежний перебор «каждое слово × каждый корень» против одного скомпилированного выражения.
+Сверяется, что оба способа находят запрещённые слова в одних и тех же описаниях
+(прежний перебор не видел корней с дефисом, например «старт-ап»).
+
+Запуск из каталога deepseek:
+    python benchmarks/bench_modern_words.py [--texts 200] [--words 1500] [--dirty 0.5]
+"""
+
+import argparse
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = (
+    "держава раскинулась меж горных хребтов и плодородных долин великой реки где земледельцы "
+    "возделывают поля ячменя а кузнецы куют бронзовые мечи жрецы возносят молитвы богу солнца "
+    "в высоких храмах караваны везут ладан и медь старейшины вершат суд у городских ворот"
+).split()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=200)
+    parser.add_argument("--words", type=int, default=1500, help="слов в одном описании")
+    parser.add_argument("--dirty", type=float, default=0.5, help="доля описаний с одним современным словом")
+    return parser.parse_args()
+
+
+def contains_modern_words_loop(text, roots):
+    """
+    Прежняя реализация contains_modern_words.
+    """
+    lower_text = text.lower()
+    words = re.findall(r"\b\w+", lower_text)
+    for player_word in words:
+        for modern_word in roots:
+            if player_word.startswith(modern_word):
+                return modern_word
+    return None
+
+
+def timed(function, texts):
+    latencies, results = [], []
+    for text in texts:
+        started = time.perf_counter()
+        results.append(function(text))
+        latencies.append(time.perf_counter() - started)
+    return results, statistics.mean(latencies)
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("BOT_TOKEN", "benchmark")
+    from style_checker import MODERN_WORDS, contains_modern_words
+
+    rng = random.Random(0)
+    texts = []
+    for _ in range(args.texts):
+        words = [rng.choice(WORDS) for _ in range(args.words)]
+        if rng.random() < args.dirty:
+            words.insert(rng.randrange(len(words)), rng.choice(MODERN_WORDS) + rng.choice(("", "а", "ами", "ный")))
+        texts.append(" ".join(words).capitalize() + ".")
+
+    before, loop_mean = timed(lambda t: contains_modern_words_loop(t, MODERN_WORDS), texts)
+    after, compiled_mean = timed(contains_modern_words, texts)
+
+    agree = sum((a is None) == (b is None) for a, b in zip(before, after))
+    print(f"Описаний: {args.texts} по {args.words} слов, корней: {len(MODERN_WORDS)}")
+    print(f"Перебор корней     : {loop_mean * 1000:8.2f} мс на описание")
+    print(f"Одно выражение     : {compiled_mean * 1000:8.2f} мс на описание (x{loop_mean / compiled_mean:.0f})")
+    print(f"Находка совпадает в {agree} из {args.texts} описаний, с запрещёнными словами: {sum(map(bool, after))}")
+
+
+if __name__ == "__main__":
+    main()
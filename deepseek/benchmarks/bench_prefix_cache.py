@@ -0,0 +1,78 @@
+"""
+Бенчмарк кэша префиксов: время до первого токена с кэшем KV-состояний
+RPG_PROMPT и блока описания страны и без него (запускается на CPU).
+
+Запуск из каталога deepseek:
+    python benchmarks/bench_prefix_cache.py [--model Qwen/Qwen2.5-0.5B-Instruct] [--history 4] [--runs 5]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+COUNTRY_DESC = (
+    "Держава у великой реки, окружённая пустынями и горами. Народ возделывает плодородные берега, "
+    "почитает бога солнца и хранит древние свитки в храмах. Войско невелико, но крепости стоят на всех бродах. "
+) * 4
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="Qwen/Qwen2.5-0.5B-Instruct")
+    parser.add_argument("--history", type=int, default=4, help="Число строк истории в промпте")
+    parser.add_argument("--runs", type=int, default=5)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("BOT_TOKEN", "benchmark")
+    os.environ["MODEL_NAME"] = args.model
+    os.environ["INFERENCE_BACKEND"] = "transformers"
+    os.environ["PREFIX_CACHE_COUNTRY_BLOCKS"] = "1"
+
+    from batch_scheduler import GenerationRequest
+    from config import RPG_PROMPT
+    from model_handler import model_handler
+
+    model_handler.load()
+    backend = model_handler.backend
+
+    prefix = f"{RPG_PROMPT}\nИгрок управляет страной Египет.\nОписание страны: {COUNTRY_DESC}\n\n"
+    history = "\n".join(
+        f"Игрок: Приказываю строить новые стены, ход {i}.\nАссистент: Стены растут, о владыка, ход {i}."
+        for i in range(args.history // 2)
+    )
+    prompts = [f"{prefix}{history}\nИгрок: Что скажут соседи, шаг {i}?\nАссистент:" for i in range(args.runs)]
+    prompt_tokens = backend.tokenizer(prompts[0], return_tensors="pt")["input_ids"].shape[1]
+
+    # Прогрев и префилл блока страны
+    backend.generate_batch([GenerationRequest(prompts[0], 1, prefix=prefix)])
+
+    started = time.perf_counter()
+    for prompt in prompts:
+        backend._generate_padded([GenerationRequest(prompt, 1)])
+    uncached = (time.perf_counter() - started) / args.runs
+
+    saved_before = backend.prefix_cache.saved_seconds
+    started = time.perf_counter()
+    for prompt in prompts:
+        backend.generate_batch([GenerationRequest(prompt, 1, prefix=prefix)])
+    cached = (time.perf_counter() - started) / args.runs
+    saved = (backend.prefix_cache.saved_seconds - saved_before) / args.runs
+
+    cache = backend.prefix_cache
+    print(f"Модель: {args.model}, токенов в промпте: {prompt_tokens}")
+    print(f"TTFT без кэша:  {uncached * 1000:.1f} мс")
+    print(f"TTFT с кэшем:   {cached * 1000:.1f} мс (x{uncached / cached:.2f})")
+    print(f"Сэкономлено префилла на запрос (оценка кэша): {saved * 1000:.1f} мс")
+    print(
+        f"Кэш: {len(cache)} префиксов, {cache.total_bytes / 1024**2:.1f} МБ, попаданий {cache.hits}, промахов {cache.misses}"
+    )
+
+
+if __name__ == "__main__":
+    main()
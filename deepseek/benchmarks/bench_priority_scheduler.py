@@ -0,0 +1,145 @@
+"""
+Симуляция очереди инференса на синтетических трассах: ходы игроков приходят пуассоновским потоком,
+поверх них — регистрации (9 аспектов пачкой, затем описание), события администратора и фоновые запросы.
+Генерация заменена задержкой: пачка занимает --batch-base секунд плюс --per-request на каждый запрос.
+Ходы, как при STREAM_RESPONSES, потоковые и генерируются по одному.
+Сравниваются прежний порядок FIFO (все запросы в одном классе) и классы приоритета со старением.
+Время симуляции сжато в --scale раз; модели и зависимостей бота не нужно.
+
+Запуск из каталога deepseek:
+    python benchmarks/bench_priority_scheduler.py [--duration 1800] [--turn-interval 12] [--registrations 12]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_scheduler import PRIORITY_CLASSES, BatchScheduler, GenerationResult
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=1800, help="длина трассы, секунд модели")
+    parser.add_argument("--turn-interval", type=float, default=12, help="средний интервал между ходами игроков")
+    parser.add_argument("--registrations", type=int, default=12)
+    parser.add_argument("--signup-window", type=float, default=600, help="регистрации приходят в первые N секунд")
+    parser.add_argument("--events", type=int, default=10)
+    parser.add_argument("--background", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--batch-base", type=float, default=6.0, help="секунд на пачку")
+    parser.add_argument("--per-request", type=float, default=1.0, help="секунд на запрос в пачке")
+    parser.add_argument("--aging", type=float, default=120, help="секунд ожидания на подъём класса")
+    parser.add_argument("--scale", type=float, default=0.004, help="реальных секунд на секунду модели")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+def make_trace(args):
+    """
+    Список (время, класс, число запросов разом, продолжение) по возрастанию времени.
+    Продолжение — (класс, число) запросов, которые ставятся после завершения первых (описание страны).
+    """
+    rng = random.Random(args.seed)
+    trace = []
+    t = 0.0
+    while True:
+        t += rng.expovariate(1 / args.turn_interval)
+        if t >= args.duration:
+            break
+        trace.append((t, "turn", 1, None))
+    for _ in range(args.registrations):
+        trace.append((rng.uniform(0, args.signup_window), "registration", 9, ("registration", 1)))
+    for _ in range(args.events):
+        trace.append((rng.uniform(0, args.duration), "event", 1, None))
+    for _ in range(args.background):
+        trace.append((rng.uniform(0, args.duration), "background", 1, None))
+    return sorted(trace, key=lambda item: item[0])
+
+
+def simulate(args, trace, prioritized):
+    def generate_batch(requests):
+        started = time.perf_counter()
+        time.sleep((args.batch_base + args.per_request * len(requests)) * args.scale)
+        finished = time.perf_counter()
+        return [GenerationResult("", 0, 1, "eos", started - r.enqueued_at, 0.0, finished - started) for r in requests]
+
+    scheduler = BatchScheduler(
+        generate_batch,
+        args.batch,
+        20,
+        aging_seconds=args.aging * args.scale if prioritized else 0,
+        class_limits={"background": 2} if prioritized else None,
+    )
+    latencies = {name: [] for name in PRIORITY_CLASSES}
+    lock = threading.Lock()
+    pending = threading.Semaphore(0)
+    total = 0
+
+    def submit(kind, count, then):
+        # В режиме FIFO все запросы в одном классе — порядок только по времени постановки
+        priority = kind if prioritized else "background"
+        submitted = time.perf_counter()
+        # Ходу нужен только признак потокового запроса: стример заглушка ничем не пользуется
+        streamer = object() if kind == "turn" else None
+        futures = [scheduler.submit("промпт", 1, priority=priority, streamer=streamer) for _ in range(count)]
+        remaining = [count]
+
+        def done(_):
+            with lock:
+                latencies[kind].append((time.perf_counter() - submitted) / args.scale)
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and then is not None:
+                submit(*then, None)
+            pending.release()
+
+        for future in futures:
+            future.add_done_callback(done)
+
+    started = time.perf_counter()
+    for at, kind, count, then in trace:
+        delay = started + at * args.scale - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        submit(kind, count, then)
+        total += count + (then[1] if then else 0)
+    for _ in range(total):
+        pending.acquire()
+    return latencies
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def main():
+    args = parse_args()
+    trace = make_trace(args)
+    turns = sum(1 for _, kind, _, _ in trace if kind == "turn")
+    print(
+        f"Трасса: {args.duration:.0f} с, ходов {turns}, регистраций {args.registrations}, "
+        f"событий {args.events}, фоновых {args.background}; пачка до {args.batch}"
+    )
+    results = {"FIFO": simulate(args, trace, False), "приоритеты": simulate(args, trace, True)}
+    for name, latencies in results.items():
+        print(f"\n{name}:")
+        for kind in PRIORITY_CLASSES:
+            values = latencies[kind]
+            if values:
+                print(
+                    f"  {kind:12}: p50 {statistics.median(values):6.1f} с, p95 {percentile(values, 0.95):6.1f} с, "
+                    f"макс {max(values):6.1f} с ({len(values)} запросов)"
+                )
+    before, after = (percentile(results[name]["turn"], 0.95) for name in ("FIFO", "приоритеты"))
+    print(f"\np95 задержки хода: {before:.1f} с -> {after:.1f} с (x{before / after:.2f})")
+
+
+if __name__ == "__main__":
+    main()
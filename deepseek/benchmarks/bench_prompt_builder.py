@@ -0,0 +1,76 @@
+"""
+Размер промпта диалога без бюджета (всё подряд, как раньше) и после PromptBuilder,
+когда вопрос касается «всех» стран и RAG-справка содержит описание каждой страны.
+Печатает число токенов промпта и время сборки при разном числе стран.
+
+Запуск из каталога deepseek:
+    python benchmarks/bench_prompt_builder.py [--tokenizer Qwen/Qwen2.5-0.5B-Instruct] [--countries 10 50 200]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+COUNTRY_DESC = (
+    "Держава у великой реки, окружённая пустынями и горами. Народ возделывает плодородные берега, "
+    "почитает бога солнца и хранит древние свитки в храмах. Войско невелико, но крепости стоят на всех бродах. "
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokenizer", default="", help="пусто — оценка по символам")
+    parser.add_argument("--countries", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--history", type=int, default=8, help="строк истории")
+    parser.add_argument("--runs", type=int, default=200)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("BOT_TOKEN", "benchmark")
+    os.environ["PROMPT_TOKENIZER"] = args.tokenizer
+
+    from config import PROMPT_MAX_TOKENS, RPG_PROMPT
+    from model_handler import ModelHandler
+    from prompt_builder import token_counter
+
+    token_counter.load()
+    history = [
+        f"Игрок: Приказываю строить новые стены, ход {i}.\n"
+        if i % 2 == 0
+        else f"Ассистент: {COUNTRY_DESC * 3}Стены растут, о владыка, ход {i}."
+        for i in range(args.history)
+    ]
+    country_desc = COUNTRY_DESC * 4
+    message = "Что замышляют все соседние царства?"
+
+    print(f"Бюджет промпта: {PROMPT_MAX_TOKENS} ток., токенизатор: {args.tokenizer or 'оценка по символам'}")
+    print(f"{'стран':>6} {'без бюджета':>12} {'с бюджетом':>11} {'сборка, мс':>11}")
+    for countries in args.countries:
+        rag_context = "Описание всех стран:\n" + "\n".join(
+            f"Страна {i}: {COUNTRY_DESC}" for i in range(countries)
+        )
+        raw = "\n".join(
+            [RPG_PROMPT, f"Игрок управляет страной Египет.\nОписание страны: {country_desc}\n", *history]
+            + [rag_context + "\n", f"Игрок: {message}"]
+        )
+        timings = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            prompt, _, _ = ModelHandler._build_dialog_context(
+                history, message, RPG_PROMPT, "Египет", country_desc, rag_context
+            )
+            timings.append(time.perf_counter() - started)
+        print(
+            f"{countries:>6} {token_counter.count(raw):>12} {token_counter.count(prompt):>11} "
+            f"{statistics.median(timings) * 1000:>11.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
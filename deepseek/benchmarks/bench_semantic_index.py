@@ -0,0 +1,228 @@
+"""
+Семантический индекс на синтетическом мире: сотни стран с описаниями и значениями аспектов,
+у каждого игрока — ходы летописи. Аспекты описаны словами, которых нет в ASPECT_SYNONYMS,
+а вопросы задают их в других падежных формах.
+Сравнивается, как часто нужный аспект страны попадает в контекст: по ключевым словам (AspectScorer)
+и поиском по индексу среди документов этой страны (top-k). Меряются время поиска, добавления документа,
+сохранения и загрузки индекса.
+
+Запуск из каталога deepseek:
+    python benchmarks/bench_semantic_index.py [--countries 300] [--turns 50] [--queries 500] [--top-k 3]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Формы слов: в тексте аспекта берётся одна, в вопросе — другая
+VOCABULARY = {
+    "экономика": [
+        ("казна", "казне", "казну"),
+        ("золото", "золота", "золотом"),
+        ("купцы", "купцов", "купцам"),
+        ("рудники", "рудников", "рудниках"),
+        ("подати", "податей", "податями"),
+        ("ярмарка", "ярмарки", "ярмарке"),
+    ],
+    "военное_дело": [
+        ("легионы", "легионов", "легионам"),
+        ("лучники", "лучников", "лучниками"),
+        ("колесницы", "колесниц", "колесницами"),
+        ("полководец", "полководца", "полководцу"),
+        ("копьеносцы", "копьеносцев", "копьеносцам"),
+    ],
+    "внеш_политика": [
+        ("послы", "послов", "послам"),
+        ("договор", "договора", "договору"),
+        ("дань", "дани", "данью"),
+        ("переговоры", "переговоров", "переговорах"),
+        ("чужеземцы", "чужеземцев", "чужеземцам"),
+    ],
+    "территория": [
+        ("долины", "долин", "долинах"),
+        ("пустыня", "пустыни", "пустыне"),
+        ("побережье", "побережья", "побережью"),
+        ("горы", "гор", "горах"),
+        ("реки", "рек", "реках"),
+    ],
+    "технологичность": [
+        ("кузнецы", "кузнецов", "кузнецам"),
+        ("бронза", "бронзы", "бронзой"),
+        ("колесо", "колеса", "колесом"),
+        ("письменность", "письменности", "письменностью"),
+        ("орошение", "орошения", "орошению"),
+    ],
+    "религия_культура": [
+        ("жрецы", "жрецов", "жрецам"),
+        ("боги", "богов", "богам"),
+        ("обряды", "обрядов", "обрядам"),
+        ("песни", "песен", "песнях"),
+        ("святилище", "святилища", "святилищу"),
+    ],
+    "управление": [
+        ("наместники", "наместников", "наместникам"),
+        ("сановники", "сановников", "сановникам"),
+        ("указы", "указов", "указам"),
+        ("писцы", "писцов", "писцам"),
+        ("престол", "престола", "престолу"),
+    ],
+    "стройка": [
+        ("акведук", "акведука", "акведуку"),
+        ("стены", "стен", "стенами"),
+        ("каменщики", "каменщиков", "каменщикам"),
+        ("пирамида", "пирамиды", "пирамиде"),
+        ("мостовая", "мостовой", "мостовую"),
+    ],
+    "общество": [
+        ("крестьяне", "крестьян", "крестьянам"),
+        ("рабы", "рабов", "рабам"),
+        ("ремесленники", "ремесленников", "ремесленникам"),
+        ("знать", "знати", "знатью"),
+        ("горожане", "горожан", "горожанам"),
+    ],
+}
+FILLER = "в нашей державе издавна и ныне весьма много а также при владыке".split()
+QUESTIONS = ("Что у нас с {}?", "Расскажи про {} и {}.", "Как поживают наши {}?", "Доложи о {} и {}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--countries", type=int, default=300)
+    parser.add_argument("--turns", type=int, default=50, help="ходов летописи у каждого игрока")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--top-k", type=int, default=3)
+    return parser.parse_args()
+
+
+def aspect_text(rng, aspect):
+    words = [rng.choice(forms[:1]) for forms in rng.sample(VOCABULARY[aspect], 3)]
+    filler = rng.sample(FILLER, 5)
+    return " ".join(rng.sample(words + filler, len(words) + len(filler))).capitalize() + "."
+
+
+def question(rng, aspect):
+    forms = rng.sample(VOCABULARY[aspect], 2)
+    template = rng.choice(QUESTIONS)
+    return template.format(*(rng.choice(f[1:]) for f in forms))
+
+
+def make_docs(rng, countries, turns):
+    docs = []
+    for user_id in range(1, countries + 1):
+        docs.append((f"desc:{user_id}", user_id, "описание", " ".join(rng.sample(FILLER, 8)), None))
+        for aspect in VOCABULARY:
+            docs.append((f"aspect:{user_id}:{aspect}", user_id, aspect, aspect_text(rng, aspect), None))
+        for seq in range(1, turns + 1):
+            text = aspect_text(rng, rng.choice(list(VOCABULARY)))
+            docs.append((f"turn:{user_id}:{seq}", user_id, "ход", text, {"seq": seq, "role": "assistant"}))
+    return docs
+
+
+def concurrent_check(index, rng, args, seconds: float = 2.0):
+    """
+    Поиск в отдельном потоке, пока поток индекса обновляет и удаляет документы (со сменой строк матрицы).
+    Каждая находка перепроверяется: сходство должно совпадать с вектором текста найденного документа.
+    """
+    import threading
+
+    import numpy as np
+
+    stop = threading.Event()
+    found_all = []
+
+    def searcher():
+        while not stop.is_set():
+            query = question(rng, rng.choice(list(VOCABULARY)))
+            found_all.extend((query, found) for found in index.search(query, args.top_k))
+
+    thread = threading.Thread(target=searcher)
+    thread.start()
+    deadline = time.perf_counter() + seconds
+    i = 0
+    while time.perf_counter() < deadline:
+        user_id = i % args.countries + 1
+        aspect = rng.choice(list(VOCABULARY))
+        index.submit(index.remove, f"aspect:{user_id}:{aspect}").result()
+        index.submit(index.upsert, f"aspect:{user_id}:{aspect}", user_id, aspect, aspect_text(rng, aspect)).result()
+        i += 1
+    stop.set()
+    thread.join()
+    mismatches = 0
+    for query, (score, _, doc) in found_all:
+        expected = float(np.dot(*index.encoder.encode([query, doc["text"]])))
+        mismatches += abs(expected - score) > 1e-4
+    return mismatches, len(found_all)
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("BOT_TOKEN", "benchmark")
+    from config import RAG_SEMANTIC_MIN_SCORE
+    from rag_retriever import aspect_scorer
+    from semantic_index import SemanticIndex
+
+    rng = random.Random(0)
+    docs = make_docs(rng, args.countries, args.turns)
+    path = os.path.join(tempfile.mkdtemp(), "semantic_index.npz")
+    index = SemanticIndex(path, turns_per_user=args.turns)
+
+    started = time.perf_counter()
+    index.upsert_many(docs)
+    build = time.perf_counter() - started
+
+    keyword_hits = semantic_hits = 0
+    latencies = []
+    for _ in range(args.queries):
+        user_id = rng.randint(1, args.countries)
+        aspect = rng.choice(list(VOCABULARY))
+        text = question(rng, aspect)
+        keyword_hits += aspect in aspect_scorer.top(text.lower())
+        started = time.perf_counter()
+        found = index.search(
+            text, args.top_k, RAG_SEMANTIC_MIN_SCORE, user_ids={user_id}, where=lambda doc: doc["kind"] != "ход"
+        )
+        latencies.append(time.perf_counter() - started)
+        semantic_hits += any(doc["kind"] == aspect for _, _, doc in found)
+
+    started = time.perf_counter()
+    for i in range(100):
+        index.upsert(f"aspect:{i % args.countries + 1}:экономика", i % args.countries + 1, "экономика", f"Казна {i}.")
+    upsert = (time.perf_counter() - started) / 100
+
+    started = time.perf_counter()
+    index.save()
+    save = time.perf_counter() - started
+    started = time.perf_counter()
+    SemanticIndex(path).load()
+    load = time.perf_counter() - started
+
+    mismatches, checked = concurrent_check(index, rng, args)
+
+    latencies.sort()
+    stats = index.stats()
+    print(
+        f"Стран: {args.countries}, документов: {stats['docs']}, матрица {stats['mbytes']:.1f} МБ ({stats['encoder']})"
+    )
+    print(
+        f"Нужный аспект в контексте: по ключевым словам {keyword_hits / args.queries:.0%}, "
+        f"поиском top-{args.top_k} {semantic_hits / args.queries:.0%}"
+    )
+    print(
+        f"Поиск: среднее {statistics.mean(latencies) * 1000:.2f} мс, "
+        f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.2f} мс"
+    )
+    print(
+        f"Сборка индекса {build:.2f} с, обновление документа {upsert * 1000:.2f} мс, "
+        f"сохранение {save * 1000:.0f} мс ({os.path.getsize(path) / 2**20:.1f} МБ), загрузка {load * 1000:.0f} мс"
+    )
+    print(f"Поиск во время записей: {checked} находок, из них со сходством от чужого документа {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Попадания в KV-кэш диалога игрока (SessionCache) на длинном диалоге: окно истории, сдвигающееся
+на каждом ходу (HISTORY_WINDOW_STEP=1, как раньше), и окно, сдвигающееся скачками.
+Промпт собирается настоящим ModelHandler._build_dialog_context, кэш проверяется тем же правилом,
+что в TransformersBackend._prefill_session: новый текст диалога должен продолжать закэшированный.
+Печатает долю попаданий и сколько токенов промпта в среднем префиллится заново. Модели не нужно.
+
+Запуск из каталога deepseek:
+    python benchmarks/bench_session_cache.py [--turns 60] [--steps 1 4 8 16] [--tokenizer ...]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+COUNTRY_DESC = (
+    "Держава у великой реки, окружённая пустынями и горами. Народ возделывает плодородные берега, "
+    "почитает бога солнца и хранит древние свитки в храмах. Войско невелико, но крепости стоят на всех бродах. "
+)
+REPLY_SENTENCE = "Гонцы приносят вести о том, как исполняется воля правителя, и народ говорит о них на площадях. "
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokenizer", default="", help="пусто — оценка по символам")
+    parser.add_argument("--turns", type=int, default=60, help="ходов игрока в диалоге")
+    parser.add_argument("--steps", type=int, nargs="+", default=[1, 4, 8, 16], help="значения HISTORY_WINDOW_STEP")
+    parser.add_argument("--reply-sentences", type=int, nargs=2, default=[2, 8], help="длина ответа, предложений")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+def simulate(args, step):
+    from config import HISTORY_LIMIT, RPG_PROMPT
+    from database import history_window_start
+    from model_handler import ModelHandler
+    from prompt_builder import token_counter
+
+    rng = random.Random(args.seed)
+    log = []  # все строки истории после сброса
+    cached = None  # текст диалога в кэше игрока
+    hits = misses = 0
+    prefilled, window = [], []
+    for turn in range(args.turns):
+        history = log[history_window_start(len(log), HISTORY_LIMIT, step) :]
+        message = f"Приказываю строить новые стены у брода, ход {turn}."
+        prompt, prefix, session_text = ModelHandler._build_dialog_context(
+            history, message, RPG_PROMPT, "Египет", COUNTRY_DESC * 4, ""
+        )
+        reused = prefix
+        if session_text != prefix:
+            if cached is not None and session_text.startswith(cached):
+                hits += 1
+                reused = cached
+            else:
+                misses += 1
+            cached = session_text
+        prefilled.append(token_counter.count(prompt) - token_counter.count(reused))
+        window.append(len(history))
+
+        reply = REPLY_SENTENCE * rng.randint(*args.reply_sentences)
+        before = history_window_start(len(log), HISTORY_LIMIT, step)
+        log += [f"Игрок: {message}", f"Ассистент: {reply.strip()}"]
+        # update_history сбрасывает кэш, когда окно сдвинулось
+        if history_window_start(len(log), HISTORY_LIMIT, step) != before:
+            cached = None
+    return hits, misses, statistics.mean(prefilled), statistics.mean(window), max(window)
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("BOT_TOKEN", "benchmark")
+    os.environ["PROMPT_TOKENIZER"] = args.tokenizer
+
+    from config import HISTORY_LIMIT, PROMPT_HISTORY_TOKENS
+    from prompt_builder import token_counter
+
+    token_counter.load()
+    print(
+        f"Ходов: {args.turns}, HISTORY_LIMIT={HISTORY_LIMIT}, PROMPT_HISTORY_TOKENS={PROMPT_HISTORY_TOKENS}, "
+        f"токенизатор: {args.tokenizer or 'оценка по символам'}"
+    )
+    print(f"{'шаг окна':>9} {'попаданий':>10} {'промахов':>9} {'доля':>6} {'префилл, ток.':>14} {'строк истории':>14}")
+    for step in args.steps:
+        hits, misses, prefilled, mean_window, max_window = simulate(args, step)
+        rate = hits / (hits + misses) if hits + misses else 0.0
+        print(
+            f"{step:>9} {hits:>10} {misses:>9} {rate:>6.0%} {prefilled:>14.0f} "
+            f"{mean_window:>9.1f} (до {max_window})"
+        )
+
+
+if __name__ == "__main__":
+    main()
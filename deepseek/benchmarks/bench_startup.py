@@ -0,0 +1,104 @@
+"""
+Бенчмарк запуска бота: время от старта процесса до первого ответа на /start
+и до первого ответа модели при прежней загрузке модели до опроса Telegram (eager)
+и при фоновой загрузке (lazy). Telegram подменяется сессией без сети, база — временной.
+
+Запуск из каталога deepseek:
+    python benchmarks/bench_startup.py [--backend transformers] [--model Qwen/Qwen2.5-0.5B-Instruct]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+STARTED = time.perf_counter()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+USER_ID = 1001
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default="transformers")
+    parser.add_argument("--model", default="Qwen/Qwen2.5-0.5B-Instruct")
+    parser.add_argument("--mode", choices=("eager", "lazy"), help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+async def run_bot(mode):
+    from aiogram import Bot, Dispatcher
+    from aiogram.fsm.storage.memory import MemoryStorage
+
+    from fake_telegram import RecordingSession, make_update
+    from handlers import register_handlers
+    from main import on_shutdown, on_startup
+    from model_handler import model_handler
+
+    if mode == "eager":
+        # Как раньше: модель загружается при импорте, до начала опроса
+        model_handler.load()
+
+    session = RecordingSession()
+    bot = Bot(token="42:benchmark", session=session)
+    dp = Dispatcher(storage=MemoryStorage())
+    register_handlers(dp)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    polling = time.perf_counter()
+
+    await dp.feed_update(bot, make_update(1, USER_ID, "/start"))
+    first_reply = session.messages_to(USER_ID)[0][0]
+    await dp.feed_update(bot, make_update(2, USER_ID + 1, "Приказываю строить храм богу солнца."))
+    model_reply = session.messages_to(USER_ID + 1)[-1][0]
+    await dp.emit_shutdown(bot=bot, dispatcher=dp)
+
+    return {
+        "polling": polling - STARTED,
+        "first_reply": first_reply - STARTED,
+        "model_reply": model_reply - STARTED,
+        "load": model_handler.load_seconds,
+    }
+
+
+def run_child(args):
+    import asyncio
+
+    # База — во временном каталоге, чтобы не трогать chats.db игры
+    os.chdir(tempfile.mkdtemp())
+    print(json.dumps(asyncio.run(run_bot(args.mode))))
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("BOT_TOKEN", "benchmark")
+    os.environ["MODEL_NAME"] = args.model
+    os.environ["INFERENCE_BACKEND"] = args.backend
+    if args.mode:
+        run_child(args)
+        return
+
+    print(f"Бэкенд: {args.backend}, модель: {args.model}")
+    for mode in ("eager", "lazy"):
+        # Каждый режим — в отдельном процессе, чтобы мерить холодный старт
+        output = subprocess.run(
+            [sys.executable, __file__, "--backend", args.backend, "--model", args.model, "--mode", mode],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        timings = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{mode:5}: опрос с {timings['polling']:.2f} с, ответ на /start через {timings['first_reply']:.2f} с, "
+            f"ответ модели через {timings['model_reply']:.2f} с (загрузка {timings['load']:.2f} с)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Telegram без сети для бенчмарков: сессия aiogram, которая запоминает вызовы API
+и отвечает правдоподобными объектами, и сборка входящих апдейтов.
+"""
+
+import asyncio
+import time
+from datetime import datetime
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageText, SendMessage
+from aiogram.types import Chat, Message, Update, User
+
+
+class RecordingSession(BaseSession):
+    """
+    Сессия бота без сети. calls — список (время perf_counter, метод API) в порядке вызова.
+    errors — сбои по чатам: {chat_id: [фабрика исключения от метода, ...]}; каждый запрос в чат
+    забирает очередную фабрику и падает с её исключением, пока список не опустеет.
+    """
+
+    def __init__(self, latency: float = 0.0, errors=None):
+        super().__init__()
+        self.latency = latency
+        self.errors = errors or {}
+        self.calls = []
+        self._message_id = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls.append((time.perf_counter(), method))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        failures = self.errors.get(getattr(method, "chat_id", None))
+        if failures:
+            raise failures.pop(0)(method)
+        if isinstance(method, (SendMessage, EditMessageText)):
+            self._message_id += 1
+            return Message(
+                message_id=method.message_id if isinstance(method, EditMessageText) else self._message_id,
+                date=datetime.now(),
+                chat=Chat(id=method.chat_id, type="private"),
+                text=method.text,
+            ).as_(bot)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        raise NotImplementedError
+        yield b""
+
+    async def close(self):
+        pass
+
+    def messages_to(self, chat_id):
+        """
+        Отправленные и отредактированные сообщения в чат: список (время, текст).
+        """
+        return [
+            (at, method.text)
+            for at, method in self.calls
+            if isinstance(method, (SendMessage, EditMessageText)) and method.chat_id == chat_id
+        ]
+
+
+def make_update(update_id: int, user_id: int, text: str) -> Update:
+    """
+    Входящее текстовое сообщение игрока user_id в личном чате.
+    """
+    return Update(
+        update_id=update_id,
+        message=Message(
+            message_id=update_id,
+            date=datetime.now(),
+            chat=Chat(id=user_id, type="private"),
+            from_user=User(id=user_id, is_bot=False, first_name=f"Игрок {user_id}"),
+            text=text,
+        ),
+    )
@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from config import BROADCAST_CHAT_RATE, BROADCAST_CONCURRENCY, BROADCAST_RATE, BROADCAST_RETRIES
+from utils import split_long_message
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты: не больше rate событий в секунду в среднем и не больше capacity подряд.
+    По умолчанию capacity = 1: события идут ровно, и ни в одно окно в секунду их не попадает больше rate.
+    pause() останавливает выдачу на заданное время (Telegram ответил RetryAfter).
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.resume_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.resume_at:
+                    await asyncio.sleep(self.resume_at - now)
+                    self.updated = time.monotonic()
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class DeliveryReport:
+    """
+    Итог рассылки: кому доставлено (sent), кто заблокировал бота или недоступен (blocked),
+    кому не удалось отправить по другой причине (failed, с текстом ошибки в errors).
+    Чат, получивший часть длинного текста, попадает в partial (ошибка тоже в errors): часть текста
+    игрок уже прочитал, поэтому он считается получателем в delivered.
+    """
+
+    def __init__(self):
+        self.sent = []
+        self.partial = []
+        self.blocked = []
+        self.failed = []
+        self.errors = {}
+        self.retries = 0
+        self.seconds = 0.0
+
+    @property
+    def delivered(self) -> list:
+        """
+        Чаты, которым дошло хотя бы одно сообщение рассылки.
+        """
+        return self.sent + self.partial
+
+    def summary(self) -> str:
+        """
+        Отчёт для чата администратора.
+        """
+        lines = [
+            f"Доставлено: {len(self.sent)}, бот заблокирован: {len(self.blocked)}, ошибок: {len(self.failed)} "
+            f"(повторов {self.retries}, {self.seconds:.1f} с)"
+        ]
+        if self.partial:
+            lines[0] += f", доставлено не полностью: {len(self.partial)}"
+        problems = self.partial + self.failed
+        for chat_id in problems[:10]:
+            lines.append(f"{chat_id}: {self.errors[chat_id]}")
+        if len(problems) > 10:
+            lines.append(f"…и ещё {len(problems) - 10}")
+        return "\n".join(lines)
+
+
+class Broadcaster:
+    """
+    Рассылка одного текста многим чатам.
+    Отправляет одновременно не больше concurrency сообщений, держит общий лимит rate сообщений в секунду
+    и лимит chat_rate на каждый чат (длинный текст уходит несколькими сообщениями).
+    На RetryAfter приостанавливает всю рассылку на указанное Telegram время, сетевые ошибки
+    и ошибки сервера повторяет до retries раз с растущей паузой. Ошибку разметки HTML
+    исправляет повторной отправкой без форматирования, как send_html.
+    """
+
+    def __init__(
+        self,
+        bot,
+        concurrency: int = BROADCAST_CONCURRENCY,
+        rate: float = BROADCAST_RATE,
+        chat_rate: float = BROADCAST_CHAT_RATE,
+        retries: int = BROADCAST_RETRIES,
+        backoff: float = 1.0,
+    ):
+        self.bot = bot
+        self.concurrency = max(1, concurrency)
+        self.limiter = TokenBucket(rate)
+        self.chat_rate = chat_rate
+        self.retries = retries
+        self.backoff = backoff
+        self._chat_limiters = {}
+
+    async def send(self, chat_ids, text: str, parse_mode: str = "HTML") -> DeliveryReport:
+        report = DeliveryReport()
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        parts = split_long_message(text)
+
+        async def deliver(chat_id):
+            async with semaphore:
+                for index, part in enumerate(parts):
+                    status, error = await self._send_part(chat_id, part, parse_mode, report)
+                    if status != "sent":
+                        # Первые части уже у игрока: такой чат не путается с недоставленными
+                        getattr(report, "partial" if index else status).append(chat_id)
+                        report.errors[chat_id] = error
+                        return
+                report.sent.append(chat_id)
+
+        await asyncio.gather(*(deliver(chat_id) for chat_id in chat_ids))
+        report.seconds = time.perf_counter() - started
+        logger.info(f"Рассылка на {len(chat_ids)} чатов: {report.summary()}")
+        return report
+
+    async def _send_part(self, chat_id, part: str, parse_mode, report: DeliveryReport):
+        """
+        Отправляет одно сообщение. Возвращает (статус, текст ошибки), статус — sent, blocked или failed.
+        """
+        chat_limiter = self._chat_limiters.setdefault(chat_id, TokenBucket(self.chat_rate))
+        attempt = 0
+        while True:
+            await chat_limiter.acquire()
+            await self.limiter.acquire()
+            try:
+                await self.bot.send_message(chat_id, part, parse_mode=parse_mode)
+                return "sent", None
+            except TelegramRetryAfter as e:
+                logger.warning(f"Telegram просит подождать {e.retry_after} с, рассылка приостановлена")
+                self.limiter.pause(e.retry_after)
+                error = str(e)
+            except TelegramForbiddenError as e:
+                return "blocked", str(e)
+            except TelegramBadRequest as e:
+                if "chat not found" in e.message:
+                    return "blocked", str(e)
+                if parse_mode is None or "can't parse entities" not in e.message:
+                    return "failed", str(e)
+                logger.warning(f"Не удалось отправить сообщение в HTML: {str(e)}. Пробуем без форматирования.")
+                parse_mode = None
+                continue
+            except (TelegramNetworkError, TelegramServerError) as e:
+                await asyncio.sleep(self.backoff * 2**attempt)
+                error = str(e)
+            except Exception as e:
+                logger.exception(f"Ошибка рассылки в чат {chat_id}")
+                return "failed", str(e)
+            attempt += 1
+            if attempt > self.retries:
+                return "failed", error
+            report.retries += 1
+
+
+async def broadcast(bot, chat_ids, text: str, parse_mode: str = "HTML") -> DeliveryReport:
+    """
+    Рассылает text во все чаты chat_ids с настройками из config и возвращает отчёт о доставке.
+    """
+    return await Broadcaster(bot).send(chat_ids, text, parse_mode)
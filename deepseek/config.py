@@ -10,13 +10,129 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 # ID чата администратора (целое число)
 ADMIN_CHAT_ID = int(os.getenv("ADMIN_CHAT_ID", 0))
 
+# База данных игры: путь к файлу SQLite, число постоянных соединений в пуле,
+# режим synchronous (NORMAL в WAL не делает fsync на каждый commit) и размер кэша подготовленных выражений
+DB_PATH = os.getenv("DB_PATH", "chats.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 4))
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_CACHED_STATEMENTS = int(os.getenv("DB_CACHED_STATEMENTS", 256))
+
+# Состояния FSM (незаконченные регистрация, послание, правка аспекта) хранятся в базе игры:
+# через сколько секунд без изменений состояние забывается и как часто изменения пишутся на диск
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", 7 * 24 * 3600))
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", 1))
+
+# Рассылки администратора всем странам: сколько сообщений отправлять одновременно,
+# общий лимит сообщений в секунду (у Telegram около 30) и лимит на один чат,
+# сколько раз повторять отправку при сетевых ошибках и ошибках сервера Telegram
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 16))
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25))
+BROADCAST_CHAT_RATE = float(os.getenv("BROADCAST_CHAT_RATE", 1))
+BROADCAST_RETRIES = int(os.getenv("BROADCAST_RETRIES", 3))
+
 # Лимит истории сообщений для диалога с ИИ
 HISTORY_LIMIT = int(os.getenv("HISTORY_LIMIT", 4))
+# Окно истории сдвигается не на каждом ходу, а скачками по HISTORY_WINDOW_STEP строк: между скачками
+# история в промпте только растёт (от HISTORY_LIMIT до HISTORY_LIMIT + HISTORY_WINDOW_STEP - 1 строк)
+# и KV-кэш диалога игрока продолжает прошлый ход. Цена — до HISTORY_WINDOW_STEP - 1 лишних строк
+# в каждом промпте: они занимают бюджет PROMPT_HISTORY_TOKENS и при нехватке места снова обрезаются.
+# По умолчанию 1 — окно сдвигается на каждом ходу, как раньше; больше — только для локальной модели с KV-кэшем
+HISTORY_WINDOW_STEP = max(1, int(os.getenv("HISTORY_WINDOW_STEP", 1)))
 
 # Максимальное количество новых токенов для длинных и коротких ответов модели
 MAX_NEW_TOKENS = int(os.getenv("MAX_NEW_TOKENS", 512))
 SHORT_NEW_TOKENS = int(os.getenv("SHORT_NEW_TOKENS", 250))
 
+# Модель для генерации ответов
+MODEL_NAME = os.getenv("MODEL_NAME", "deepseek-ai/DeepSeek-R1-Distill-Qwen-32B")
+
+# Бэкенд генерации: transformers (модель в процессе бота), openai (внешний OpenAI-совместимый
+# сервер, например vLLM или llama.cpp) или fake (детерминированная заглушка для нагрузочных тестов)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "transformers")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "http://localhost:8000/v1")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "EMPTY")
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 600))
+# Задержки заглушки: на одно слово ответа (в миллисекундах) и на «загрузку модели» (в секундах)
+FAKE_TOKEN_DELAY_MS = int(os.getenv("FAKE_TOKEN_DELAY_MS", 20))
+FAKE_LOAD_SECONDS = float(os.getenv("FAKE_LOAD_SECONDS", 0))
+
+# Пакетный инференс: сколько запросов склеивать в один model.generate
+# и сколько миллисекунд ждать попутчиков для неполной пачки
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", 8))
+INFERENCE_MAX_WAIT_MS = int(os.getenv("INFERENCE_MAX_WAIT_MS", 50))
+
+# Приоритеты очереди инференса (ход игрока > событие > аспект регистрации > фоновая работа):
+# через сколько секунд ожидания запрос поднимается на один класс и сколько запросов класса
+# может быть в одной пачке (формат "класс:число,..."; класс без лимита занимает всю пачку)
+INFERENCE_AGING_SECONDS = float(os.getenv("INFERENCE_AGING_SECONDS", 30))
+INFERENCE_CLASS_LIMITS = {
+    name: int(limit)
+    for name, limit in (
+        item.split(":") for item in os.getenv("INFERENCE_CLASS_LIMITS", "background:2").split(",") if item
+    )
+}
+
+# Кэш KV-состояний общих префиксов промптов: бюджет памяти в мегабайтах
+# и нужно ли кэшировать блок с описанием страны каждого игрока
+PREFIX_CACHE_MAX_MB = int(os.getenv("PREFIX_CACHE_MAX_MB", 2048))
+PREFIX_CACHE_COUNTRY_BLOCKS = os.getenv("PREFIX_CACHE_COUNTRY_BLOCKS", "1") == "1"
+
+# KV-кэш диалогов игроков между ходами: общий бюджет памяти в мегабайтах
+SESSION_CACHE_MAX_MB = int(os.getenv("SESSION_CACHE_MAX_MB", 4096))
+
+# Потоковая выдача ответов: включена ли, как часто (в секундах) править сообщение
+# и скрывать ли текст до </think> (модель с рассуждениями)
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "1") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", 1.5))
+STREAM_WAIT_FOR_THINK = os.getenv("STREAM_WAIT_FOR_THINK", "1") == "1"
+
+# Ходы игрока: пока генерируется ответ, в следующий ход копится не больше TURN_MAX_PENDING сообщений;
+# после ответа ход ждёт паузы в TURN_DEBOUNCE_MS миллисекунд, сообщение свободного игрока не ждёт
+TURN_DEBOUNCE_MS = int(os.getenv("TURN_DEBOUNCE_MS", 250))
+TURN_MAX_PENDING = int(os.getenv("TURN_MAX_PENDING", 3))
+
+# Досрочно останавливать генерацию, когда модель начинает выдумывать реплики игрока
+EARLY_STOP = os.getenv("EARLY_STOP", "1") == "1"
+
+# Контекст RAG: сколько самых весомых аспектов сообщения брать, минимальный вес аспекта
+# (одно совпадение основы — 1) и бюджет контекста в токенах
+RAG_TOP_ASPECTS = int(os.getenv("RAG_TOP_ASPECTS", 2))
+RAG_MIN_ASPECT_SCORE = float(os.getenv("RAG_MIN_ASPECT_SCORE", 1))
+RAG_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", 1024))
+
+# Семантический поиск для контекста RAG: режим (keywords — только ключевые слова, semantic — ещё и
+# ближайшие по смыслу описания, аспекты и ходы летописи), сколько находок добавлять, минимальное
+# косинусное сходство и бюджет времени на поиск в миллисекундах (не успел — контекст без находок)
+RAG_MODE = os.getenv("RAG_MODE", "semantic")
+RAG_SEMANTIC_TOP_K = int(os.getenv("RAG_SEMANTIC_TOP_K", 3))
+RAG_SEMANTIC_MIN_SCORE = float(os.getenv("RAG_SEMANTIC_MIN_SCORE", 0.15))
+RAG_SEMANTIC_TIMEOUT_MS = int(os.getenv("RAG_SEMANTIC_TIMEOUT_MS", 50))
+
+# Векторный индекс для семантического поиска: файл, модель предложений для CPU (пусто — хэширование
+# слов и триграмм без модели), размерность хэширующих векторов, сколько последних ходов каждого игрока
+# индексировать и раз во сколько секунд сохранять индекс на диск
+SEMANTIC_INDEX_PATH = os.getenv("SEMANTIC_INDEX_PATH", "semantic_index.npz")
+SEMANTIC_MODEL = os.getenv("SEMANTIC_MODEL", "")
+SEMANTIC_INDEX_DIM = int(os.getenv("SEMANTIC_INDEX_DIM", 512))
+SEMANTIC_TURNS_PER_USER = int(os.getenv("SEMANTIC_TURNS_PER_USER", 100))
+SEMANTIC_INDEX_SAVE_INTERVAL = float(os.getenv("SEMANTIC_INDEX_SAVE_INTERVAL", 60))
+
+# Бюджет промпта диалога в токенах: всего, на описание страны и на историю (RAG — RAG_CONTEXT_TOKENS);
+# токенизатор для подсчёта (пусто — оценка по символам) и сколько длин строк кэшировать
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", 4096))
+PROMPT_COUNTRY_TOKENS = int(os.getenv("PROMPT_COUNTRY_TOKENS", 512))
+PROMPT_HISTORY_TOKENS = int(os.getenv("PROMPT_HISTORY_TOKENS", 2048))
+PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER", "" if INFERENCE_BACKEND == "fake" else MODEL_NAME)
+PROMPT_TOKEN_CACHE_SIZE = int(os.getenv("PROMPT_TOKEN_CACHE_SIZE", 4096))
+
+# HTTP-эндпоинт метрик в формате Prometheus (/metrics): адрес и порт, 0 — не запускать
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9108))
+
+# Файл с дополнительными запрещёнными корнями современных слов (по одному в строке);
+# изменения подхватываются без перезапуска
+MODERN_WORDS_FILE = os.getenv("MODERN_WORDS_FILE", "modern_words.txt")
+
 # Базовые игровые промпты
 GAME_PROMPT = (
     "Ты — мудрый летописец и повелитель судеб в великой хронике стран древнего мира. "
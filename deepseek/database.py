@@ -1,10 +1,13 @@
+import logging
 import random
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
-import aiosqlite
-
-from config import HISTORY_LIMIT
+from config import HISTORY_LIMIT, HISTORY_WINDOW_STEP
+from db_pool import db_pool
 from game import ASPECTS
+from metrics import DB_QUERY_SECONDS, instrument_module
+from semantic_index import semantic_index
+from world_state import WorldState, world_state
 
 ASPECT_CODES = [
     "экономика",
@@ -19,16 +22,11 @@ ASPECT_CODES = [
 ]
 # Если меняется порядок или список аспектов — поправь оба файла
 
+logger = logging.getLogger(__name__)
+
 
 async def init_db():
-    async with aiosqlite.connect("chats.db") as db:
-        # Таблица для истории чатов
-        await db.execute(
-            """CREATE TABLE IF NOT EXISTS chats (
-                user_id INTEGER PRIMARY KEY,
-                history TEXT
-            )"""
-        )
+    async with db_pool.acquire() as db:
         # Таблица для пользователя и описания страны
         await db.execute(
             f"""CREATE TABLE IF NOT EXISTS user_states (
@@ -48,97 +46,361 @@ async def init_db():
             """
         )
         await db.commit()
+        # Существующая база (в том числе chats.db старых версий) обновляется на месте
+        await migrate(db)
+    # Мир в памяти перечитается из обновлённой базы
+    world_state.invalidate()
+
+
+def country_key(name: str) -> str:
+    """
+    Ключ для поиска страны или синонима без учёта регистра. Считается в Python:
+    LOWER() и COLLATE NOCASE в SQLite приводят к нижнему регистру только латиницу.
+    """
+    return name.strip().lower()
+
+
+async def _migration_country_keys(db):
+    """
+    Нормализованные ключи стран с индексами, реестр стран countries
+    и внешний ключ синонимов на него.
+    """
+    await db.execute("ALTER TABLE user_states ADD COLUMN country_key TEXT")
+    async with db.execute("SELECT user_id, country FROM user_states WHERE country IS NOT NULL") as cursor:
+        states = await cursor.fetchall()
+    await db.executemany(
+        "UPDATE user_states SET country_key = ? WHERE user_id = ?", [(country_key(c), uid) for uid, c in states]
+    )
+    await db.execute("CREATE INDEX idx_user_states_country_key ON user_states (country_key)")
+
+    await db.execute("CREATE TABLE countries (country_key TEXT PRIMARY KEY, name TEXT NOT NULL)")
+    async with db.execute(
+        "SELECT country, synonym FROM country_synonyms WHERE country <> '' AND synonym <> ''"
+    ) as cursor:
+        synonyms = await cursor.fetchall()
+    # Синонимы бывают и у неактивных стран; названия действующих стран перекрывают их написание
+    await db.executemany(
+        "INSERT OR REPLACE INTO countries (country_key, name) VALUES (?, ?)",
+        [(country_key(c), c.strip()) for c, _ in synonyms] + [(country_key(c), c.strip()) for _, c in states],
+    )
+
+    await db.execute("DROP TABLE country_synonyms")
+    await db.execute("""CREATE TABLE country_synonyms (
+            synonym_key TEXT PRIMARY KEY,
+            synonym TEXT NOT NULL,
+            country_key TEXT NOT NULL REFERENCES countries (country_key) ON DELETE CASCADE
+        )""")
+    await db.execute("CREATE INDEX idx_country_synonyms_country_key ON country_synonyms (country_key)")
+    await db.executemany(
+        "INSERT OR IGNORE INTO country_synonyms (synonym_key, synonym, country_key) VALUES (?, ?, ?)",
+        [(country_key(syn), syn.strip(), country_key(c)) for c, syn in synonyms],
+    )
+
+
+async def _migration_turns(db):
+    """
+    Летопись ходов turns вместо JSON-истории в chats: новый ход дописывается одной строкой,
+    старые ходы не выбрасываются. История из chats переносится, сама таблица удаляется.
+    """
+    await db.execute(
+        """CREATE TABLE turns (
+            user_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            text TEXT NOT NULL,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, seq)
+        )"""
+    )
+    # Сбросы истории (/new) редки: частичный индекс находит последний без просмотра всех ходов
+    await db.execute("CREATE INDEX idx_turns_resets ON turns (user_id, seq) WHERE role = 'reset'")
+
+    async with db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chats'") as cursor:
+        if await cursor.fetchone() is None:
+            return
+    async with db.execute("SELECT user_id, history FROM chats") as cursor:
+        chats = await cursor.fetchall()
+    await db.executemany(
+        "INSERT INTO turns (user_id, seq, role, text) VALUES (?, ?, ?, ?)",
+        [
+            (user_id, seq, *_parse_history_line(line))
+            for user_id, history in chats
+            for seq, line in enumerate(json.loads(history or "[]"), start=1)
+        ],
+    )
+    await db.execute("DROP TABLE chats")
+
+
+async def _migration_fsm_states(db):
+    """
+    Состояния FSM aiogram (fsm_storage.SQLiteStorage): незаконченные диалоги переживают перезапуск бота.
+    """
+    await db.execute(
+        """CREATE TABLE fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL
+        )"""
+    )
+    # Истёкшие записи удаляются по времени последнего изменения
+    await db.execute("CREATE INDEX idx_fsm_states_updated_at ON fsm_states (updated_at)")
+
+
+# Миграции схемы по порядку; номер применённой хранится в PRAGMA user_version.
+# Новые миграции только дописываются в конец
+MIGRATIONS = [_migration_country_keys, _migration_turns, _migration_fsm_states]
+
+
+async def migrate(db):
+    """
+    Применяет к базе недостающие миграции, каждую в своей транзакции.
+    """
+    async with db.execute("PRAGMA user_version") as cursor:
+        version = (await cursor.fetchone())[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        logger.info(f"Миграция базы {number}: {migration.__name__}")
+        await db.execute("BEGIN")
+        try:
+            await migration(db)
+            await db.execute(f"PRAGMA user_version = {number}")
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
 
 
 # ==== История чатов ====
 
 import json
 
+# Подписчики на сброс истории пользователя (например, KV-кэш диалогов в model_handler)
+_history_invalidation_listeners = []
 
-async def get_history(user_id: int) -> List[str]:
-    async with aiosqlite.connect("chats.db") as db:
-        async with db.execute("SELECT history FROM chats WHERE user_id = ?", (user_id,)) as cursor:
-            result = await cursor.fetchone()
-            return json.loads(result[0]) if result else []
 
+def on_history_invalidated(callback):
+    """
+    Регистрирует callback(user_id), который вызывается, когда история пользователя
+    очищена или её окно в промпте сдвинулось.
+    """
+    _history_invalidation_listeners.append(callback)
 
-async def update_history(user_id: int, message: str, response: str, history_limit: int):
-    history = await get_history(user_id)
-    history.extend([f"Игрок: {message}", f"Ассистент: {response}"])
-    history = history[-history_limit:]
 
-    async with aiosqlite.connect("chats.db") as db:
-        await db.execute(
-            "INSERT OR REPLACE INTO chats (user_id, history) VALUES (?, ?)", (user_id, json.dumps(history))
-        )
+def _notify_history_invalidated(user_id: int):
+    for callback in _history_invalidation_listeners:
+        callback(user_id)
+
+
+# Роли ходов в летописи и их подписи в истории для промпта; reset отмечает сброс истории
+TURN_PREFIXES = {"player": "Игрок", "assistant": "Ассистент", "event": "Ассистент"}
+
+
+def _parse_history_line(line: str):
+    for role in ("player", "assistant"):
+        prefix = f"{TURN_PREFIXES[role]}: "
+        if line.startswith(prefix):
+            return role, line[len(prefix) :]
+    return "assistant", line
+
+
+async def _last_seq(db, user_id: int) -> int:
+    # Последний ход пользователя — по первичному ключу (user_id, seq), без просмотра летописи
+    async with db.execute("SELECT COALESCE(MAX(seq), 0) FROM turns WHERE user_id = ?", (user_id,)) as cursor:
+        return (await cursor.fetchone())[0]
+
+
+async def _reset_seq(db, user_id: int) -> int:
+    # Последний сброс — по частичному индексу idx_turns_resets
+    async with db.execute(
+        "SELECT COALESCE(MAX(seq), 0) FROM turns WHERE user_id = ? AND role = 'reset'", (user_id,)
+    ) as cursor:
+        return (await cursor.fetchone())[0]
+
+
+async def _append_turns(db, user_id: int, turns) -> Tuple[int, int]:
+    """
+    Дописывает ходы (role, text) в летопись пользователя (без commit).
+    Возвращает seq последнего дописанного хода и сколько ходов теперь в истории после последнего сброса.
+    """
+    last_seq = await _last_seq(db, user_id)
+    await db.executemany(
+        "INSERT INTO turns (user_id, seq, role, text) VALUES (?, ?, ?, ?)",
+        [(user_id, last_seq + i, role, text) for i, (role, text) in enumerate(turns, start=1)],
+    )
+    return last_seq + len(turns), last_seq + len(turns) - await _reset_seq(db, user_id)
+
+
+def _index_turns(user_id: int, last_seq: int, turns):
+    """
+    Дописанные ходы (role, text), последний из которых получил seq last_seq, — в семантический индекс.
+    """
+    semantic_index.submit(
+        semantic_index.upsert_many,
+        [
+            (f"turn:{user_id}:{seq}", user_id, "ход", text, {"seq": seq, "role": role})
+            for seq, (role, text) in enumerate(turns, start=last_seq - len(turns) + 1)
+        ],
+    )
+
+
+def history_window_start(count: int, history_limit: int = HISTORY_LIMIT, step: int = HISTORY_WINDOW_STEP) -> int:
+    """
+    Сколько первых из count строк истории (после сброса) не попадает в промпт. Окно сдвигается скачками
+    по step строк, так что в промпте от history_limit до history_limit + step - 1 последних строк.
+    """
+    if count <= history_limit:
+        return 0
+    return (count - history_limit) // step * step
+
+
+async def get_history(user_id: int, history_limit: int = HISTORY_LIMIT) -> List[str]:
+    """
+    Строки истории после последнего сброса, попадающие в окно history_window_start, от старых к новым.
+    """
+    async with db_pool.acquire() as db:
+        last_seq, reset_seq = await _last_seq(db, user_id), await _reset_seq(db, user_id)
+        start = reset_seq + history_window_start(last_seq - reset_seq, history_limit)
+        async with db.execute(
+            "SELECT role, text FROM turns WHERE user_id = ? AND seq > ? ORDER BY seq", (user_id, start)
+        ) as cursor:
+            rows = await cursor.fetchall()
+    return [f"{TURN_PREFIXES[role]}: {text}" for role, text in rows]
+
+
+def _notify_if_window_moved(user_id: int, count: int, added: int, history_limit: int = HISTORY_LIMIT):
+    # Пока окно истории не сдвинулось, новые строки лишь продолжают промпт и KV-кэш диалога годен
+    if history_window_start(count, history_limit) != history_window_start(count - added, history_limit):
+        _notify_history_invalidated(user_id)
+
+
+async def update_history(user_id: int, message: str, response: str, history_limit: int):
+    async with db_pool.acquire() as db:
+        turns = [("player", message), ("assistant", response)]
+        last_seq, count = await _append_turns(db, user_id, turns)
         await db.commit()
+    _index_turns(user_id, last_seq, turns)
+    _notify_if_window_moved(user_id, count, len(turns), history_limit)
 
 
 async def add_event_to_history(user_id: int, event_text: str, history_limit: int = HISTORY_LIMIT):
     """
     Добавляет событие в историю пользователя.
     """
-    # Получаем текущую историю через уже существующую функцию
-    history = await get_history(user_id)
-    history.append(f"Ассистент: {event_text}")
-    history = history[-history_limit:]
+    async with db_pool.acquire() as db:
+        last_seq, count = await _append_turns(db, user_id, [("event", event_text)])
+        await db.commit()
+    _index_turns(user_id, last_seq, [("event", event_text)])
+    _notify_if_window_moved(user_id, count, 1, history_limit)
 
-    async with aiosqlite.connect("chats.db") as db:
-        await db.execute(
-            "INSERT OR REPLACE INTO chats (user_id, history) VALUES (?, ?)", (user_id, json.dumps(history))
+
+async def add_event_to_history_many(user_ids: List[int], event_text: str):
+    """
+    Добавляет одно событие в историю сразу нескольких пользователей одной транзакцией.
+    """
+    if not user_ids:
+        return
+    async with db_pool.acquire() as db:
+        await db.executemany(
+            """INSERT INTO turns (user_id, seq, role, text)
+               VALUES (?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM turns WHERE user_id = ?), 'event', ?)""",
+            [(user_id, user_id, event_text) for user_id in user_ids],
         )
         await db.commit()
+        # Два поиска по индексам на игрока вместо агрегата по всей летописи получателей
+        last_seqs = [(user_id, await _last_seq(db, user_id), await _reset_seq(db, user_id)) for user_id in user_ids]
+    for user_id, last_seq, reset_seq in last_seqs:
+        _index_turns(user_id, last_seq, [("event", event_text)])
+        _notify_if_window_moved(user_id, last_seq - reset_seq, 1)
 
 
 async def add_event_to_history_all(event_text: str, history_limit: int = HISTORY_LIMIT):
     """
     Добавляет событие в историю всех активных стран (игроков).
     """
-    countries = await get_all_active_countries()
-    for row in countries:
-        user_id = row[0]
-        await add_event_to_history(user_id, event_text, history_limit)
+    async with db_pool.acquire() as db:
+        async with db.execute("SELECT user_id FROM user_states WHERE country IS NOT NULL") as cursor:
+            user_ids = [row[0] for row in await cursor.fetchall()]
+    await add_event_to_history_many(user_ids, event_text)
 
 
 async def clear_history(user_id: int):
-    async with aiosqlite.connect("chats.db") as db:
-        await db.execute("DELETE FROM chats WHERE user_id = ?", (user_id,))
+    """
+    Начинает историю заново. Прежние ходы остаются в летописи, но в промпт больше не попадают.
+    """
+    async with db_pool.acquire() as db:
+        await _append_turns(db, user_id, [("reset", "")])
         await db.commit()
+    # Для поиска по смыслу летопись тоже начинается заново
+    semantic_index.submit(semantic_index.remove_turns, user_id)
+    _notify_history_invalidated(user_id)
 
 
 # ==== Страна, описание, индекс аспекта ====
 
 
+async def _world() -> WorldState:
+    """
+    Мир игры в памяти; при первом обращении (или после invalidate) загружается из базы.
+    """
+    if world_state.loaded:
+        world_state.hits += 1
+        return world_state
+    world_state.misses += 1
+    while not world_state.loaded:
+        version = world_state.version
+        async with db_pool.acquire() as db:
+            async with db.execute(
+                f"SELECT user_id, country, country_key, country_desc, {', '.join(ASPECT_CODES)} FROM user_states"
+            ) as cursor:
+                users = {
+                    row[0]: dict(zip(["country", "country_key", "country_desc", *ASPECT_CODES], row[1:]))
+                    for row in await cursor.fetchall()
+                }
+            async with db.execute("SELECT country_key, name FROM countries") as cursor:
+                countries = dict(await cursor.fetchall())
+            async with db.execute("SELECT synonym_key, synonym, country_key FROM country_synonyms") as cursor:
+                synonyms = {skey: (synonym, key) for skey, synonym, key in await cursor.fetchall()}
+        world_state.install(version, users, countries, synonyms)
+    return world_state
+
+
 async def get_user_country(user_id: int) -> Optional[str]:
-    async with aiosqlite.connect("chats.db") as db:
-        async with db.execute("SELECT country FROM user_states WHERE user_id = ?", (user_id,)) as cursor:
-            result = await cursor.fetchone()
-            return result[0] if result else None
+    row = (await _world()).users.get(user_id)
+    return row["country"] if row else None
 
 
 async def set_user_country(user_id: int, country: Optional[str]):
-    async with aiosqlite.connect("chats.db") as db:
+    async with db_pool.acquire() as db:
         if country is None:
-            await db.execute("UPDATE user_states SET country = NULL WHERE user_id = ?", (user_id,))
+            await db.execute("UPDATE user_states SET country = NULL, country_key = NULL WHERE user_id = ?", (user_id,))
         else:
             await db.execute(
-                """INSERT INTO user_states (user_id, country)
+                """INSERT INTO countries (country_key, name)
                    VALUES (?, ?)
-                   ON CONFLICT(user_id) DO UPDATE SET country=excluded.country""",
-                (user_id, country),
+                   ON CONFLICT(country_key) DO UPDATE SET name=excluded.name""",
+                (country_key(country), country.strip()),
+            )
+            await db.execute(
+                """INSERT INTO user_states (user_id, country, country_key)
+                   VALUES (?, ?, ?)
+                   ON CONFLICT(user_id) DO UPDATE SET country=excluded.country, country_key=excluded.country_key""",
+                (user_id, country, country_key(country)),
             )
         await db.commit()
+    if country is None:
+        world_state.update_user(user_id, create=False, country=None, country_key=None)
+    else:
+        world_state.set_country_name(country_key(country), country.strip())
+        world_state.update_user(user_id, country=country, country_key=country_key(country))
 
 
 async def get_user_country_desc(user_id: int) -> Optional[str]:
-    async with aiosqlite.connect("chats.db") as db:
-        async with db.execute("SELECT country_desc FROM user_states WHERE user_id = ?", (user_id,)) as cursor:
-            result = await cursor.fetchone()
-            return result[0] if result else None
+    row = (await _world()).users.get(user_id)
+    return row["country_desc"] if row else None
 
 
 async def set_user_country_desc(user_id: int, country_desc: Optional[str]):
-    async with aiosqlite.connect("chats.db") as db:
+    async with db_pool.acquire() as db:
         if country_desc is None:
             await db.execute("UPDATE user_states SET country_desc = NULL WHERE user_id = ?", (user_id,))
         else:
@@ -149,18 +411,20 @@ async def set_user_country_desc(user_id: int, country_desc: Optional[str]):
                 (user_id, country_desc),
             )
         await db.commit()
+    world_state.update_user(user_id, create=country_desc is not None, country_desc=country_desc)
+    semantic_index.submit(semantic_index.upsert, f"desc:{user_id}", user_id, "описание", country_desc)
 
 
 # ==== Индекс текущего аспекта для опроса ====
 async def get_aspect_index(user_id: int) -> Optional[int]:
-    async with aiosqlite.connect("chats.db") as db:
+    async with db_pool.acquire() as db:
         async with db.execute("SELECT aspect_index FROM user_states WHERE user_id = ?", (user_id,)) as cursor:
             result = await cursor.fetchone()
             return result[0] if result and result[0] is not None else None
 
 
 async def set_aspect_index(user_id: int, index: Optional[int]):
-    async with aiosqlite.connect("chats.db") as db:
+    async with db_pool.acquire() as db:
         if index is None:
             await db.execute("UPDATE user_states SET aspect_index = NULL WHERE user_id = ?", (user_id,))
         else:
@@ -171,13 +435,15 @@ async def set_aspect_index(user_id: int, index: Optional[int]):
                 (user_id, index),
             )
         await db.commit()
+    # Сам индекс в памяти не хранится, но вставка создаёт строку игрока (важно для user_exists)
+    world_state.update_user(user_id, create=index is not None)
 
 
 # ==== Запись и чтение аспектов ====
 async def set_user_aspect(user_id: int, aspect_code: str, value: Optional[str]):
     if aspect_code not in ASPECT_CODES:
         raise ValueError(f"Недопустимый код аспекта: {aspect_code}")
-    async with aiosqlite.connect("chats.db") as db:
+    async with db_pool.acquire() as db:
         if value is None:
             await db.execute(f"UPDATE user_states SET {aspect_code} = NULL WHERE user_id = ?", (user_id,))
         else:
@@ -188,23 +454,26 @@ async def set_user_aspect(user_id: int, aspect_code: str, value: Optional[str]):
                 (user_id, value),
             )
         await db.commit()
+    world_state.update_user(user_id, create=value is not None, **{aspect_code: value})
+    semantic_index.submit(semantic_index.upsert, f"aspect:{user_id}:{aspect_code}", user_id, aspect_code, value)
 
 
 async def get_user_aspect(user_id: int, aspect_code: str) -> Optional[str]:
     if aspect_code not in ASPECT_CODES:
         raise ValueError(f"Недопустимый код аспекта: {aspect_code}")
-    async with aiosqlite.connect("chats.db") as db:
-        async with db.execute(f"SELECT {aspect_code} FROM user_states WHERE user_id = ?", (user_id,)) as cursor:
-            result = await cursor.fetchone()
-            return result[0] if result else None
+    row = (await _world()).users.get(user_id)
+    return row.get(aspect_code) if row else None
 
 
 async def clear_user_aspects(user_id: int):
-    async with aiosqlite.connect("chats.db") as db:
+    async with db_pool.acquire() as db:
         # Сбросить все аспекты пользователя (кроме country и country_desc)
         columns = ", ".join([f"{a} = NULL" for a in ASPECT_CODES] + ["aspect_index = NULL"])
         await db.execute(f"UPDATE user_states SET {columns} WHERE user_id = ?", (user_id,))
         await db.commit()
+    world_state.update_user(user_id, create=False, **dict.fromkeys(ASPECT_CODES))
+    for aspect_code in ASPECT_CODES:
+        semantic_index.submit(semantic_index.remove, f"aspect:{user_id}:{aspect_code}")
 
 
 # ==== Получить всех игроков ====
@@ -213,117 +482,82 @@ async def get_all_active_countries():
     Возвращает список кортежей:
     (user_id, country, country_desc, экономика, военное_дело, ..., общество)
     """
-    async with aiosqlite.connect("chats.db") as db:
-        async with db.execute(
-            f"""SELECT user_id, country, country_desc,
-                {", ".join(ASPECT_CODES)}
-                FROM user_states
-                WHERE country IS NOT NULL
-            """
-        ) as cursor:
-            countries = await cursor.fetchall()
-            return countries
+    return [
+        (uid, row["country"], row["country_desc"], *(row.get(a) for a in ASPECT_CODES))
+        for uid, row in (await _world()).active()
+    ]
 
 
 async def get_all_country_names():
     """
     Возвращает список названий всех стран (country) для активных пользователей.
     """
-    async with aiosqlite.connect("chats.db") as db:
-        async with db.execute("SELECT country FROM user_states WHERE country IS NOT NULL") as cursor:
-            rows = await cursor.fetchall()
-            # rows — список кортежей вроде [('Греция',), ('Египет',)]
-            return [row[0] for row in rows]
+    return [row["country"] for _, row in (await _world()).active()]
 
 
 async def get_user_id_by_country(country: str) -> Optional[int]:
-    country_name = await get_country_by_synonym_or_name(country)
-    if not country_name:
-        return None
-    async with aiosqlite.connect("chats.db") as db:
-        async with db.execute(
-            "SELECT user_id FROM user_states WHERE LOWER(country) = LOWER(?)", (country_name,)
-        ) as cursor:
-            result = await cursor.fetchone()
-            return result[0] if result else None
+    world = await _world()
+    key = country_key(country)
+    # Сначала синоним, иначе само название
+    synonym = world.synonyms.get(key)
+    return world.user_id_by_country_key(synonym[1] if synonym else key)
 
 
 async def get_country_name_by_user_id(user_id: int) -> Optional[str]:
-    async with aiosqlite.connect("chats.db") as db:
-        async with db.execute("SELECT country FROM user_states WHERE user_id = ?", (user_id,)) as cursor:
-            result = await cursor.fetchone()
-            return result[0] if result else None
+    return await get_user_country(user_id)
 
 
 async def get_random_country_name() -> Optional[str]:
-    async with aiosqlite.connect("chats.db") as db:
-        async with db.execute("SELECT country FROM user_states") as cursor:
-            countries = [row[0] for row in await cursor.fetchall() if row[0]]
+    countries = [name for name in await get_all_country_names() if name]
     if not countries:
         return None
     return random.choice(countries)
 
 
 async def user_exists(user_id: int) -> bool:
-    async with aiosqlite.connect("chats.db") as db:
-        async with db.execute("SELECT 1 FROM user_states WHERE user_id = ?", (user_id,)) as cursor:
-            return (await cursor.fetchone()) is not None
+    return user_id in (await _world()).users
 
 
 async def add_country_synonym(country: str, synonym: str):
-    async with aiosqlite.connect("chats.db") as db:
-        await db.execute("INSERT OR IGNORE INTO country_synonyms (country, synonym) VALUES (?, ?)", (country, synonym))
+    async with db_pool.acquire() as db:
+        await db.execute(
+            "INSERT OR IGNORE INTO countries (country_key, name) VALUES (?, ?)", (country_key(country), country.strip())
+        )
+        await db.execute(
+            "INSERT OR IGNORE INTO country_synonyms (synonym_key, synonym, country_key) VALUES (?, ?, ?)",
+            (country_key(synonym), synonym.strip(), country_key(country)),
+        )
         await db.commit()
+    world_state.set_country_name(country_key(country), country.strip(), replace=False)
+    world_state.add_synonym(country_key(synonym), synonym.strip(), country_key(country))
 
 
 async def get_country_by_synonym_or_name(name: str) -> Optional[str]:
-    async with aiosqlite.connect("chats.db") as db:
-        # Сначала ищем синоним
-        async with db.execute(
-            "SELECT country FROM country_synonyms WHERE LOWER(synonym) = LOWER(?)", (name,)
-        ) as cursor:
-            res = await cursor.fetchone()
-            if res:
-                return res[0]
-        # Если не найден, ищем среди официальных названий
-        async with db.execute("SELECT country FROM user_states WHERE LOWER(country) = LOWER(?)", (name,)) as cursor:
-            res = await cursor.fetchone()
-            if res:
-                return res[0]
-        return None
+    world = await _world()
+    key = country_key(name)
+    # Синоним важнее официального названия
+    synonym = world.synonyms.get(key)
+    if synonym:
+        return world.countries[synonym[1]]
+    user_id = world.user_id_by_country_key(key)
+    return world.users[user_id]["country"] if user_id is not None else None
 
 
 async def get_synonyms_for_country(country: str) -> List[str]:
-    async with aiosqlite.connect("chats.db") as db:
-        async with db.execute(
-            "SELECT synonym FROM country_synonyms WHERE LOWER(country) = LOWER(?)", (country,)
-        ) as cursor:
-            synonyms = await cursor.fetchall()
-            return [row[0] for row in synonyms]
+    key = country_key(country)
+    return [synonym for synonym, ckey in (await _world()).synonyms.values() if ckey == key]
 
 
 async def get_all_countries_and_synonyms():
     """
     Возвращает словарь: {country: [synonym1, synonym2, ...], ...}
     """
-    async with aiosqlite.connect("chats.db") as db:
-        # Получим список всех стран (их основное имя)
-        async with db.execute("SELECT country FROM user_states WHERE country IS NOT NULL") as cursor:
-            countries = [row[0] for row in await cursor.fetchall()]
-
-        # Получим все синонимы
-        async with db.execute("SELECT country, synonym FROM country_synonyms") as cursor:
-            synonyms = await cursor.fetchall()
-
-        # Группируем
-        country_to_synonyms = {c: [] for c in countries}
-        for country, synonym in synonyms:
-            if country in country_to_synonyms:
-                country_to_synonyms[country].append(synonym)
-            else:
-                # Иногда могут быть синонимы для неактивных стран
-                country_to_synonyms[country] = [synonym]
-        return country_to_synonyms
+    world = await _world()
+    country_to_synonyms = {name: [] for name in await get_all_country_names()}
+    for synonym, key in world.synonyms.values():
+        # Иногда могут быть синонимы для неактивных стран
+        country_to_synonyms.setdefault(world.countries[key], []).append(synonym)
+    return country_to_synonyms
 
 
 async def get_all_country_synonyms_and_names():
@@ -331,19 +565,16 @@ async def get_all_country_synonyms_and_names():
     Возвращает список кортежей (вариант_поиска, canonical_country_name),
     где вариант_поиска — это основное имя страны и все её синонимы (в lowercase, strip).
     """
-    async with aiosqlite.connect("chats.db") as db:
-        # Основные имена стран
-        async with db.execute("SELECT country FROM user_states WHERE country IS NOT NULL") as cursor:
-            mains = [row[0].strip() for row in await cursor.fetchall()]
-        # Синонимы
-        async with db.execute("SELECT synonym, country FROM country_synonyms") as cursor:
-            synonyms = [(row[0].strip(), row[1].strip()) for row in await cursor.fetchall()]
-        result = []
-        for main in mains:
-            result.append((main.lower(), main))  # основное имя
-        for syn, main in synonyms:
-            result.append((syn.lower(), main))  # синоним
-        return result
+    return list((await _world()).search_variants())
+
+
+async def find_country_mentions(text: str) -> List[Tuple[int, int, str]]:
+    """
+    Упоминания стран (по названиям и синонимам) в тексте в нижнем регистре:
+    список (начало, конец, название страны) по порядку в тексте.
+    """
+    world = await _world()
+    return [(start, end, world.countries[key]) for start, end, key in world.country_matcher().find_all(text)]
 
 
 async def get_all_user_country_descs():
@@ -351,10 +582,7 @@ async def get_all_user_country_descs():
     Возвращает словарь {country_name: description}
     Только для активных стран (country IS NOT NULL)
     """
-    async with aiosqlite.connect("chats.db") as db:
-        async with db.execute("SELECT country, country_desc FROM user_states WHERE country IS NOT NULL") as cursor:
-            rows = await cursor.fetchall()
-            return {row[0]: row[1] for row in rows}
+    return {row["country"]: row["country_desc"] for _, row in (await _world()).active()}
 
 
 async def get_all_user_aspect_values(aspect):
@@ -364,25 +592,67 @@ async def get_all_user_aspect_values(aspect):
     """
     if aspect not in [a[0] for a in ASPECTS]:
         raise ValueError("Недопустимый код аспекта")
-    async with aiosqlite.connect("chats.db") as db:
-        async with db.execute(f"SELECT country, {aspect} FROM user_states WHERE country IS NOT NULL") as cursor:
-            rows = await cursor.fetchall()
-            return {row[0]: row[1] for row in rows}
+    return {row["country"]: row.get(aspect) for _, row in (await _world()).active()}
 
 
 async def get_other_countries_descs(current_country):
-    async with aiosqlite.connect("chats.db") as db:
-        async with db.execute(
-            "SELECT country, country_desc FROM user_states WHERE country IS NOT NULL AND country <> ?",
-            (current_country,),
-        ) as cursor:
-            return [(row[0], row[1]) for row in await cursor.fetchall()]
+    return [
+        (row["country"], row["country_desc"])
+        for _, row in (await _world()).active()
+        if row["country"] != current_country
+    ]
 
 
 async def get_other_countries_aspect(current_country, aspect_code):
-    async with aiosqlite.connect("chats.db") as db:
+    return [
+        (row["country"], row.get(aspect_code))
+        for _, row in (await _world()).active()
+        if row["country"] != current_country
+    ]
+
+
+# ==== Семантический индекс ====
+
+
+async def sync_semantic_index():
+    """
+    Сверяет семантический индекс с базой: загружает сохранённый с диска, считает векторы только новых
+    и изменившихся текстов и удаляет документы, которых в базе больше нет. Вызывается при запуске после init_db.
+    Чтение файла и кодирование идут в потоке индекса.
+    """
+    await semantic_index.run(semantic_index.load)
+    docs = []
+    for user_id, row in (await _world()).users.items():
+        docs.append((f"desc:{user_id}", user_id, "описание", row.get("country_desc"), None))
+        docs.extend((f"aspect:{user_id}:{code}", user_id, code, row.get(code), None) for code in ASPECT_CODES)
+    async with db_pool.acquire() as db:
+        # Последние ходы каждого игрока после его последнего сброса истории
         async with db.execute(
-            f"SELECT country, {aspect_code} FROM user_states WHERE country IS NOT NULL AND country <> ?",
-            (current_country,),
+            """SELECT user_id, seq, role, text FROM (
+                   SELECT t.user_id, t.seq, t.role, t.text,
+                          ROW_NUMBER() OVER (PARTITION BY t.user_id ORDER BY t.seq DESC) AS age
+                   FROM turns t
+                   WHERE t.seq > (SELECT COALESCE(MAX(r.seq), 0) FROM turns r
+                                  WHERE r.user_id = t.user_id AND r.role = 'reset'))
+               WHERE age <= ?
+               ORDER BY user_id, seq""",
+            (semantic_index.turns_per_user,),
         ) as cursor:
-            return [(row[0], row[1]) for row in await cursor.fetchall()]
+            turns = await cursor.fetchall()
+    docs.extend(
+        (f"turn:{user_id}:{seq}", user_id, "ход", text, {"seq": seq, "role": role})
+        for user_id, seq, role, text in turns
+    )
+    current = {key for key, _, _, text, _ in docs if text and text.strip()}
+
+    def sync():
+        for key in [key for key in semantic_index.docs if key not in current]:
+            semantic_index.remove(key)
+        semantic_index.upsert_many(docs)
+        return semantic_index.stats()
+
+    logger.info(f"Семантический индекс сверен с базой: {await semantic_index.run(sync)}")
+
+
+# Время каждой функции базы — в гистограмме db_query_seconds с меткой function
+instrument_module(globals(), DB_QUERY_SECONDS, "function")
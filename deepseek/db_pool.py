@@ -0,0 +1,97 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+from config import DB_CACHED_STATEMENTS, DB_PATH, DB_POOL_SIZE, DB_SYNCHRONOUS
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """
+    Пул постоянных соединений aiosqlite с базой игры.
+    Соединения открываются один раз (при старте бота или при первом запросе) в режиме WAL:
+    читатели не ждут писателя, а synchronous=NORMAL не делает fsync на каждый commit.
+    Каждое соединение держит свой кэш подготовленных выражений (cached_statements),
+    поэтому повторяющиеся запросы не компилируются заново.
+    acquire() выдаёт соединение в монопольное пользование: транзакции разных корутин не смешиваются.
+    Пул привязан к event loop, в котором открыт; вызовы из другого loop (например, из скриптов
+    бенчмарков) получают отдельное одноразовое соединение.
+    """
+
+    def __init__(
+        self,
+        path: str = DB_PATH,
+        size: int = DB_POOL_SIZE,
+        synchronous: str = DB_SYNCHRONOUS,
+        cached_statements: int = DB_CACHED_STATEMENTS,
+    ):
+        self.path = path
+        self.size = max(1, size)
+        self.synchronous = synchronous
+        self.cached_statements = cached_statements
+        self._idle = None
+        self._loop = None
+        self._connections = []
+        self._open_lock = None
+
+    async def open(self):
+        """
+        Открывает все соединения пула. Повторный вызов ничего не делает.
+        """
+        if self._open_lock is None:
+            self._open_lock = asyncio.Lock()
+        async with self._open_lock:
+            if self._idle is not None:
+                return
+            idle = asyncio.Queue()
+            for _ in range(self.size):
+                db = await self._connect()
+                self._connections.append(db)
+                idle.put_nowait(db)
+            self._idle = idle
+            self._loop = asyncio.get_running_loop()
+            logger.info(f"Открыт пул из {self.size} соединений с {self.path} (WAL, synchronous={self.synchronous})")
+
+    async def _connect(self):
+        db = await aiosqlite.connect(self.path, cached_statements=self.cached_statements)
+        await db.execute("PRAGMA journal_mode=WAL")
+        await db.execute(f"PRAGMA synchronous={self.synchronous}")
+        # Писатель в WAL один: остальные ждут освобождения базы, а не падают с "database is locked"
+        await db.execute("PRAGMA busy_timeout=5000")
+        # Внешние ключи SQLite проверяет, только если включить их на каждом соединении
+        await db.execute("PRAGMA foreign_keys=ON")
+        return db
+
+    async def close(self):
+        for db in self._connections:
+            await db.close()
+        self._connections = []
+        self._idle = None
+        self._loop = None
+
+    @asynccontextmanager
+    async def acquire(self):
+        if self._idle is None:
+            await self.open()
+        if asyncio.get_running_loop() is not self._loop:
+            db = await self._connect()
+            try:
+                yield db
+            finally:
+                await db.close()
+            return
+        idle = self._idle
+        db = await idle.get()
+        try:
+            yield db
+        finally:
+            # Незакоммиченное (например, после исключения) не должно достаться следующему владельцу
+            if db.in_transaction:
+                await db.rollback()
+            idle.put_nowait(db)
+
+
+db_pool = ConnectionPool()
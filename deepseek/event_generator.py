@@ -1,4 +1,5 @@
 import asyncio
+import functools
 
 from config import GAME_PROMPT
 from database import get_user_aspect, get_user_country_desc, get_user_id_by_country
@@ -59,7 +60,6 @@ async def generate_event_for_country(country):
     loop = asyncio.get_event_loop()
     event_text = await loop.run_in_executor(
         executor,
-        model_handler.generate_short_responce,
-        prompt,
+        functools.partial(model_handler.generate_short_responce, prompt, priority="event"),
     )
     return event_text.strip()
@@ -0,0 +1,154 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from config import FSM_FLUSH_INTERVAL, FSM_STATE_TTL
+from db_pool import db_pool
+
+logger = logging.getLogger(__name__)
+
+
+def storage_key(key: StorageKey) -> str:
+    """
+    Строковый ключ записи FSM: бот, чат, пользователь, тема, бизнес-подключение и destiny.
+    """
+    return (
+        f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:"
+        f"{key.business_connection_id or ''}:{key.destiny}"
+    )
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище состояний FSM aiogram в таблице fsm_states базы игры: незаконченные регистрация,
+    послание, подтверждение события и правка аспекта переживают перезапуск бота.
+    Все записи держатся в памяти (загружаются в start()), поэтому чтения в хендлерах не ходят в базу.
+    Изменения копятся и раз в flush_interval секунд пишутся одной транзакцией, а при close() — сразу.
+    Запись, не менявшаяся дольше ttl секунд, считается истёкшей: при чтении её нет, из базы она удаляется.
+    """
+
+    def __init__(self, ttl: float = FSM_STATE_TTL, flush_interval: float = FSM_FLUSH_INTERVAL):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._records = {}  # ключ -> {"state", "data", "updated_at"}
+        self._dirty = set()
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+        self._closed = False
+
+    async def start(self):
+        """
+        Загружает неистёкшие записи из базы и запускает периодическую запись изменений.
+        Вызывается после init_db, когда таблица fsm_states уже есть.
+        """
+        async with db_pool.acquire() as db:
+            async with db.execute(
+                "SELECT key, state, data, updated_at FROM fsm_states WHERE updated_at >= ?", (self._expired_before(),)
+            ) as cursor:
+                rows = await cursor.fetchall()
+            await db.execute("DELETE FROM fsm_states WHERE updated_at < ?", (self._expired_before(),))
+            await db.commit()
+        for key, state, data, updated_at in rows:
+            # Записанное хендлерами до загрузки новее, чем в базе
+            self._records.setdefault(key, {"state": state, "data": json.loads(data), "updated_at": updated_at})
+        logger.info(f"Загружено {len(rows)} состояний FSM")
+
+        async def autoflush():
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logger.error(f"Ошибка записи состояний FSM: {e}", exc_info=True)
+
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(autoflush())
+
+    def _expired_before(self) -> float:
+        return time.time() - self.ttl
+
+    def _get(self, key: StorageKey) -> Optional[dict]:
+        record_key = storage_key(key)
+        record = self._records.get(record_key)
+        if record is not None and record["updated_at"] < self._expired_before():
+            del self._records[record_key]
+            self._dirty.add(record_key)
+            return None
+        return record
+
+    def _put(self, key: StorageKey, **fields):
+        record_key = storage_key(key)
+        record = self._get(key) or {"state": None, "data": {}}
+        record.update(fields, updated_at=time.time())
+        if record["state"] is None and not record["data"]:
+            # Пустая запись не хранится
+            self._records.pop(record_key, None)
+        else:
+            self._records[record_key] = record
+        self._dirty.add(record_key)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        self._put(key, state=state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._get(key)
+        return record["state"] if record is not None else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        self._put(key, data=dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._get(key)
+        return dict(record["data"]) if record is not None else {}
+
+    async def flush(self):
+        """
+        Пишет накопленные изменения одной транзакцией и удаляет из базы истёкшие записи.
+        Если изменений нет, в базу не обращается.
+        """
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, set()
+            upserts, deletes = [], []
+            for record_key in dirty:
+                record = self._records.get(record_key)
+                if record is None:
+                    deletes.append((record_key,))
+                else:
+                    data = json.dumps(record["data"], ensure_ascii=False)
+                    upserts.append((record_key, record["state"], data, record["updated_at"]))
+            try:
+                async with db_pool.acquire() as db:
+                    await db.executemany(
+                        "INSERT OR REPLACE INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)", upserts
+                    )
+                    await db.executemany("DELETE FROM fsm_states WHERE key = ?", deletes)
+                    await db.execute("DELETE FROM fsm_states WHERE updated_at < ?", (self._expired_before(),))
+                    await db.commit()
+            except Exception:
+                # Незаписанное уйдёт следующей попыткой
+                self._dirty |= dirty
+                raise
+        logger.debug(f"Состояния FSM записаны: {len(upserts)} изменено, {len(deletes)} удалено")
+
+    async def close(self) -> None:
+        # Вызывается из on_shutdown, пока пул открыт; повторный вызов из aiogram ничего не делает
+        if self._closed:
+            return
+        self._closed = True
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {"states": len(self._records), "pending": len(self._dirty)}
+
+
+fsm_storage = SQLiteStorage()
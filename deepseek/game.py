@@ -16,3 +16,6 @@ ASPECTS = [
     ),
     ("общество", "Общественные отношения", "Сословия, нравы народа, старейшины и положения в чинах и кланах:"),
 ]
+
+# Аспекты, промпт которых опирается на данные других стран (генерируются отдельной пачкой)
+CROSS_COUNTRY_ASPECTS = ("внеш_политика", "территория")
@@ -1,7 +1,19 @@
-from . import admin, cancel, game_aspects_buttons, game_logic, registration, user_commands
+from . import (
+    admin,
+    cancel,
+    game_aspects_buttons,
+    game_logic,
+    instrumentation,
+    model_ready,
+    registration,
+    user_commands,
+)
 
 
 def register_handlers(dp):
+    # Первым: время хендлера включает ожидание загрузки модели в ModelReadyMiddleware
+    instrumentation.register(dp)
+    model_ready.register(dp)
     user_commands.register(dp)
     registration.register(dp)
     admin.register(dp)
@@ -3,10 +3,12 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
 
+from broadcast import broadcast
 from config import ADMIN_CHAT_ID
 from database import *
 from event_generator import generate_event_for_country
 from game import ASPECTS
+from model_handler import model_handler
 from utils import answer_html, send_html, stars_to_bold
 
 from .fsm import *
@@ -261,7 +263,7 @@ async def admin_delete_country(message: types.Message):
     await answer_html(message, f'Страна "{country_name}" и все связанные данные удалены.')
 
 
-@router.message(Command("event"))
+@router.message(Command("event"), flags={"llm": True})
 async def admin_generate_event(message: types.Message, state: FSMContext):
     if message.chat.id != ADMIN_CHAT_ID:
         await answer_html(message, "У вас нет прав на эту команду.")
@@ -316,16 +318,14 @@ async def confirm_event_send(message: types.Message, state: FSMContext):
     # Если "все" — отправить всем странам
     if country_name.lower() == "все":
         countries = await get_all_active_countries()
-        for row in countries:
-            user_id = row[0]
-            try:
-                await message.bot.send_message(
-                    user_id, f"⚡️ <b>В вашей стране случилось новое событие:</b>\n\n{event_text}", parse_mode="HTML"
-                )
-                await add_event_to_history_all(event_text)
-            except Exception as e:
-                continue
-        await answer_html(message, "Событие отправлено всем странам!", reply_markup=None)
+        report = await broadcast(
+            message.bot,
+            [row[0] for row in countries],
+            f"⚡️ <b>В вашей стране случилось новое событие:</b>\n\n{event_text}",
+        )
+        # Событие попадает в историю тех, кому дошло хотя бы начало, — одной транзакцией на всех
+        await add_event_to_history_many(report.delivered, event_text)
+        await answer_html(message, f"Событие отправлено всем странам!\n{report.summary()}", reply_markup=None)
         return
 
     # Для одной страны
@@ -376,15 +376,8 @@ async def admin_do_send_message(message: types.Message, state: FSMContext):
 
     if target.lower() == "все":
         countries = await get_all_active_countries()
-        success = 0
-        for row in countries:
-            user_id = row[0]
-            try:
-                await message.bot.send_message(user_id, text, parse_mode="HTML")
-                success += 1
-            except Exception:
-                continue
-        await answer_html(message, f"Сообщение отправлено всем {success} странам!")
+        report = await broadcast(message.bot, [row[0] for row in countries], text)
+        await answer_html(message, f"Сообщение отправлено всем {len(report.delivered)} странам!\n{report.summary()}")
         return
 
     user_id = await get_user_id_by_country(target)
@@ -464,6 +457,19 @@ async def admin_add_synonym(message: types.Message, state: FSMContext):
     await state.clear()
 
 
+@router.message(Command("queue"))
+async def queue_stats(message: types.Message):
+    if message.chat.id != ADMIN_CHAT_ID:
+        await answer_html(message, "У вас нет прав на эту команду.")
+        return
+    lines = [
+        f"<b>{name}</b>: в очереди {s['depth']}, всего {s['submitted']}, "
+        f"ожидание в среднем {s['wait_mean']:.2f} с, p95 {s['wait_p95']:.2f} с"
+        for name, s in model_handler.scheduler.stats().items()
+    ]
+    await answer_html(message, "<b>Очередь генерации по классам:</b>\n" + "\n".join(lines))
+
+
 @router.message(Command("help"))
 async def admin_help(message: types.Message):
     if message.chat.id != ADMIN_CHAT_ID:
@@ -479,6 +485,7 @@ async def admin_help(message: types.Message):
         "<b>/send [страна|все]</b> — отправить сообщение в страну или всем\n"
         "<b>/countries</b> — вывести список всех стран и их синонимов\n"
         "<b>/add_synonym [страна]</b> — добавить синоним для страны (бот спросит синоним)\n"
+        "<b>/queue</b> — глубина очереди генерации и ожидание по классам приоритета\n"
         "<b>/help</b> — показать эту справку\n\n"
         "<i>Во всех командах вместо названия страны можно использовать её синоним!</i>\n\n"
         "<b>Доступные аспекты:</b>\n" + ", ".join(f"<b>{a[0]}</b>" for a in ASPECTS) + ", <b>описание</b>",
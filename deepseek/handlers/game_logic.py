@@ -1,19 +1,21 @@
 import asyncio
+import functools
 
 from aiogram import F, Router, types
 from aiogram.fsm.context import FSMContext
 
-from config import ADMIN_CHAT_ID, GAME_PROMPT, HISTORY_LIMIT, RPG_PROMPT
+from config import ADMIN_CHAT_ID, GAME_PROMPT, HISTORY_LIMIT, RPG_PROMPT, STREAM_EDIT_INTERVAL, STREAM_RESPONSES
 
 # Импорт функций получения страны/описания по user_id, если требуется
 from database import *
 from database import set_user_aspect, set_user_country, set_user_country_desc
-from game import ASPECTS
+from game import ASPECTS, CROSS_COUNTRY_ASPECTS
 from keyboard import ASPECTS_KEYBOARD
 from model_handler import executor, model_handler
 from rag_retriever import get_rag_context
 from style_checker import contains_modern_words
-from utils import answer_html, keep_typing, send_html, stars_to_bold
+from turn_manager import turn_manager
+from utils import StreamingAnswer, answer_html, keep_typing, send_html, stars_to_bold
 
 from .fsm import *
 
@@ -35,7 +37,38 @@ async def handle_country_name(message: types.Message, state: FSMContext):
     await state.set_state(RegisterCountry.waiting_for_desc)
 
 
-@router.message(RegisterCountry.waiting_for_desc)
+async def build_aspect_prompt(code: str, prompt: str, country: str, country_desc: str) -> str:
+    """
+    Собирает промпт для генерации аспекта страны при регистрации.
+    Для внешней политики и территории добавляет сведения о других странах.
+    """
+    aspect_prompt = f"{GAME_PROMPT}" f"Название страны: {country}\n" f"Описание страны: {country_desc}\n"
+
+    # --- Особый контекст для ВНЕШНЕЙ ПОЛИТИКИ ---
+    if code == "внеш_политика":
+        # Получаем описания всех остальных стран
+        other_descs = await get_other_countries_descs(country)
+        if other_descs:
+            aspect_prompt += "Краткие описания других стран в мире:\n" + "".join(
+                [f"- {c_name}: {desc.strip() if desc else '(нет описания)'}\n" for c_name, desc in other_descs]
+            )
+    # --- Особый контекст для ТЕРРИТОРИИ ---
+    if code == "территория":
+        # Получаем аспект территория остальных стран
+        other_territories = await get_other_countries_aspect(country, "территория")
+        if other_territories:
+            aspect_prompt += "Краткое описание границ и земель других стран:\n" + "".join(
+                [
+                    f"- {c_name}: {territory.strip() if territory else '(нет описания)'}\n"
+                    for c_name, territory in other_territories
+                ]
+            )
+
+    # Основной промпт аспекта
+    return aspect_prompt + prompt
+
+
+@router.message(RegisterCountry.waiting_for_desc, flags={"llm": True})
 async def handle_country_desc(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     user_text = message.text.strip()
@@ -74,58 +107,46 @@ async def handle_country_desc(message: types.Message, state: FSMContext):
         f"<b>Название страны:</b> {country}\n"
         f"<b>Описание страны:</b>\n{user_text.strip()}\n\n",
     )
-    all_aspects = []
-
-    for code, label, prompt in ASPECTS:
-        aspect_prompt = f"{GAME_PROMPT}" f"Название страны: {country}\n" f"Описание страны: {user_text.strip()}\n"
-
-        # --- Особый контекст для ВНЕШНЕЙ ПОЛИТИКИ ---
-        if code == "внеш_политика":
-            # Получаем описания всех остальных стран
-            other_descs = await get_other_countries_descs(country)
-            if other_descs:
-                aspect_prompt += "Краткие описания других стран в мире:\n" + "".join(
-                    [f"- {c_name}: {desc.strip() if desc else '(нет описания)'}\n" for c_name, desc in other_descs]
-                )
-        # --- Особый контекст для ТЕРРИТОРИИ ---
-        if code == "территория":
-            # Получаем аспект территория остальных стран
-            other_territories = await get_other_countries_aspect(country, "территория")
-            if other_territories:
-                aspect_prompt += "Краткое описание границ и земель других стран:\n" + "".join(
-                    [
-                        f"- {c_name}: {territory.strip() if territory else '(нет описания)'}\n"
-                        for c_name, territory in other_territories
-                    ]
-                )
-
-        # Основной промпт аспекта
-        aspect_prompt += prompt
-
-        # --- Отправить промпт в чат админов (для контроля) ---
-        await send_html(
-            message.bot,
-            ADMIN_CHAT_ID,
-            f"<b>Промпт для генерации аспекта <u>{label}</u> страны {country}:</b>\n" f"<pre>{aspect_prompt}</pre>",
+    aspect_values = {}
+    independent = [a for a in ASPECTS if a[0] not in CROSS_COUNTRY_ASPECTS]
+    dependent = [a for a in ASPECTS if a[0] in CROSS_COUNTRY_ASPECTS]
+
+    # Сначала одной пачкой — аспекты, не зависящие от других стран, затем — зависящие
+    for group in (independent, dependent):
+        prompts = []
+        for code, label, prompt in group:
+            aspect_prompt = await build_aspect_prompt(code, prompt, country, user_text.strip())
+            # --- Отправить промпт в чат админов (для контроля) ---
+            await send_html(
+                message.bot,
+                ADMIN_CHAT_ID,
+                f"<b>Промпт для генерации аспекта <u>{label}</u> страны {country}:</b>\n" f"<pre>{aspect_prompt}</pre>",
+            )
+            prompts.append(aspect_prompt)
+
+        # Генерация аспектов группы одним пакетным вызовом
+        values = await loop.run_in_executor(
+            executor, functools.partial(model_handler.generate_short_batch, prompts, priority="registration")
         )
 
-        # Генерация аспекта
-        aspect_value = await loop.run_in_executor(
-            executor,
-            model_handler.generate_short_responce,
-            aspect_prompt,
-        )
+        for (code, _, _), aspect_value in zip(group, values):
+            await set_user_aspect(user_id, code, aspect_value.strip())
+            aspect_values[code] = aspect_value.strip()
+
+    # Игрок видит аспекты в привычном порядке ASPECTS, а не в порядке пачек
+    for code, label, _ in ASPECTS:
+        aspect_value = aspect_values[code]
         await answer_html(
             message,
-            f"<b>{label}</b> страны {country}: {aspect_value.strip()}{'' if aspect_value.strip().endswith('.') else '.'}",
+            f"<b>{label}</b> страны {country}: {aspect_value}{'' if aspect_value.endswith('.') else '.'}",
         )
         await send_html(
             message.bot,
             ADMIN_CHAT_ID,
-            f"<b>{label}</b> страны {country}: {aspect_value.strip()}{'' if aspect_value.strip().endswith('.') else '.'}",
+            f"<b>{label}</b> страны {country}: {aspect_value}{'' if aspect_value.endswith('.') else '.'}",
         )
-        await set_user_aspect(user_id, code, aspect_value.strip())
-        all_aspects.append(aspect_value.strip())
+
+    all_aspects = [aspect_values[code] for code, _, _ in ASPECTS]
 
     # Генерируем итоговое краткое описание страны
     desc_prompt = (
@@ -145,8 +166,7 @@ async def handle_country_desc(message: types.Message, state: FSMContext):
 
     description = await loop.run_in_executor(
         executor,
-        model_handler.generate_short_responce,
-        desc_prompt,
+        functools.partial(model_handler.generate_short_responce, desc_prompt, priority="registration"),
     )
     await send_html(
         message.bot,
@@ -172,7 +192,7 @@ async def handle_country_desc(message: types.Message, state: FSMContext):
     )
 
 
-@router.message(F.text & ~F.text.startswith("/"))
+@router.message(F.text & ~F.text.startswith("/"), flags={"llm": True})
 async def handle_game_dialog(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     user_text = message.text.strip()
@@ -190,6 +210,23 @@ async def handle_game_dialog(message: types.Message, state: FSMContext):
         )
         return
 
+    # Сообщения подряд и пришедшие, пока пишется прошлый ответ, склеиваются в один ход игрока
+    if not turn_manager.accepts(user_id):
+        turn_manager.reject(user_id)
+        await answer_html(
+            message,
+            "⏳ Летописец ещё пишет ответ на прежние твои слова. Дождись его, прежде чем повелевать снова.",
+            reply_markup=ASPECTS_KEYBOARD,
+        )
+        return
+    if turn_manager.is_busy(user_id):
+        await answer_html(message, "✍️ Летописец дописывает прежний ответ и учтёт это слово в следующей записи.")
+    turn = await turn_manager.collect(user_id, user_text)
+    if turn is None:
+        # Сообщение вошло в ход, который соберёт и отправит хендлер первого сообщения
+        return
+    user_text = turn.text
+
     try:
         await message.bot.send_chat_action(chat_id=chat_id, action="typing")
         typing_task = asyncio.create_task(keep_typing(message.bot, chat_id))
@@ -206,32 +243,48 @@ async def handle_game_dialog(message: types.Message, state: FSMContext):
         # Получить RAG-контекст (расширенную справку) для вставки в промпт к модели
         rag_context = await get_rag_context(user_id, user_text)
 
-        # RPG_PROMPT + rag_context + история + пользовательский запрос
-        # Модифицируем RPG_PROMPT если rag_context есть
-        if rag_context:
-            prompt_with_rag = f"{RPG_PROMPT}\n\n{rag_context}\n"
+        # История читается и пишется здесь, на event loop бота: генерация к базе не обращается
+        history = await get_history(user_id, HISTORY_LIMIT)
+
+        # RAG-контекст передаём отдельно: он меняется от хода к ходу и идёт в промпте
+        # после RPG_PROMPT и описания страны, KV-состояние которых кэшируется
+        if STREAM_RESPONSES:
+            # Ответ показывается по мере генерации правками одного сообщения
+            stream = await model_handler.stream_generate_response(
+                user_id, user_text, history, RPG_PROMPT, country_name, country_desc, rag_context
+            )
+            answer = StreamingAnswer(
+                message, STREAM_EDIT_INTERVAL, typing_task=typing_task, reply_markup=ASPECTS_KEYBOARD
+            )
+            async for visible_text in stream:
+                await answer.update(visible_text)
+            typing_task.cancel()
+            assistant_reply, result, prompt = stream.reply, stream.result, stream.context
+            await update_history(user_id, user_text, assistant_reply, HISTORY_LIMIT)
+            await answer.finish(stars_to_bold(assistant_reply))
         else:
-            prompt_with_rag = RPG_PROMPT + "\n\n"
-
-        await send_html(message.bot, ADMIN_CHAT_ID, f"<b>Промпт:</b>\n" f"{prompt_with_rag}")
-
-        # Передадим rag-расширенный prompt в LLM
-        assistant_reply, context = await asyncio.get_event_loop().run_in_executor(
-            executor,
-            model_handler.sync_generate_response,
-            user_id,
-            user_text,
-            prompt_with_rag,
-            country_name,
-            country_desc,
-            HISTORY_LIMIT,
-        )
-        typing_task.cancel()
-        html_reply = stars_to_bold(assistant_reply)
-        await answer_html(message, html_reply, reply_markup=ASPECTS_KEYBOARD)
-
+            assistant_reply, result, prompt = await asyncio.get_event_loop().run_in_executor(
+                executor,
+                model_handler.sync_generate_response,
+                user_id,
+                user_text,
+                history,
+                RPG_PROMPT,
+                country_name,
+                country_desc,
+                rag_context,
+            )
+            typing_task.cancel()
+            await update_history(user_id, user_text, assistant_reply, HISTORY_LIMIT)
+            html_reply = stars_to_bold(assistant_reply)
+            await answer_html(message, html_reply, reply_markup=ASPECTS_KEYBOARD)
+
+        # Промпт — ровно тот, что видела модель: после бюджета токенов и сводки истории
+        await send_html(message.bot, ADMIN_CHAT_ID, f"<b>Промпт:</b>\n" f"{prompt}")
         await send_html(
-            message.bot, ADMIN_CHAT_ID, f"<b>Полный ответ модели:</b>\n" f"{context[len(prompt_with_rag):]}"
+            message.bot,
+            ADMIN_CHAT_ID,
+            f"<b>Полный ответ модели</b> ({result.summary()}):\n" f"{result.text}",
         )
         await send_html(
             message.bot,
@@ -240,6 +293,8 @@ async def handle_game_dialog(message: types.Message, state: FSMContext):
         )
     except Exception as e:
         await send_html(message.bot, ADMIN_CHAT_ID, f"Ошибка: {str(e)}")
+    finally:
+        turn_manager.finish(turn)
 
 
 def register(dp):
@@ -0,0 +1,49 @@
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+from metrics import HANDLER_ERRORS, HANDLER_SECONDS, TELEGRAM_ERRORS, TELEGRAM_REQUEST_SECONDS
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Время каждого хендлера (метка — модуль и имя функции) и его исключения.
+    Внутренний middleware диспетчера: действует на хендлеры всех роутеров, сами хендлеры не меняются.
+    """
+
+    async def __call__(self, handler, event, data: dict):
+        handler_object = data.get("handler")
+        callback = getattr(handler_object, "callback", None)
+        name = f"{callback.__module__}.{callback.__name__}" if callback is not None else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            HANDLER_ERRORS.inc(handler=name, error=type(e).__name__)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """
+    Задержка и ошибки каждого запроса к Bot API (отправка, правка сообщений, chat action) по имени метода.
+    Подключается к сессии бота: bot.session.middleware(TelegramMetricsMiddleware()).
+    """
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            TELEGRAM_ERRORS.inc(method=name, error=type(e).__name__)
+            raise
+        finally:
+            TELEGRAM_REQUEST_SECONDS.observe(time.perf_counter() - started, method=name)
+
+
+def register(dp):
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
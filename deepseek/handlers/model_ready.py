@@ -0,0 +1,39 @@
+import logging
+
+from aiogram import BaseMiddleware, types
+from aiogram.dispatcher.flags import get_flag
+
+from model_handler import model_handler
+from utils import answer_html
+
+logger = logging.getLogger(__name__)
+
+
+class ModelReadyMiddleware(BaseMiddleware):
+    """
+    Для хендлеров с флагом llm: пока модель загружается, отвечает игроку, что летописец
+    пробуждается, и откладывает обработку до готовности модели. Остальные хендлеры
+    (/start, /help, кнопки аспектов) работают сразу.
+    """
+
+    async def __call__(self, handler, event: types.Message, data: dict):
+        if not get_flag(data, "llm") or model_handler.is_ready:
+            return await handler(event, data)
+        if model_handler.state != "failed":
+            await answer_html(
+                event,
+                "🌅 Летописец пробуждается ото сна и разворачивает свитки. "
+                "Твоё слово записано — ответ придёт, как только он откроет глаза.",
+            )
+        try:
+            await model_handler.wait_ready()
+        except RuntimeError as e:
+            logger.error(f"Запрос пользователя {event.from_user.id} не обработан: {str(e)}")
+            await answer_html(event, "⚠️ Летописец сейчас недоступен. Попробуй позже.")
+            return
+        return await handler(event, data)
+
+
+def register(dp):
+    # Внутренний middleware: флаги хендлера известны только после фильтров
+    dp.message.middleware(ModelReadyMiddleware())
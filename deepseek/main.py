@@ -3,10 +3,38 @@ import logging
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
-from aiogram.fsm.storage.memory import MemoryStorage
 
-from config import BOT_TOKEN
+from config import BOT_TOKEN, METRICS_HOST, METRICS_PORT
+from database import init_db, sync_semantic_index
+from db_pool import db_pool
+from fsm_storage import fsm_storage
 from handlers import register_handlers
+from handlers.instrumentation import TelegramMetricsMiddleware
+from metrics import MetricsServer
+from model_handler import model_handler
+from semantic_index import semantic_index
+
+metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT)
+
+
+async def on_startup():
+    await db_pool.open()
+    await init_db()
+    # Состояния незаконченных диалогов загружаются до первого апдейта
+    await fsm_storage.start()
+    await sync_semantic_index()
+    semantic_index.start_autosave()
+    if METRICS_PORT:
+        await metrics_server.start()
+    # Модель грузится в фоне: бот начинает отвечать на команды сразу, не дожидаясь весов
+    model_handler.start_warm_up()
+
+
+async def on_shutdown():
+    await metrics_server.stop()
+    await fsm_storage.close()
+    await semantic_index.stop()
+    await db_pool.close()
 
 
 def main():
@@ -16,10 +44,14 @@ def main():
 
     # Создаём бота и диспетчер с новым способом установки parse_mode
     bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties())
-    dp = Dispatcher(storage=MemoryStorage())
+    # Задержка и ошибки всех запросов к Telegram — в метриках
+    bot.session.middleware(TelegramMetricsMiddleware())
+    dp = Dispatcher(storage=fsm_storage)
 
     # Регистрируем все хендлеры
     register_handlers(dp)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
 
     logger.info("Бот запущен")
     asyncio.run(dp.start_polling(bot))
@@ -0,0 +1,253 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм в секундах: быстрые операции (база, Telegram) и генерация
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    Метрика с метками в текстовом формате Prometheus. Значения пишутся из любых потоков
+    (event loop бота, поток планировщика генерации) под блокировкой метрики.
+    """
+
+    type = None
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield from self._render_value(key, value)
+
+    def _render_value(self, key, value):
+        yield f"{self.name}{_format_labels(self.labels, key)} {_format_number(value)}"
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """
+    Гистограмма с накопительными корзинами buckets, суммой и числом наблюдений.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = FAST_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def time(self, **labels):
+        """
+        Декоратор: время выполнения функции или корутины (в том числе завершившейся исключением).
+        """
+
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    started = time.perf_counter()
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        self.observe(time.perf_counter() - started, **labels)
+
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - started, **labels)
+
+            return wrapper
+
+        return decorator
+
+    def _render_value(self, key, value):
+        counts, total = value
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            labels = _format_labels(self.labels, key, f'le="{_format_number(float(bound))}"')
+            yield f"{self.name}_bucket{labels} {cumulative}"
+        yield f"{self.name}_sum{_format_labels(self.labels, key)} {_format_number(total)}"
+        yield f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric):
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+
+
+def instrument_module(namespace: dict, histogram: Histogram, label: str):
+    """
+    Оборачивает все публичные корутины, объявленные в модуле (namespace — его globals()), декоратором
+    histogram.time с меткой label = имя функции. Вызывается в конце модуля, до того как его импортируют другие.
+    """
+    module = namespace["__name__"]
+    for name, value in list(namespace.items()):
+        if asyncio.iscoroutinefunction(value) and value.__module__ == module and not name.startswith("_"):
+            namespace[name] = histogram.time(**{label: name})(value)
+
+
+# ==== Метрики бота ====
+
+LLM_QUEUE_SECONDS = Histogram(
+    "llm_queue_wait_seconds", "Ожидание запроса в очереди генерации", ["priority"], SLOW_BUCKETS
+)
+LLM_PREFILL_SECONDS = Histogram("llm_prefill_seconds", "Префилл промпта до первого токена", ["priority"], SLOW_BUCKETS)
+LLM_DECODE_SECONDS = Histogram("llm_decode_seconds", "Декодирование ответа", ["priority"], SLOW_BUCKETS)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "llm_decode_tokens_per_second",
+    "Скорость декодирования одного запроса",
+    ["priority"],
+    (1, 2, 5, 10, 20, 30, 50, 75, 100, 200, 500),
+)
+LLM_PROMPT_TOKENS = Histogram(
+    "llm_prompt_tokens", "Длина промпта в токенах", ["priority"], (128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+)
+LLM_GENERATED_TOKENS = Counter("llm_generated_tokens_total", "Сгенерировано токенов", ["priority"])
+LLM_REQUESTS = Counter("llm_requests_total", "Завершённые запросы генерации", ["priority", "stop_reason"])
+LLM_ERRORS = Counter("llm_errors_total", "Запросы, генерация которых упала", ["priority"])
+LLM_QUEUE_DEPTH = Gauge("llm_queue_depth", "Запросов в очереди генерации", ["priority"])
+
+DB_QUERY_SECONDS = Histogram("db_query_seconds", "Время функций database.py", ["function"])
+RAG_LOOKUP_SECONDS = Histogram("rag_lookup_seconds", "Сборка контекста RAG для сообщения")
+
+TELEGRAM_REQUEST_SECONDS = Histogram("telegram_request_seconds", "Запросы к Bot API", ["method"])
+TELEGRAM_ERRORS = Counter("telegram_errors_total", "Ошибки запросов к Bot API", ["method", "error"])
+
+HANDLER_SECONDS = Histogram("handler_seconds", "Время обработки апдейта хендлером", ["handler"], SLOW_BUCKETS)
+HANDLER_ERRORS = Counter("handler_errors_total", "Исключения в хендлерах", ["handler", "error"])
+
+
+def record_generation(request, result):
+    """
+    Метрики одного завершённого запроса генерации (GenerationRequest и его GenerationResult).
+    """
+    priority = request.priority
+    LLM_QUEUE_SECONDS.observe(result.queue_seconds, priority=priority)
+    LLM_PREFILL_SECONDS.observe(result.prefill_seconds, priority=priority)
+    LLM_DECODE_SECONDS.observe(result.decode_seconds, priority=priority)
+    if result.decode_seconds > 0:
+        LLM_TOKENS_PER_SECOND.observe(result.generated_tokens / result.decode_seconds, priority=priority)
+    # Внешний сервер может не сообщить длину промпта
+    if result.prompt_tokens is not None:
+        LLM_PROMPT_TOKENS.observe(result.prompt_tokens, priority=priority)
+    LLM_GENERATED_TOKENS.inc(result.generated_tokens, priority=priority)
+    LLM_REQUESTS.inc(priority=priority, stop_reason=result.stop_reason)
+
+
+class MetricsServer:
+    """
+    HTTP-сервер метрик на event loop бота: GET /metrics отдаёт registry в текстовом формате Prometheus.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            # Заголовки запроса не нужны, но их надо дочитать до пустой строки
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, content_type, body = "200 OK", "text/plain; version=0.0.4; charset=utf-8", registry.render()
+            else:
+                status, content_type, body = "404 Not Found", "text/plain; charset=utf-8", "not found\n"
+            payload = body.encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode("latin-1") + payload
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -1,109 +1,294 @@
+import asyncio
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor
 
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
-
-from config import MAX_NEW_TOKENS, SHORT_NEW_TOKENS
-from database import get_history, update_history
+from backends import create_backend
+from batch_scheduler import BatchScheduler
+from config import (
+    INFERENCE_AGING_SECONDS,
+    INFERENCE_CLASS_LIMITS,
+    INFERENCE_MAX_BATCH_SIZE,
+    INFERENCE_MAX_WAIT_MS,
+    MAX_NEW_TOKENS,
+    PROMPT_COUNTRY_TOKENS,
+    PROMPT_HISTORY_TOKENS,
+    RAG_CONTEXT_TOKENS,
+    SHORT_NEW_TOKENS,
+    STREAM_WAIT_FOR_THINK,
+)
+from database import on_history_invalidated
+from prompt_builder import PromptSection, prompt_builder, split_sentences, summarize_turns, token_counter
 from utils import *
 
 logger = logging.getLogger(__name__)
 
 
+class ResponseStream:
+    """
+    Ответ модели, выдаваемый по мере генерации.
+    Итерация отдаёт накопленный видимый игроку текст (рассуждения и выдуманные ходы игрока скрыты).
+    После окончания в reply лежит очищенный ответ, в result — GenerationResult с текстом и метаданными.
+    Историю диалога записывает вызывающий хендлер.
+    """
+
+    def __init__(self, streamer, future, context):
+        self.streamer = streamer
+        self.future = future
+        self.context = context
+        self.reply = None
+        self.result = None
+
+    async def __aiter__(self):
+        cleaner = StreamingResponseCleaner(STREAM_WAIT_FOR_THINK)
+        visible = ""
+        async for chunk in self.streamer:
+            new_visible = cleaner.feed(chunk)
+            if new_visible != visible:
+                visible = new_visible
+                yield visible
+        self.result = await asyncio.wrap_future(self.future)
+        self.reply = clean_ai_response(self.result.text.strip())
+
+
 class ModelHandler:
-    def __init__(self, max_new_tokens, short_new_tokens):
+    """
+    Генерация ответов летописца. Сам объект создаётся мгновенно, а бэкенд (веса модели)
+    загружается в фоне: start_warm_up() из хука запуска бота или при первом запросе.
+    Запросы, пришедшие раньше, ждут окончания загрузки в очереди планировщика.
+    state — "sleeping" (загрузка не начата), "loading", "ready" или "failed".
+    """
+
+    def __init__(self, max_new_tokens, short_new_tokens, backend=None):
         self.max_new_tokens = max_new_tokens
         self.short_new_tokens = short_new_tokens
-        self._initialize_model()
-
-    def _initialize_model(self):
-        model_name = "deepseek-ai/DeepSeek-R1-Distill-Qwen-32B"
-        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        self.model = AutoModelForCausalLM.from_pretrained(
-            model_name, device_map="auto", torch_dtype=torch.float16, use_flash_attention_2=False
+        self.backend = None
+        self.state = "sleeping"
+        self.load_error = None
+        self.load_seconds = None
+        self._load_lock = threading.Lock()
+        self._warm_up_task = None
+        if backend is not None:
+            self._attach(backend)
+        self.scheduler = BatchScheduler(
+            self._generate_batch,
+            INFERENCE_MAX_BATCH_SIZE,
+            INFERENCE_MAX_WAIT_MS,
+            INFERENCE_AGING_SECONDS,
+            INFERENCE_CLASS_LIMITS,
         )
 
-        # Log device information
-        device_info = f"Модель использует устройство: {self.model.device}"
-        logger.info(device_info)
-        cuda_available = torch.cuda.is_available()
-        logger.info(f"CUDA доступен: {cuda_available}")
-
-        if cuda_available:
-            cuda_device_count = torch.cuda.device_count()
-            cuda_device_name = torch.cuda.get_device_name(0) if cuda_device_count > 0 else "Нет"
-            logger.info(f"Количество GPU: {cuda_device_count}")
-            logger.info(f"Название GPU: {cuda_device_name}")
-            logger.info(f"Текущее использование GPU памяти: {torch.cuda.memory_allocated() / 1024**2:.2f} МБ")
-            logger.info(
-                f"Максимальная доступная GPU память: {torch.cuda.get_device_properties(0).total_memory / 1024**2:.2f} МБ"
-            )
+    @property
+    def is_ready(self) -> bool:
+        return self.state == "ready"
+
+    def _attach(self, backend):
+        self.backend = backend
+        on_history_invalidated(backend.invalidate_session)
+        self.state = "ready"
+
+    def load(self):
+        """
+        Загружает бэкенд генерации (блокирующе). Повторные и одновременные вызовы
+        дожидаются первой загрузки и ничего не делают.
+        """
+        with self._load_lock:
+            if self.state in ("ready", "failed"):
+                return
+            self.state = "loading"
+            started = time.perf_counter()
+            logger.info("Загрузка бэкенда генерации...")
+            try:
+                # Бэкенд генерации выбирается INFERENCE_BACKEND: локальная модель, внешний сервер или заглушка
+                backend = create_backend()
+            except Exception as e:
+                self.load_error = e
+                self.state = "failed"
+                logger.error(f"Не удалось загрузить бэкенд генерации: {str(e)}", exc_info=True)
+                return
+            self.load_seconds = time.perf_counter() - started
+            self._attach(backend)
+            # Бюджет промпта считает свой экземпляр токенизатора PROMPT_TOKENIZER (по умолчанию — модели):
+            # токенизатор бэкенда занят потоком планировщика
+            token_counter.load()
+            logger.info(f"Бэкенд генерации {backend.name} готов за {self.load_seconds:.1f} с")
+
+    def start_warm_up(self):
+        """
+        Запускает фоновую загрузку в текущем event loop (один раз) и возвращает её задачу.
+        """
+        if self._warm_up_task is None:
+            self._warm_up_task = asyncio.create_task(asyncio.to_thread(self.load))
+        return self._warm_up_task
+
+    async def wait_ready(self):
+        """
+        Дожидается загрузки бэкенда; если загрузка провалилась — бросает RuntimeError.
+        """
+        await asyncio.shield(self.start_warm_up())
+        self._check_loaded()
+
+    def _check_loaded(self):
+        if self.state == "failed":
+            raise RuntimeError(f"Бэкенд генерации не загружен: {self.load_error}")
+
+    def _generate_batch(self, requests):
+        # Поток планировщика дожидается загрузки (или загружает сам, если её никто не начал)
+        self.load()
+        self._check_loaded()
+        return self.backend.generate_batch(requests)
+
+    @staticmethod
+    def _build_dialog_context(history, message_text, rpg_prompt, country_name, country_desc, rag_context, user_id=None):
+        """
+        Собирает промпт диалога. Возвращает (промпт, префикс для кэша префиксов, текст для кэша диалога).
+        Блоки идут от самых постоянных к самым изменчивым, чтобы KV-состояние начала
+        промпта переиспользовалось: системный промпт и страна — общий кэш префиксов,
+        история диалога — кэш диалога игрока (окно истории растёт до скачка, см. history_window_start),
+        RAG-справка и новый ход — префиллятся заново.
+        Разделы укладываются в бюджет токенов prompt_builder: первой режется RAG-справка,
+        затем старые ходы истории (сворачиваются в сводку), затем конец описания страны;
+        системный промпт и ход игрока не режутся.
+        """
+        sections = prompt_builder.fit(
+            [
+                PromptSection("system", [rpg_prompt]),
+                PromptSection(
+                    "country",
+                    [f"Игрок управляет страной {country_name}.\nОписание страны:", *split_sentences(country_desc)]
+                    if country_name and country_desc
+                    else [],
+                    priority=1,
+                    max_tokens=PROMPT_COUNTRY_TOKENS,
+                    keep="head",
+                    separator=" ",
+                ),
+                PromptSection(
+                    "history",
+                    history,
+                    priority=2,
+                    max_tokens=PROMPT_HISTORY_TOKENS,
+                    keep="tail",
+                    summarize=summarize_turns,
+                ),
+                PromptSection(
+                    "rag",
+                    rag_context.split("\n") if rag_context else [],
+                    priority=3,
+                    max_tokens=RAG_CONTEXT_TOKENS,
+                    keep="head",
+                ),
+                PromptSection("message", [f"Игрок: {message_text}"]),
+            ],
+            label=f"диалог {user_id}" if user_id is not None else "",
+        )
+        context_prompts = [rpg_prompt]
+        # От описания страны мог остаться только заголовок — тогда блок не нужен
+        if len(sections["country"].kept) > 1:
+            context_prompts.append(sections["country"].text + "\n")
+        prefix = "\n".join(context_prompts) + "\n"
+        # Кэш диалога продолжает прошлый ход, только пока история растёт: срезанная по бюджету история
+        # (со сводкой) меняет начало от хода к ходу, поэтому в ключ кэша не идёт
+        history_section = sections["history"]
+        history_text = history_section.text
+        dialog_text = "\n".join(context_prompts + ([history_text] if history_text else [])) + "\n"
+        session_text = dialog_text if not history_section.trimmed else prefix
+        rag_text = sections["rag"].text
+        tail = ([rag_text + "\n"] if rag_text else []) + [f"Игрок: {message_text}"]
+        return dialog_text + "\n".join(tail) + "\nАссистент:", prefix, session_text
 
     def sync_generate_response(
-        self, user_id, message_text, rpg_prompt, country_name=None, country_desc=None, history_limit=4
+        self, user_id, message_text, history, rpg_prompt, country_name=None, country_desc=None, rag_context=None
     ):
-        import asyncio
-
+        """
+        Синхронная генерация хода диалога без обращений к базе и своего event loop:
+        история передаётся готовой, а записывает её вызывающий хендлер на основном loop.
+        Возвращает (очищенный ответ, GenerationResult, промпт).
+        """
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            history = loop.run_until_complete(get_history(user_id))
-
-            context_prompts = [rpg_prompt]
-            if country_name and country_desc:
-                context_prompts.append(f"Игрок управляет страной {country_name}.\nОписание страны: {country_desc}\n")
-            context = "\n".join(context_prompts + history + [f"Игрок: {message_text}"]) + "\nАссистент:"
-
-            inputs = self.tokenizer(context, return_tensors="pt").to(self.model.device)
-            outputs = self.model.generate(
-                **inputs,
-                max_new_tokens=self.max_new_tokens,
-                do_sample=True,
-                temperature=0.7,
-                top_p=0.95,
-                eos_token_id=self.tokenizer.eos_token_id,
-                pad_token_id=self.tokenizer.eos_token_id,
+            context, prefix, session_text = self._build_dialog_context(
+                history, message_text, rpg_prompt, country_name, country_desc, rag_context, user_id
             )
-            response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
 
-            # Чистим ответ ассистента
-            ai_response = clean_ai_response(response[len(context) :].strip())
+            result = self.scheduler.submit(
+                context,
+                self.max_new_tokens,
+                prefix=prefix,
+                session=(user_id, session_text),
+                stop_strings=DIALOG_STOP_STRINGS,
+                priority="turn",
+            ).result()
 
-            loop.run_until_complete(update_history(user_id, message_text, ai_response, history_limit))
-            loop.close()
-            return ai_response, response
+            # Чистим ответ ассистента
+            ai_response = clean_ai_response(result.text.strip())
+            return ai_response, result, context
         except Exception as e:
             logger.error(f"Ошибка в generate_response: {str(e)}", exc_info=True)
             raise
 
-    def generate_short_responce(self, prompt: str) -> str:
-        import asyncio
+    async def stream_generate_response(
+        self, user_id, message_text, history, rpg_prompt, country_name=None, country_desc=None, rag_context=None
+    ):
+        """
+        Потоковый вариант sync_generate_response: ставит генерацию в очередь планировщика
+        и возвращает ResponseStream, по которому можно итерироваться, получая видимый игроку текст.
+        """
+        await self.wait_ready()
+        # Подсчёт токенов — работа токенизатора, её не место на event loop бота
+        context, prefix, session_text = await asyncio.to_thread(
+            self._build_dialog_context,
+            history,
+            message_text,
+            rpg_prompt,
+            country_name,
+            country_desc,
+            rag_context,
+            user_id,
+        )
+        streamer = self.backend.create_streamer()
+        future = self.scheduler.submit(
+            context,
+            self.max_new_tokens,
+            prefix=prefix,
+            session=(user_id, session_text),
+            streamer=streamer,
+            stop_strings=DIALOG_STOP_STRINGS,
+            priority="turn",
+        )
+        return ResponseStream(streamer, future, context)
 
+    def generate_short_responce(self, prompt: str, max_new_tokens: int = None, priority: str = "background") -> str:
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-
-            inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
-            outputs = self.model.generate(
-                **inputs,
-                max_new_tokens=self.short_new_tokens,
-                do_sample=True,
-                temperature=0.7,
-                top_p=0.95,
-                eos_token_id=self.tokenizer.eos_token_id,
-                pad_token_id=self.tokenizer.eos_token_id,
-            )
-            response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
+            result = self.scheduler.submit(
+                prompt, max_new_tokens or self.short_new_tokens, stop_strings=SHORT_STOP_STRINGS, priority=priority
+            ).result()
 
             # Чистим ответ ассистента
-            ai_response = clean_ai_response(response[len(prompt) :].strip(), "\n")
-
-            loop.close()
-            return ai_response
+            return clean_ai_response(result.text.strip(), "\n")
         except Exception as e:
             logger.error(f"Ошибка в generate_short_response: {str(e)}", exc_info=True)
             raise
 
+    def generate_short_batch(self, prompts, max_new_tokens: int = None, priority: str = "background"):
+        """
+        Короткие ответы на несколько независимых промптов.
+        Все промпты ставятся в очередь разом, поэтому планировщик прогоняет их одной пачкой.
+        """
+        try:
+            futures = [
+                self.scheduler.submit(
+                    p, max_new_tokens or self.short_new_tokens, stop_strings=SHORT_STOP_STRINGS, priority=priority
+                )
+                for p in prompts
+            ]
+            return [clean_ai_response(f.result().text.strip(), "\n") for f in futures]
+        except Exception as e:
+            logger.error(f"Ошибка в generate_short_batch: {str(e)}", exc_info=True)
+            raise
+
 
 model_handler = ModelHandler(MAX_NEW_TOKENS, SHORT_NEW_TOKENS)
-executor = ThreadPoolExecutor(max_workers=1)
+# Потоки пула лишь собирают промпт и ждут future планировщика — сама генерация идёт
+# в единственном потоке BatchScheduler, поэтому потоков нужно не меньше размера пачки.
+# К базе потоки пула не обращаются: история читается и пишется в хендлерах на event loop бота.
+executor = ThreadPoolExecutor(max_workers=INFERENCE_MAX_BATCH_SIZE * 2)
@@ -0,0 +1,129 @@
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def cache_nbytes(past_key_values) -> int:
+    """
+    Размер KV-кэша в байтах (сумма по всем слоям ключей и значений).
+    """
+    return sum(t.numel() * t.element_size() for layer in past_key_values for t in layer)
+
+
+class PrefixCacheEntry:
+    """
+    Закэшированный префикс промпта: текст, его токены и past_key_values после префилла.
+    prefill_seconds — сколько стоил префилл этого префикса с нуля.
+    """
+
+    def __init__(self, text, input_ids, past_key_values, prefill_seconds):
+        self.text = text
+        self.input_ids = input_ids
+        self.past_key_values = past_key_values
+        self.prefill_seconds = prefill_seconds
+        self.nbytes = cache_nbytes(past_key_values)
+
+    @property
+    def num_tokens(self) -> int:
+        return self.input_ids.shape[-1]
+
+
+class KVCacheLRU:
+    """
+    LRU-хранилище записей PrefixCacheEntry с общим бюджетом памяти max_bytes.
+    При переполнении вытесняются давно не использованные записи.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+        self.saved_seconds = 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry: PrefixCacheEntry) -> PrefixCacheEntry:
+        """
+        Кладёт запись в кэш, вытесняя старые. Возвращает запись,
+        даже если она не поместилась в бюджет и не была сохранена.
+        """
+        if entry.nbytes > self.max_bytes:
+            logger.warning(f"KV-состояние из {entry.num_tokens} токенов не помещается в кэш ({entry.nbytes} байт)")
+            return entry
+        with self._lock:
+            self._pop(key)
+            while self._entries and self.total_bytes + entry.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted.nbytes
+                logger.info(f"Из кэша вытеснено KV-состояние из {evicted.num_tokens} токенов")
+            self._entries[key] = entry
+            self.total_bytes += entry.nbytes
+        return entry
+
+    def _pop(self, key):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.total_bytes -= old.nbytes
+        return old
+
+    def record_hit(self, entry: PrefixCacheEntry, saved_tokens: int = None, saved_seconds: float = None):
+        with self._lock:
+            self.hits += 1
+            self.saved_tokens += entry.num_tokens if saved_tokens is None else saved_tokens
+            self.saved_seconds += entry.prefill_seconds if saved_seconds is None else saved_seconds
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+
+class PrefixCache(KVCacheLRU):
+    """
+    Кэш KV-состояний для общих префиксов промптов (RPG_PROMPT, GAME_PROMPT,
+    блоки с описанием страны игрока), ключ — текст префикса.
+    """
+
+    def longest_prefix(self, text: str):
+        """
+        Самый длинный закэшированный префикс, строго короче text.
+        """
+        with self._lock:
+            best = None
+            for key, entry in self._entries.items():
+                if len(key) < len(text) and text.startswith(key) and (best is None or len(key) > len(best.text)):
+                    best = entry
+            if best is not None:
+                self._entries.move_to_end(best.text)
+            return best
+
+
+class SessionCache(KVCacheLRU):
+    """
+    KV-состояние диалога каждого игрока после предыдущего хода, ключ — user_id.
+    Если новая история продолжает закэшированную, префиллятся только новые токены.
+    Общий бюджет памяти делится между всеми игроками по LRU.
+    """
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            if self._pop(user_id) is not None:
+                logger.info(f"Сброшен KV-кэш диалога пользователя {user_id}")
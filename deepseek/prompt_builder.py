@@ -0,0 +1,210 @@
+import functools
+import logging
+import re
+import threading
+from typing import Callable, Dict, List, Optional
+
+from config import PROMPT_MAX_TOKENS, PROMPT_TOKEN_CACHE_SIZE, PROMPT_TOKENIZER
+from utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+
+
+class TokenCounter:
+    """
+    Счётчик токенов промпта токенизатором модели. Длины кэшируются по тексту (LRU на cache_size строк):
+    системный промпт, описания стран и строки истории повторяются от хода к ходу.
+    Пока токенизатор не загружен (или не задан PROMPT_TOKENIZER), используется estimate_tokens.
+    Токенизатор — собственный экземпляр, не бэкенда: быстрый токенизатор HF нельзя вызывать из нескольких
+    потоков сразу («Already borrowed»), а счётчик зовут потоки пула и to_thread, пока бэкенд генерирует.
+    Вызовы своего экземпляра тоже идут под блокировкой.
+    """
+
+    def __init__(self, tokenizer_name: str = PROMPT_TOKENIZER, cache_size: int = PROMPT_TOKEN_CACHE_SIZE):
+        self.tokenizer_name = tokenizer_name
+        self.tokenizer = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._encode_lock = threading.Lock()
+        self.count = functools.lru_cache(maxsize=cache_size)(self._count)
+
+    def load(self):
+        """
+        Загружает токенизатор (блокирующе, один раз). Ошибка загрузки не фатальна — остаётся оценка по символам.
+        """
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not self.tokenizer_name:
+                logger.info("Токенизатор для бюджета промпта не задан, длины оцениваются по символам")
+                return
+            try:
+                from transformers import AutoTokenizer
+
+                self.use_tokenizer(AutoTokenizer.from_pretrained(self.tokenizer_name))
+            except Exception as e:
+                logger.warning(f"Не удалось загрузить токенизатор {self.tokenizer_name}: {str(e)}. Оценка по символам.")
+
+    def use_tokenizer(self, tokenizer):
+        """
+        Переключает счётчик на уже загруженный токенизатор. Токенизатор не должен использоваться больше нигде.
+        """
+        self.tokenizer = tokenizer
+        self._loaded = True
+        # Закэшированные оценки по символам больше не годятся
+        self.count.cache_clear()
+
+    def _count(self, text: str) -> int:
+        if self.tokenizer is None:
+            return estimate_tokens(text)
+        with self._encode_lock:
+            return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+
+token_counter = TokenCounter()
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Делит текст на предложения по концу предложения и пробелу за ним.
+    """
+    return [s for s in SENTENCE_END.split(text.strip()) if s]
+
+
+def first_sentence(text: str, max_words: int = 20) -> str:
+    """
+    Первое предложение текста, не длиннее max_words слов.
+    """
+    sentences = split_sentences(text)
+    words = (sentences[0] if sentences else "").split()
+    return " ".join(words[:max_words]) + ("…" if len(words) > max_words else "")
+
+
+def summarize_turns(turns: List[str]) -> str:
+    """
+    Извлекающая сводка выпавших из бюджета ходов летописи: по первому предложению каждого хода.
+    """
+    return "Ранее в летописи: " + " ".join(first_sentence(turn) for turn in turns)
+
+
+class PromptSection:
+    """
+    Раздел промпта из единиц (строк, предложений, ходов), которые убираются целиком.
+    priority — чем больше число, тем раньше раздел режется при нехватке общего бюджета; раздел с keep="all"
+    не режется никогда. max_tokens — собственный бюджет раздела (None — без ограничения).
+    keep — какие единицы оставлять при обрезке: "head" — первые (самые важные), "tail" — последние (свежие).
+    summarize — функция, сворачивающая выброшенные единицы в одну строку; строка ставится перед оставленными,
+    если помещается в бюджет.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        units: List[str],
+        priority: int = 0,
+        max_tokens: Optional[int] = None,
+        keep: str = "all",
+        separator: str = "\n",
+        summarize: Callable[[List[str]], str] = None,
+    ):
+        self.name = name
+        self.units = list(units)
+        self.priority = priority
+        self.max_tokens = max_tokens
+        self.keep = keep
+        self.separator = separator
+        self.summarize = summarize
+        self.kept = list(self.units)
+        self.summary = None
+        self.original_tokens = 0
+        self.tokens = 0
+
+    @property
+    def text(self) -> str:
+        return self.separator.join(([self.summary] if self.summary else []) + self.kept)
+
+    @property
+    def trimmed(self) -> bool:
+        return len(self.kept) < len(self.units)
+
+
+class PromptBuilder:
+    """
+    Укладывает разделы промпта в бюджет токенов. Сначала каждый раздел обрезается до своего max_tokens,
+    затем, если сумма больше max_tokens сборщика, разделы режутся от самого низкого приоритета к высокому.
+    Разбивка по разделам пишется в лог на каждый промпт.
+    """
+
+    def __init__(self, max_tokens: int = PROMPT_MAX_TOKENS, counter: TokenCounter = token_counter):
+        self.max_tokens = max_tokens
+        self.counter = counter
+
+    def measure(self, units: List[str], separator: str = "\n") -> int:
+        if not units:
+            return 0
+        return sum(self.counter.count(unit) for unit in units) + (len(units) - 1) * self.counter.count(separator)
+
+    def _trim(self, section: PromptSection, limit: int):
+        """
+        Оставляет в разделе столько единиц с нужного конца, сколько влезает в limit токенов,
+        и, если есть место, сводку выброшенных.
+        """
+        if section.keep == "all" or section.tokens <= limit:
+            return
+        units = section.units if section.keep == "head" else section.units[::-1]
+        kept, used = [], 0
+        separator_cost = self.counter.count(section.separator)
+        for unit in units:
+            cost = self.counter.count(unit) + (separator_cost if kept else 0)
+            if used + cost > limit:
+                break
+            kept.append(unit)
+            used += cost
+        if section.keep == "tail":
+            kept.reverse()
+        section.kept, section.summary = kept, None
+        if section.summarize is not None and section.trimmed:
+            if section.keep == "tail":
+                dropped = section.units[: len(section.units) - len(kept)]
+            else:
+                dropped = section.units[len(kept) :]
+            summary = section.summarize(dropped)
+            cost = self.counter.count(summary) + (separator_cost if kept else 0)
+            if used + cost <= limit:
+                section.summary = summary
+                used += cost
+        section.tokens = used
+
+    def fit(self, sections: List[PromptSection], label: str = "") -> Dict[str, PromptSection]:
+        """
+        Обрезает разделы по бюджетам и возвращает их по имени.
+        """
+        for section in sections:
+            section.tokens = section.original_tokens = self.measure(section.units, section.separator)
+            if section.max_tokens is not None:
+                self._trim(section, section.max_tokens)
+
+        overflow = sum(section.tokens for section in sections) - self.max_tokens
+        for section in sorted(sections, key=lambda s: -s.priority):
+            if overflow <= 0:
+                break
+            before = section.tokens
+            self._trim(section, max(0, before - overflow))
+            overflow -= before - section.tokens
+
+        total = sum(section.tokens for section in sections)
+        title = f"Промпт ({label})" if label else "Промпт"
+        breakdown = ", ".join(
+            f"{s.name} {s.tokens}" + (f"/{s.original_tokens}" if s.trimmed else "") + (" (сводка)" if s.summary else "")
+            for s in sections
+        )
+        logger.info(f"{title}: {breakdown} — всего {total} из {self.max_tokens} ток.")
+        if overflow > 0:
+            logger.warning(f"{title} больше бюджета на {overflow} ток.: обязательные разделы не режутся")
+        return {section.name: section for section in sections}
+
+
+prompt_builder = PromptBuilder()
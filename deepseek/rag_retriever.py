@@ -1,8 +1,25 @@
+import asyncio
 import logging
-from typing import Tuple
+import re
+from typing import Dict, List, Tuple
 
+from config import (
+    HISTORY_LIMIT,
+    HISTORY_WINDOW_STEP,
+    RAG_CONTEXT_TOKENS,
+    RAG_MIN_ASPECT_SCORE,
+    RAG_MODE,
+    RAG_SEMANTIC_MIN_SCORE,
+    RAG_SEMANTIC_TIMEOUT_MS,
+    RAG_SEMANTIC_TOP_K,
+    RAG_TOP_ASPECTS,
+)
 from database import *
 from game import ASPECTS
+from metrics import RAG_LOOKUP_SECONDS
+from prompt_builder import token_counter
+from semantic_index import semantic_index
+from text_matching import trie_regex
 
 logger = logging.getLogger("detect_aspect_and_country")
 
@@ -88,52 +105,72 @@ ASPECT_SYNONYMS = {
 ALL_MARKERS = ["все", "други", "сосед", "проч", "остальны", "существующ"]
 
 
-async def detect_aspect_and_country(user_id: int, user_text: str) -> Tuple[str, str]:
+class AspectScorer:
     """
-    Определяет аспект и страну из текста пользователя.
-    По умолчанию: аспект = "описание", страна = собственная.
+    Многозначная классификация сообщения по аспектам.
+    Все основы из ASPECT_SYNONYMS собраны в одно выражение по префиксному дереву и индекс основа -> аспекты;
+    текст просматривается один раз. Каждое найденное вхождение (из начинающихся в одном месте — самое длинное)
+    добавляет аспекту вес 1, а основа, общая для нескольких аспектов, делит вес между ними.
+    """
+
+    def __init__(self, synonyms=ASPECT_SYNONYMS):
+        self.order = list(synonyms)
+        self.index = {}
+        for aspect, stems in synonyms.items():
+            for stem in stems:
+                self.index.setdefault(stem, []).append(aspect)
+        self.pattern = re.compile(trie_regex(self.index))
+
+    def score(self, text: str) -> Dict[str, float]:
+        """
+        Вес каждого найденного аспекта в тексте (в нижнем регистре).
+        """
+        scores = {}
+        for match in self.pattern.finditer(text):
+            aspects = self.index[match.group(0)]
+            for aspect in aspects:
+                scores[aspect] = scores.get(aspect, 0.0) + 1.0 / len(aspects)
+        return scores
+
+    def top(self, text: str, top_k: int = RAG_TOP_ASPECTS, threshold: float = RAG_MIN_ASPECT_SCORE) -> List[str]:
+        """
+        До top_k аспектов с весом не ниже threshold, от самого весомого; при равном весе — в порядке ASPECT_SYNONYMS.
+        """
+        scores = self.score(text)
+        ranked = sorted(scores, key=lambda aspect: (-scores[aspect], self.order.index(aspect)))
+        return [aspect for aspect in ranked if scores[aspect] >= threshold][:top_k]
+
+
+aspect_scorer = AspectScorer()
+
+
+async def detect_aspects_and_country(user_id: int, user_text: str) -> Tuple[List[str], str]:
+    """
+    Определяет аспекты и страну из текста пользователя.
+    По умолчанию: аспекты = ["описание"], страна = собственная.
     """
     ut = user_text.lower()
-    logger.info(f"detect_aspect_and_country: user_id={user_id}, user_text='{user_text}' (ut='{ut}')")
-    aspect = "описание"
-    all_country_names = await get_all_country_names()
-    logger.info(f"Все названия стран (основные): {all_country_names}")
+    logger.info(f"detect_aspects_and_country: user_id={user_id}, user_text='{user_text}' (ut='{ut}')")
     country_name = await get_user_country(user_id)
     logger.info(f"Страна пользователя по умолчанию: {country_name}")
 
-    # Найти аспект по ключевым словам
-    aspect_found = False
-    for asp, synonyms in ASPECT_SYNONYMS.items():
-        for word in synonyms:
-            if word in ut:
-                aspect = asp
-                aspect_found = True
-                logger.info(f"Найден аспект '{aspect}' по синониму '{word}' в тексте '{user_text}'")
-                break
-        if aspect_found:
-            break
-    if not aspect_found:
+    # Аспекты по взвешенным совпадениям основ
+    scores = aspect_scorer.score(ut)
+    aspects = aspect_scorer.top(ut)
+    if aspects:
+        logger.info(f"Найдены аспекты {aspects} (веса {scores}) в тексте '{user_text}'")
+    else:
+        aspects = ["описание"]
         logger.info("Аспект не найден, используется 'описание'")
 
-    country_variants = await get_all_country_synonyms_and_names()
-    logger.info(f"country_variants (все варианты поиска): {country_variants}")
+    # Все упоминания стран за один проход; из пересекающихся берётся самое длинное
+    mentions = await find_country_mentions(ut)
+    logger.info(f"Упоминания стран в тексте: {mentions}")
 
     country_found = None
-    for var, canonical in country_variants:
-        if not var:
-            continue
-        # Пробуем: полное совпадение, совпадение без последней буквы, без двух последних букв
-        lowers = [var, var[:-1], var[:-2]] if len(var) > 3 else [var]
-        for form in lowers:
-            if form and form in ut:
-                logger.info(
-                    f"В тексте '{ut}' найдено упоминание страны/синонима '{form}' "
-                    f"(оригинал: '{var}', каноническое: '{canonical}')"
-                )
-                country_found = canonical
-                break
-        if country_found:
-            break
+    if mentions:
+        start, end, country_found = mentions[0]
+        logger.info(f"В тексте '{ut}' найдено упоминание страны '{ut[start:end]}' (каноническое: '{country_found}')")
 
     if country_found:
         logger.debug(f"Итоговая страна (поиск по тексту): {country_found}")
@@ -149,15 +186,23 @@ async def detect_aspect_and_country(user_id: int, user_text: str) -> Tuple[str,
         if not all_marker_found:
             logger.debug("Страна не найдена в тексте и не найден маркер, используется страна пользователя")
 
-    logger.debug(f"Результат: aspect={aspect}, country_name={country_name}")
-    return aspect, country_name
+    logger.debug(f"Результат: aspects={aspects}, country_name={country_name}")
+    return aspects, country_name
 
 
-async def get_rag_context(user_id: int, user_text: str) -> str:
-    logger.info(f"get_rag_context: user_id={user_id}, user_text='{user_text}'")
-    aspect, country = await detect_aspect_and_country(user_id, user_text)
-    logger.info(f"get_rag_context: detect_aspect_and_country вернул aspect={aspect}, country={country}")
+async def detect_aspect_and_country(user_id: int, user_text: str) -> Tuple[str, str]:
+    """
+    Определяет самый весомый аспект и страну из текста пользователя.
+    По умолчанию: аспект = "описание", страна = собственная.
+    """
+    aspects, country_name = await detect_aspects_and_country(user_id, user_text)
+    return aspects[0], country_name
+
 
+async def _aspect_context(aspect: str, country: str) -> str:
+    """
+    Блок контекста по одному аспекту (или описанию) для страны или для всех стран.
+    """
     if country == "все":
         if aspect == "описание":
             # Получить описания всех стран
@@ -204,3 +249,91 @@ async def get_rag_context(user_id: int, user_text: str) -> str:
     if value and value.strip():
         return f"{aspect_label} страны {country}: {value.strip()}"
     return ""
+
+
+def fit_to_budget(blocks: List[str], budget: int) -> str:
+    """
+    Склеивает блоки контекста по порядку важности, пока они укладываются в budget токенов.
+    Блок, который не помещается целиком, обрезается по строкам (если от него остаётся не только заголовок).
+    """
+    parts, used = [], 0
+    for block in blocks:
+        lines = block.split("\n")
+        kept = []
+        for line in lines:
+            cost = token_counter.count(line)
+            if used + cost > budget:
+                break
+            kept.append(line)
+            used += cost
+        if len(kept) == len(lines) or len(kept) > 1:
+            parts.append("\n".join(kept))
+        if len(kept) < len(lines):
+            logger.info(f"Контекст RAG обрезан по бюджету {budget} токенов")
+            break
+    return "\n\n".join(parts)
+
+
+async def _semantic_blocks(user_id: int, user_text: str, country: str, aspects: List[str]) -> List[str]:
+    """
+    Блоки контекста из семантического индекса: ближайшие к сообщению описания и аспекты страны country
+    (всех стран, если country == "все"), кроме уже взятых по ключевым словам aspects, и ходы летописи
+    самого игрока старше тех, что попадут в промпт историей. Поиск не дольше RAG_SEMANTIC_TIMEOUT_MS.
+    """
+    if country == "все":
+        names = {row[0]: row[1] for row in await get_all_active_countries()}
+    else:
+        owner = await get_user_id_by_country(country) if country else None
+        names = {owner: country} if owner else {}
+    # Окно истории в промпте бывает длиной до HISTORY_LIMIT + HISTORY_WINDOW_STEP - 1 строк
+    recent_seq = semantic_index.last_turn_seq(user_id) - (HISTORY_LIMIT + HISTORY_WINDOW_STEP - 1)
+
+    def where(doc):
+        if doc["kind"] == "ход":
+            return doc["user_id"] == user_id and doc["seq"] <= recent_seq
+        return doc["user_id"] in names and doc["kind"] not in aspects
+
+    try:
+        found = await asyncio.wait_for(
+            asyncio.to_thread(
+                semantic_index.search,
+                user_text,
+                RAG_SEMANTIC_TOP_K,
+                RAG_SEMANTIC_MIN_SCORE,
+                {user_id, *names},
+                where,
+            ),
+            RAG_SEMANTIC_TIMEOUT_MS / 1000,
+        )
+    except asyncio.TimeoutError:
+        logger.warning(f"Семантический поиск не уложился в {RAG_SEMANTIC_TIMEOUT_MS} мс, контекст без него")
+        return []
+    logger.info(f"Семантический поиск: {[(key, round(score, 3)) for score, key, _ in found]}")
+
+    blocks = []
+    for _, _, doc in found:
+        if doc["kind"] == "ход":
+            blocks.append(f"Из летописи: {TURN_PREFIXES[doc['role']]}: {doc['text']}")
+        elif doc["kind"] == "описание":
+            blocks.append(f"Описание страны {names[doc['user_id']]}: {doc['text']}")
+        else:
+            aspect_label = next((label for code, label, _ in ASPECTS if code == doc["kind"]), doc["kind"])
+            blocks.append(f"{aspect_label} страны {names[doc['user_id']]}: {doc['text']}")
+    return blocks
+
+
+@RAG_LOOKUP_SECONDS.time()
+async def get_rag_context(user_id: int, user_text: str, budget: int = RAG_CONTEXT_TOKENS, mode: str = RAG_MODE) -> str:
+    """
+    Контекст RAG для сообщения в пределах budget токенов. В режиме "semantic" к блокам по ключевым словам
+    добавляются находки семантического поиска; если ключевые слова ничего не дали, находки идут раньше описания.
+    """
+    logger.info(f"get_rag_context: user_id={user_id}, user_text='{user_text}'")
+    aspects, country = await detect_aspects_and_country(user_id, user_text)
+    logger.info(f"get_rag_context: detect_aspects_and_country вернул aspects={aspects}, country={country}")
+    blocks = [await _aspect_context(aspect, country) for aspect in aspects]
+    if mode == "semantic":
+        found = await _semantic_blocks(user_id, user_text, country, aspects)
+        blocks = found + blocks if aspects == ["описание"] else blocks + found
+    # Строки считает токенизатор — вне event loop бота
+    return await asyncio.to_thread(fit_to_budget, [block for block in blocks if block], budget)
@@ -0,0 +1,384 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from config import (
+    SEMANTIC_INDEX_DIM,
+    SEMANTIC_INDEX_PATH,
+    SEMANTIC_INDEX_SAVE_INTERVAL,
+    SEMANTIC_MODEL,
+    SEMANTIC_TURNS_PER_USER,
+)
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r"\w+")
+# Служебные слова есть почти в любом тексте и только размывают сходство
+STOP_WORDS = frozenset(
+    "что как про для это эта эти этот так или нас наш наша наше наши нам вас ваш ваша ваши его она они оно "
+    "при также тот там тут где когда чтобы был была были быть есть нет уже ещё все всё меня мне мой моя мои "
+    "тебя тебе свой своя свои над под без через".split()
+)
+
+
+class HashingEncoder:
+    """
+    Векторы текстов без обученной модели: грубые основы слов (без двух последних букв) и символьные
+    триграммы слов (ловят падежные формы: «золото» и «золота» делят большую часть триграмм)
+    хэшируются в dim ячеек со знаком; короткие и служебные слова пропускаются.
+    Хэш crc32 не зависит от запуска, поэтому сохранённые векторы остаются годными. Векторы нормированы.
+    """
+
+    def __init__(self, dim: int = SEMANTIC_INDEX_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    @staticmethod
+    def features(text: str):
+        for word in WORD_RE.findall(text.lower()):
+            if len(word) < 3 or word in STOP_WORDS:
+                continue
+            yield word[: max(3, len(word) - 2)]
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                yield padded[i : i + 3]
+
+    def encode(self, texts) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in self.features(text)), dtype=np.uint32)
+            # Старший бит хэша задаёт знак: случайные коллизии чаще гасят друг друга, чем складываются
+            np.add.at(vectors[row], hashes % self.dim, np.where(hashes & 0x80000000, 1.0, -1.0))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class TransformerEncoder:
+    """
+    Векторы небольшой моделью предложений на CPU (средние скрытые состояния по токенам).
+    Модель грузится при создании; transformers и torch импортируются только здесь.
+    """
+
+    def __init__(self, model_name: str):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self.torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).eval()
+        self.dim = self.model.config.hidden_size
+        self.name = model_name
+
+    def encode(self, texts) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        batch = self.tokenizer(list(texts), padding=True, truncation=True, max_length=256, return_tensors="pt")
+        with self.torch.no_grad():
+            hidden = self.model(**batch).last_hidden_state
+        mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        vectors = ((hidden * mask).sum(1) / mask.sum(1).clamp(min=1)).numpy().astype(np.float32)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def create_encoder():
+    """
+    Модель из SEMANTIC_MODEL, если она задана и загружается; иначе хэширующий кодировщик.
+    """
+    if SEMANTIC_MODEL:
+        try:
+            return TransformerEncoder(SEMANTIC_MODEL)
+        except Exception as e:
+            logger.warning(f"Модель {SEMANTIC_MODEL} для семантического индекса не загрузилась ({e}), беру хэширование")
+    return HashingEncoder()
+
+
+class SemanticIndex:
+    """
+    Векторный индекс текстов мира для RAG: описаний стран, значений аспектов и ходов летописи.
+    Документ — запись с ключом ("desc:<user_id>", "aspect:<user_id>:<код>", "turn:<user_id>:<seq>"),
+    его вектор — строка матрицы; поиск — косинусная близость одним умножением матрицы на вектор запроса.
+    Функции записи database.py после commit ставят обновления в очередь submit(): векторы считает единственный
+    поток индекса (кодировщик-модель не занимает event loop бота), записи применяются в порядке постановки.
+    Изменения массивов и документов и выборка кандидатов при поиске идут под блокировкой, кодирование — вне её.
+    На диск индекс сохраняется периодически (autosave) и при остановке, а при запуске сверяется с базой
+    (database.sync_semantic_index).
+    """
+
+    def __init__(self, path: str = SEMANTIC_INDEX_PATH, encoder=None, turns_per_user: int = SEMANTIC_TURNS_PER_USER):
+        self.path = path
+        self._encoder = encoder
+        self.turns_per_user = turns_per_user
+        self.docs = {}  # ключ -> {"row", "user_id", "kind", "text", для ходов ещё "seq" и "role"}
+        self.keys = []  # строка матрицы -> ключ (None — строка свободна)
+        self.matrix = None
+        self.owners = None  # строка матрицы -> user_id документа (-1 — строка свободна)
+        self._free = []
+        self._turns = defaultdict(list)  # user_id -> ключи его ходов по возрастанию seq
+        self.dirty = False
+        self._autosave_task = None
+        self._lock = threading.RLock()
+        self._encoder_lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="semantic-index")
+
+    @property
+    def encoder(self):
+        with self._encoder_lock:
+            if self._encoder is None:
+                self._encoder = create_encoder()
+            return self._encoder
+
+    def __len__(self):
+        return len(self.docs)
+
+    def stats(self) -> dict:
+        return {
+            "docs": len(self.docs),
+            "rows": len(self.keys),
+            "mbytes": 0 if self.matrix is None else self.matrix.nbytes / 2**20,
+            "encoder": self.encoder.name,
+        }
+
+    # ==== Запись ====
+
+    def submit(self, func, *args):
+        """
+        Ставит func(*args) (upsert_many, remove, remove_turns...) в очередь потока индекса и возвращает Future.
+        Ошибка записи пишется в лог, вызывающему ждать не нужно.
+        """
+        future = self._writer.submit(func, *args)
+        future.add_done_callback(_log_write_error)
+        return future
+
+    async def run(self, func, *args):
+        """
+        То же, что submit, но с ожиданием результата.
+        """
+        return await asyncio.wrap_future(self.submit(func, *args))
+
+    def upsert_many(self, docs):
+        """
+        Добавляет или обновляет документы: итерируемое из (ключ, user_id, вид, текст, доп. поля или None).
+        Пустой текст удаляет документ; векторы считаются только для новых и изменившихся текстов.
+        """
+        changed = []
+        for key, user_id, kind, text, extra in docs:
+            text = (text or "").strip()
+            if not text:
+                self.remove(key)
+                continue
+            doc = self.docs.get(key)
+            if doc is not None and doc["text"] == text:
+                continue
+            changed.append((key, {"user_id": user_id, "kind": kind, "text": text, **(extra or {})}))
+        if not changed:
+            return
+        unique = list(dict.fromkeys(doc["text"] for _, doc in changed))
+        vectors = dict(zip(unique, self.encoder.encode(unique)))
+        with self._lock:
+            for key, doc in changed:
+                user_id = doc["user_id"]
+                old = self.docs.get(key)
+                doc["row"] = old["row"] if old is not None else self._allocate(key)
+                self.matrix[doc["row"]] = vectors[doc["text"]]
+                self.owners[doc["row"]] = user_id
+                self.docs[key] = doc
+                if old is None and doc["kind"] == "ход":
+                    self._add_turn(doc["user_id"], key)
+            self.dirty = True
+
+    def upsert(self, key: str, user_id: int, kind: str, text, **extra):
+        self.upsert_many([(key, user_id, kind, text, extra)])
+
+    def remove(self, key: str):
+        with self._lock:
+            doc = self.docs.pop(key, None)
+            if doc is None:
+                return
+            self.matrix[doc["row"]] = 0.0
+            self.owners[doc["row"]] = -1
+            self.keys[doc["row"]] = None
+            self._free.append(doc["row"])
+            if doc["kind"] == "ход":
+                self._turns[doc["user_id"]].remove(key)
+            self.dirty = True
+
+    def remove_turns(self, user_id: int):
+        with self._lock:
+            for key in list(self._turns.get(user_id, [])):
+                self.remove(key)
+            self._turns.pop(user_id, None)
+
+    def last_turn_seq(self, user_id: int) -> int:
+        with self._lock:
+            turns = self._turns.get(user_id)
+            return self.docs[turns[-1]]["seq"] if turns else 0
+
+    def _allocate(self, key: str) -> int:
+        if self._free:
+            row = self._free.pop()
+            self.keys[row] = key
+            return row
+        if self.matrix is None:
+            self._resize(64)
+        if len(self.keys) == len(self.matrix):
+            self._resize(2 * len(self.matrix))
+        self.keys.append(key)
+        return len(self.keys) - 1
+
+    def _resize(self, capacity: int):
+        # Новые массивы, а не resize на месте: поиск в другом потоке дочитывает старые
+        matrix = np.zeros((capacity, self.encoder.dim), dtype=np.float32)
+        owners = np.full(capacity, -1, dtype=np.int64)
+        if self.matrix is not None:
+            matrix[: len(self.keys)] = self.matrix[: len(self.keys)]
+            owners[: len(self.keys)] = self.owners[: len(self.keys)]
+        self.matrix, self.owners = matrix, owners
+
+    def _add_turn(self, user_id: int, key: str):
+        turns = self._turns[user_id]
+        turns.append(key)
+        turns.sort(key=lambda k: self.docs[k]["seq"])
+        # Хранятся только последние ходы каждого игрока
+        while len(turns) > self.turns_per_user:
+            self.remove(turns[0])
+
+    # ==== Поиск ====
+
+    def search(self, query: str, top_k: int, min_score: float = 0.0, user_ids=None, where=None):
+        """
+        До top_k самых близких к query документов со сходством не ниже min_score: список
+        (сходство, ключ, документ), от самого близкого. user_ids оставляет только документы этих игроков
+        (отбор векторный, по всей матрице сразу), where(doc) — произвольное условие для кандидатов.
+        Можно вызывать из другого потока: запрос кодируется вне блокировки, а сходство и выборка документов
+        считаются под ней, так что строки матрицы, ключи и документы согласованы (запись ждёт конца выборки).
+        """
+        if self.matrix is None:
+            return []
+        query_vector = self.encoder.encode([query])[0]
+        with self._lock:
+            rows = len(self.keys)
+            if not rows:
+                return []
+            scores = self.matrix[:rows] @ query_vector
+            if user_ids is not None:
+                scores[~np.isin(self.owners[:rows], list(user_ids))] = 0.0
+            # Сортируются только кандидаты выше порога, а не вся матрица
+            candidates = np.flatnonzero(scores >= max(min_score, 1e-6))
+            found = []
+            for row in candidates[np.argsort(-scores[candidates])]:
+                if len(found) >= top_k:
+                    break
+                key = self.keys[row]
+                doc = self.docs.get(key) if key else None
+                if doc is not None and (where is None or where(doc)):
+                    found.append((float(scores[row]), key, doc))
+            return found
+
+    # ==== Диск ====
+
+    def _snapshot(self):
+        with self._lock:
+            rows = [doc["row"] for doc in self.docs.values()]
+            vectors = self.matrix[rows] if rows else np.zeros((0, self.encoder.dim), dtype=np.float32)
+            meta = {"encoder": self.encoder.name, "docs": [{"key": key, **doc} for key, doc in self.docs.items()]}
+            self.dirty = False
+        return vectors, meta
+
+    def save(self):
+        """
+        Сохраняет векторы и документы в один .npz (через временный файл, чтобы не оставить полузаписанный).
+        """
+        self._write(*self._snapshot())
+
+    def _write(self, vectors, meta):
+        started = time.perf_counter()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, vectors=vectors, meta=np.array(json.dumps(meta, ensure_ascii=False)))
+        os.replace(tmp_path, self.path)
+        logger.info(
+            f"Семантический индекс сохранён: {len(meta['docs'])} документов, "
+            f"{(time.perf_counter() - started) * 1000:.0f} мс"
+        )
+
+    def load(self) -> bool:
+        """
+        Загружает индекс с диска. False — файла нет, он повреждён или посчитан другим кодировщиком.
+        """
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with np.load(self.path) as data:
+                vectors = data["vectors"]
+                meta = json.loads(str(data["meta"]))
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать семантический индекс {self.path}: {e}")
+            return False
+        if meta["encoder"] != self.encoder.name:
+            logger.info(f"Семантический индекс посчитан {meta['encoder']}, а не {self.encoder.name}: пересчёт")
+            return False
+        with self._lock:
+            self.docs, self.keys, self._free = {}, [], []
+            self._turns = defaultdict(list)
+            self.matrix = None
+            self._resize(max(64, len(vectors)))
+            self.matrix[: len(vectors)] = vectors
+            for row, doc in enumerate(meta["docs"]):
+                key = doc.pop("key")
+                doc["row"] = row
+                self.docs[key] = doc
+                self.keys.append(key)
+                self.owners[row] = doc["user_id"]
+                if doc["kind"] == "ход":
+                    self._turns[doc["user_id"]].append(key)
+            for turns in self._turns.values():
+                turns.sort(key=lambda k: self.docs[k]["seq"])
+            self.dirty = False
+        logger.info(f"Семантический индекс загружен: {len(self.docs)} документов")
+        return True
+
+    async def save_async(self):
+        """
+        Сохраняет индекс в потоке индекса — после уже поставленных записей, не занимая event loop.
+        """
+        await self.run(self._save_if_dirty)
+
+    def _save_if_dirty(self):
+        if self.dirty:
+            self.save()
+
+    def start_autosave(self, interval: float = SEMANTIC_INDEX_SAVE_INTERVAL):
+        async def autosave():
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self.save_async()
+                except Exception as e:
+                    logger.error(f"Ошибка сохранения семантического индекса: {e}", exc_info=True)
+
+        self._autosave_task = asyncio.create_task(autosave())
+
+    async def stop(self):
+        if self._autosave_task is not None:
+            self._autosave_task.cancel()
+            self._autosave_task = None
+        # Поставленные записи применяются до сохранения: очередь потока индекса идёт по порядку
+        await self.save_async()
+        self._writer.shutdown()
+
+
+def _log_write_error(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Ошибка записи в семантический индекс: {future.exception()}", exc_info=future.exception())
+
+
+semantic_index = SemanticIndex()
@@ -0,0 +1,48 @@
+import torch
+from transformers import StoppingCriteria
+
+from utils import StopStringScanner
+
+
+class SentinelStoppingCriteria(StoppingCriteria):
+    """
+    Останавливает строки пачки, как только в ответе (после </think>, если модель рассуждает)
+    встретилась стоп-метка с непустым текстом перед ней. Всё, что после метки,
+    clean_ai_response всё равно отрезал бы, поэтому видимый ответ не меняется.
+    stop_strings — кортеж меток для каждой строки пачки (None — не останавливать).
+    Ответ каждой строки декодируется инкрементально: на шаге декодируются только токены после
+    последнего завершённого символа, а метки ищет StopStringScanner лишь в новом тексте.
+    """
+
+    def __init__(self, tokenizer, prompt_length, stop_strings, wait_for_think=True):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.stop_strings = stop_strings
+        self.wait_for_think = wait_for_think
+        # Сколько токенов было сгенерировано, когда строка остановилась по метке
+        self.stopped_at = [None] * len(stop_strings)
+        self._scanners = [StopStringScanner(stops, wait_for_think) if stops else None for stops in stop_strings]
+        # Окно инкрементального декодирования строки: [prefix_offset, read_offset) уже выдано текстом
+        self._offsets = [(0, 0)] * len(stop_strings)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        generated = input_ids.shape[1] - self.prompt_length
+        for row, scanner in enumerate(self._scanners):
+            if scanner is not None and self.stopped_at[row] is None and scanner.feed(self._new_text(input_ids, row)):
+                self.stopped_at[row] = generated
+        return torch.tensor([s is not None for s in self.stopped_at], dtype=torch.bool, device=input_ids.device)
+
+    def _new_text(self, input_ids, row) -> str:
+        """
+        Текст, добавленный последними токенами строки. Декодируются несколько токенов перед новыми
+        (для пробелов и склейки символов) и сами новые; незаконченный многобайтовый символ
+        ждёт следующего токена.
+        """
+        prefix_offset, read_offset = self._offsets[row]
+        ids = input_ids[row, self.prompt_length + prefix_offset :].tolist()
+        prefix_text = self.tokenizer.decode(ids[: read_offset - prefix_offset], skip_special_tokens=True)
+        full_text = self.tokenizer.decode(ids, skip_special_tokens=True)
+        if full_text.endswith("\ufffd"):
+            return ""
+        self._offsets[row] = (read_offset, prefix_offset + len(ids))
+        return full_text[len(prefix_text) :]
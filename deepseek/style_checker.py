@@ -1,5 +1,12 @@
+import logging
+import os
 import re
 
+from config import MODERN_WORDS_FILE
+from text_matching import trie_regex
+
+logger = logging.getLogger(__name__)
+
 MODERN_WORDS = [
     # Городское/инфраструктура
     "метро",
@@ -190,15 +197,61 @@ MODERN_WORDS = [
 ]
 
 
+class ModernWordsMatcher:
+    """
+    Поиск запрещённых корней (совпадение только с начала слова) одним проходом по тексту:
+    все корни скомпилированы в одно регулярное выражение, длинные корни раньше коротких.
+    К встроенному списку добавляются корни из файла extra_path (по одному в строке, # — комментарий);
+    файл перечитывается, как только меняется, без перезапуска бота.
+    """
+
+    def __init__(self, roots=MODERN_WORDS, extra_path: str = MODERN_WORDS_FILE):
+        self.roots = list(roots)
+        self.extra_path = extra_path
+        self.extra_roots = []
+        self._extra_mtime = None
+        self._pattern = self._compile()
+
+    def _compile(self):
+        return re.compile(r"\b" + trie_regex(r.lower() for r in self.roots + self.extra_roots), re.IGNORECASE)
+
+    def _refresh(self):
+        try:
+            mtime = os.stat(self.extra_path).st_mtime if self.extra_path else None
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._extra_mtime:
+            return
+        try:
+            extra_roots = []
+            if mtime is not None:
+                with open(self.extra_path, encoding="utf-8") as f:
+                    extra_roots = [
+                        line.strip().lower() for line in f if line.strip() and not line.strip().startswith("#")
+                    ]
+        except OSError as e:
+            logger.warning(f"Не удалось прочитать корни из {self.extra_path}: {e}")
+            return
+        self.extra_roots = extra_roots
+        self._extra_mtime = mtime
+        self._pattern = self._compile()
+        logger.info(f"Загружено дополнительных корней из {self.extra_path}: {len(extra_roots)}")
+
+    def find_all(self, text: str):
+        """
+        Все найденные корни: список (начало, конец, корень) по порядку в тексте.
+        """
+        self._refresh()
+        return [(m.start(), m.end(), m.group(0).lower()) for m in self._pattern.finditer(text)]
+
+
+modern_words = ModernWordsMatcher()
+
+
 def contains_modern_words(text: str):
     """
     Если найден запрещённый корень — возвращает его (строку), иначе возвращает None.
     Совпадение только с начала слова.
     """
-    lower_text = text.lower()
-    words = re.findall(r"\b\w+", lower_text)
-    for player_word in words:
-        for modern_word in MODERN_WORDS:
-            if player_word.startswith(modern_word):
-                return modern_word
-    return None
+    hits = modern_words.find_all(text)
+    return hits[0][2] if hits else None
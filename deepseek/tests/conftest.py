@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# Модули бота лежат в каталоге deepseek и читают настройки из окружения при импорте:
+# тесты работают с временной базой, заглушкой вместо модели и без токенизатора
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_tmp = tempfile.mkdtemp(prefix="deepseek-tests-")
+os.environ.setdefault("BOT_TOKEN", "test")
+os.environ["DB_PATH"] = os.path.join(_tmp, "chats.db")
+os.environ["SEMANTIC_INDEX_PATH"] = os.path.join(_tmp, "semantic_index.npz")
+os.environ["INFERENCE_BACKEND"] = "fake"
+os.environ["PROMPT_TOKENIZER"] = ""
@@ -0,0 +1,59 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from backends import OpenAICompatibleBackend
+from batch_scheduler import GenerationRequest
+from utils import DIALOG_STOP_STRINGS
+
+# Сервер отдаёт по два токена в куске потока; ответ заканчивается выдуманной репликой игрока
+CHUNKS = ["</think>", "Стены", " растут,", " государь.", "\nИгрок:", " А ров?"]
+
+
+def serve(per_chunk_usage):
+    """
+    OpenAI-совместимый сервер, который стримит CHUNKS; usage приходит в каждом куске или не приходит вовсе.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for i, chunk in enumerate(CHUNKS, start=1):
+                event = {"choices": [{"text": chunk, "finish_reason": None}]}
+                if per_chunk_usage:
+                    event["usage"] = {"prompt_tokens": 10, "completion_tokens": 2 * i}
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.mark.parametrize("per_chunk_usage", [True, False])
+def test_early_stop_saves_only_counted_tokens(per_chunk_usage):
+    server = serve(per_chunk_usage)
+    try:
+        backend = OpenAICompatibleBackend(base_url=f"http://127.0.0.1:{server.server_port}/v1", model_name="test")
+        request = GenerationRequest("Игрок: Строим стены\nАссистент:", 100, stop_strings=DIALOG_STOP_STRINGS)
+        [result] = backend.generate_batch([request])
+    finally:
+        server.shutdown()
+
+    assert result.stop_reason == "stop_string"
+    assert backend.stop_stats["early_stops"] == 1
+    if per_chunk_usage:
+        # Остановка на пятом куске: сгенерировано 10 токенов, а не 5 кусков
+        assert backend.stop_stats["saved_tokens"] == 90
+        assert backend.stop_stats["uncounted_stops"] == 0
+    else:
+        assert backend.stop_stats["saved_tokens"] == 0
+        assert backend.stop_stats["uncounted_stops"] == 1
@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError
+from aiogram.methods import SendMessage
+
+from broadcast import Broadcaster, TokenBucket
+
+LONG_TEXT = "\n".join(["Гонцы приносят вести из дальних провинций." * 20] * 12)
+
+
+class FakeBot:
+    """
+    Бот без сети: failures — {chat_id: {номер сообщения в чат: фабрика исключения}}.
+    """
+
+    def __init__(self, failures=None):
+        self.failures = failures or {}
+        self.sent = {}
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        number = len(self.sent.setdefault(chat_id, []))
+        failure = self.failures.get(chat_id, {}).pop(number, None)
+        if failure is not None:
+            raise failure(SendMessage(chat_id=chat_id, text=text))
+        self.sent[chat_id].append(text)
+
+
+def blocked(method):
+    return TelegramForbiddenError(method, "Forbidden: bot was blocked by the user")
+
+
+def send(bot, chat_ids, text, **kwargs):
+    broadcaster = Broadcaster(bot, concurrency=4, rate=1000, chat_rate=1000, backoff=0, **kwargs)
+    return asyncio.run(broadcaster.send(chat_ids, text))
+
+
+def test_token_bucket_spaces_events():
+    async def main():
+        bucket = TokenBucket(rate=50)
+        started = time.monotonic()
+        for _ in range(6):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    # Первое событие сразу, остальные пять — через 1/rate
+    assert 0.09 <= asyncio.run(main()) < 0.5
+
+
+def test_broadcast_reports_statuses():
+    bot = FakeBot({2: {0: blocked}, 3: {0: lambda m: TelegramNetworkError(m, "Connection reset")}})
+    report = send(bot, [1, 2, 3], "Засуха")
+
+    assert sorted(report.sent) == [1, 3]
+    assert report.blocked == [2]
+    assert report.retries == 1
+    assert report.delivered == report.sent
+    assert bot.sent[3] == ["Засуха"]
+
+
+def test_failure_after_first_part_counts_as_delivered():
+    bot = FakeBot({2: {1: blocked}})
+    report = send(bot, [1, 2], LONG_TEXT)
+
+    assert report.sent == [1]
+    assert report.partial == [2]
+    assert report.blocked == []
+    assert sorted(report.delivered) == [1, 2]
+    assert len(bot.sent[2]) == 1 < len(bot.sent[1])
+    assert "доставлено не полностью: 1" in report.summary()
@@ -0,0 +1,204 @@
+import asyncio
+import json
+import sqlite3
+
+import pytest
+
+import database
+from db_pool import ConnectionPool
+
+# Схема chats.db до миграций (как её создавал init_db первых версий бота)
+BASELINE_SCHEMA = f"""
+CREATE TABLE chats (user_id INTEGER PRIMARY KEY, history TEXT);
+CREATE TABLE user_states (
+    user_id INTEGER PRIMARY KEY, country TEXT, country_desc TEXT, aspect_index INTEGER,
+    {", ".join(f'"{a}" TEXT' for a in database.ASPECT_CODES)}
+);
+CREATE TABLE country_synonyms (country TEXT, synonym TEXT UNIQUE);
+"""
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "chats.db")
+
+
+@pytest.fixture
+def baseline_db(db_path):
+    """
+    База старой версии: Египет игрока 1 с синонимом, синоним страны без игрока и JSON-история в chats.
+    """
+    with sqlite3.connect(db_path) as db:
+        db.executescript(BASELINE_SCHEMA)
+        db.execute("INSERT INTO user_states (user_id, country, country_desc) VALUES (1, 'Египет', 'Держава у реки')")
+        db.executemany(
+            "INSERT INTO country_synonyms (country, synonym) VALUES (?, ?)",
+            [("Египет", "Кемет"), ("Хатти", "Хетты")],
+        )
+        db.execute(
+            "INSERT INTO chats (user_id, history) VALUES (1, ?)",
+            (json.dumps(["Игрок: Строим стены", "Ассистент: Стены растут"], ensure_ascii=False),),
+        )
+    return db_path
+
+
+def run(db_path, monkeypatch, scenario):
+    """
+    Выполняет scenario() с пулом соединений к базе db_path вместо общего пула бота.
+    """
+    pool = ConnectionPool(db_path, size=2)
+    monkeypatch.setattr(database, "db_pool", pool)
+
+    async def main():
+        try:
+            await database.init_db()
+            return await scenario()
+        finally:
+            await pool.close()
+
+    return asyncio.run(main())
+
+
+def user_version(db_path) -> int:
+    with sqlite3.connect(db_path) as db:
+        return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def test_fresh_database_gets_all_migrations(db_path, monkeypatch):
+    async def scenario():
+        await database.set_user_country(7, "Вавилон")
+        return await database.get_user_id_by_country("ВАВИЛОН")
+
+    assert run(db_path, monkeypatch, scenario) == 7
+    assert user_version(db_path) == len(database.MIGRATIONS)
+
+
+def test_country_synonyms_migrate_to_countries(baseline_db, monkeypatch):
+    async def scenario():
+        return (
+            await database.get_user_id_by_country("египет"),
+            await database.get_country_by_synonym_or_name("кемет"),
+            await database.get_country_by_synonym_or_name("Хетты"),
+            await database.get_synonyms_for_country("Египет"),
+        )
+
+    owner, by_synonym, inactive, synonyms = run(baseline_db, monkeypatch, scenario)
+    assert owner == 1
+    assert by_synonym == "Египет"
+    assert inactive == "Хатти"
+    assert synonyms == ["Кемет"]
+    with sqlite3.connect(baseline_db) as db:
+        countries = dict(db.execute("SELECT country_key, name FROM countries"))
+        columns = [row[1] for row in db.execute("PRAGMA table_info(country_synonyms)")]
+    assert countries == {"египет": "Египет", "хатти": "Хатти"}
+    assert columns == ["synonym_key", "synonym", "country_key"]
+
+
+def test_migrations_are_applied_once(baseline_db, monkeypatch):
+    async def scenario():
+        # Второй запуск бота: все миграции уже применены, init_db ничего не ломает
+        await database.init_db()
+        return await database.get_user_id_by_country("Египет")
+
+    assert run(baseline_db, monkeypatch, scenario) == 1
+    assert user_version(baseline_db) == len(database.MIGRATIONS)
+
+
+def test_chats_history_migrates_to_turns(baseline_db, monkeypatch):
+    async def scenario():
+        migrated = await database.get_history(1)
+        await database.update_history(1, "Что соседи?", "Соседи молчат", 4)
+        return migrated, await database.get_history(1)
+
+    migrated, extended = run(baseline_db, monkeypatch, scenario)
+    assert migrated == ["Игрок: Строим стены", "Ассистент: Стены растут"]
+    assert extended == migrated + ["Игрок: Что соседи?", "Ассистент: Соседи молчат"]
+    with sqlite3.connect(baseline_db) as db:
+        tables = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        roles = [row[0] for row in db.execute("SELECT role FROM turns WHERE user_id = 1 ORDER BY seq")]
+    assert "chats" not in tables
+    assert roles == ["player", "assistant", "player", "assistant"]
+
+
+def test_history_window_and_reset(db_path, monkeypatch):
+    async def scenario():
+        for i in range(6):
+            await database.update_history(2, f"ход {i}", f"ответ {i}", 4)
+        window = await database.get_history(2, 4)
+        await database.clear_history(2)
+        await database.add_event_to_history(2, "Засуха")
+        return window, await database.get_history(2, 4)
+
+    window, after_reset = run(db_path, monkeypatch, scenario)
+    # Окно сдвигается скачками по HISTORY_WINDOW_STEP строк, но всегда держит последние history_limit
+    assert len(window) >= 4
+    assert window[-2:] == ["Игрок: ход 5", "Ассистент: ответ 5"]
+    assert len(window) == 12 - database.history_window_start(12, 4)
+    # Летопись после сброса начинается заново; событие пишется репликой летописца
+    assert after_reset == ["Ассистент: Засуха"]
+
+
+def test_history_window_start_moves_in_steps():
+    starts = [database.history_window_start(count, 4, 8) for count in range(0, 24, 2)]
+    assert starts == [0, 0, 0, 0, 0, 0, 8, 8, 8, 8, 16, 16]
+    assert [database.history_window_start(count, 4, 1) for count in (4, 6, 8)] == [0, 2, 4]
+
+
+def vm_steps(db, sql) -> int:
+    """
+    Сколько инструкций виртуальной машины SQLite (с точностью до 10) выполняет запрос.
+    """
+    steps = [0]
+
+    def count():
+        steps[0] += 10
+
+    db.set_progress_handler(count, 10)
+    db.execute(sql).fetchall()
+    db.set_progress_handler(None, 10)
+    return steps[0]
+
+
+def test_history_queries_use_indexes(db_path, monkeypatch):
+    """
+    Чтение окна истории и рассылка события на длинной летописи ищут по индексам turns:
+    ни полного просмотра таблицы, ни просмотра всех ходов игрока.
+    """
+    statements = []
+
+    async def scenario():
+        await database.clear_history(3)
+        with sqlite3.connect(db_path) as db:
+            db.executemany(
+                "INSERT INTO turns (user_id, seq, role, text) VALUES (3, ?, 'player', 'ход')",
+                [(seq,) for seq in range(2, 5002)],
+            )
+        async with database.db_pool.acquire() as db:
+            await db.set_trace_callback(statements.append)
+        window = await database.get_history(3, 4)
+        await database.add_event_to_history_many([3, 4], "Засуха")
+        async with database.db_pool.acquire() as db:
+            await db.set_trace_callback(None)
+        return window
+
+    # Одно соединение: трассировка видит все запросы
+    pool = ConnectionPool(db_path, size=1)
+    monkeypatch.setattr(database, "db_pool", pool)
+
+    async def main():
+        try:
+            await database.init_db()
+            return await scenario()
+        finally:
+            await pool.close()
+
+    assert 4 <= len(asyncio.run(main())) < 4 + database.HISTORY_WINDOW_STEP
+    queries = [sql for sql in statements if "turns" in sql and sql.lstrip().upper().startswith(("SELECT", "INSERT"))]
+    assert len(queries) >= 5
+    with sqlite3.connect(db_path) as db:
+        for sql in queries:
+            plan = [row[3] for row in db.execute(f"EXPLAIN QUERY PLAN {sql}")]
+            assert not any(step.startswith("SCAN turns") for step in plan), (sql, plan)
+            if sql.lstrip().upper().startswith("SELECT"):
+                # 5000 ходов игрока: запрос, перебирающий их, сделал бы десятки тысяч шагов
+                assert vm_steps(db, sql) < 1000, sql
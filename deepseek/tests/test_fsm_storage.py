@@ -0,0 +1,130 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+import database
+import fsm_storage
+from db_pool import ConnectionPool
+from fsm_storage import SQLiteStorage
+from handlers.fsm import RegisterCountry
+
+KEY = StorageKey(bot_id=42, chat_id=1, user_id=1)
+OTHER_KEY = StorageKey(bot_id=42, chat_id=1, user_id=1, destiny="other")
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "chats.db")
+
+
+def run(db_path, monkeypatch, scenario):
+    """
+    Выполняет scenario() с пулом соединений к базе db_path; таблица fsm_states создаётся init_db.
+    """
+    pool = ConnectionPool(db_path, size=2)
+    monkeypatch.setattr(database, "db_pool", pool)
+    monkeypatch.setattr(fsm_storage, "db_pool", pool)
+
+    async def main():
+        try:
+            await database.init_db()
+            return await scenario()
+        finally:
+            await pool.close()
+
+    return asyncio.run(main())
+
+
+def stored_keys(db_path):
+    with sqlite3.connect(db_path) as db:
+        return [row[0] for row in db.execute("SELECT key FROM fsm_states")]
+
+
+def test_state_and_data_follow_base_storage_contract(db_path, monkeypatch):
+    async def scenario():
+        storage = SQLiteStorage(flush_interval=3600)
+        await storage.start()
+        await storage.set_state(KEY, RegisterCountry.waiting_for_name)
+        state = await storage.get_state(KEY)
+        await storage.set_state(KEY, "Custom:raw")
+        raw_state = await storage.get_state(KEY)
+        await storage.set_data(KEY, {"country": "Египет"})
+        data = await storage.get_data(KEY)
+        data["country"] = "Испорчено"
+        updated = await storage.update_data(KEY, {"desc": "Держава у реки"})
+        result = (
+            state,
+            raw_state,
+            await storage.get_data(KEY),
+            updated,
+            await storage.get_state(OTHER_KEY),
+            await storage.get_data(OTHER_KEY),
+        )
+        await storage.close()
+        return result
+
+    state, raw_state, data, updated, other_state, other_data = run(db_path, monkeypatch, scenario)
+    assert state == RegisterCountry.waiting_for_name.state
+    assert raw_state == "Custom:raw"
+    # get_data отдаёт копию: правка словаря хендлером не меняет хранилище
+    assert data == {"country": "Египет", "desc": "Держава у реки"}
+    assert updated == data
+    assert other_state is None and other_data == {}
+
+
+def test_state_survives_restart(db_path, monkeypatch):
+    async def scenario():
+        storage = SQLiteStorage(flush_interval=3600)
+        await storage.start()
+        await storage.set_state(KEY, RegisterCountry.waiting_for_desc)
+        await storage.set_data(KEY, {"country": "Египет"})
+        await storage.close()
+        # Повторный close (aiogram вызывает его при остановке поллинга) ничего не делает
+        await storage.close()
+
+        restarted = SQLiteStorage(flush_interval=3600)
+        await restarted.start()
+        result = await restarted.get_state(KEY), await restarted.get_data(KEY)
+        await restarted.close()
+        return result
+
+    assert run(db_path, monkeypatch, scenario) == (RegisterCountry.waiting_for_desc.state, {"country": "Египет"})
+
+
+def test_cleared_record_is_deleted(db_path, monkeypatch):
+    async def scenario():
+        storage = SQLiteStorage(flush_interval=3600)
+        await storage.start()
+        await storage.set_state(KEY, RegisterCountry.waiting_for_name)
+        await storage.set_data(KEY, {"country": "Египет"})
+        await storage.flush()
+        before = stored_keys(db_path)
+        await storage.set_state(KEY, None)
+        await storage.set_data(KEY, {})
+        await storage.close()
+        return before, storage.stats()
+
+    before, stats = run(db_path, monkeypatch, scenario)
+    assert before == [fsm_storage.storage_key(KEY)]
+    assert stored_keys(db_path) == []
+    assert stats == {"states": 0, "pending": 0}
+
+
+def test_expired_record_is_dropped(db_path, monkeypatch):
+    async def scenario():
+        storage = SQLiteStorage(ttl=60, flush_interval=3600)
+        await storage.start()
+        await storage.set_state(KEY, RegisterCountry.waiting_for_name)
+        await storage.set_state(OTHER_KEY, RegisterCountry.waiting_for_desc)
+        await storage.flush()
+        # Запись KEY не менялась дольше ttl
+        storage._records[fsm_storage.storage_key(KEY)]["updated_at"] = time.time() - 120
+        result = await storage.get_state(KEY), await storage.get_state(OTHER_KEY)
+        await storage.close()
+        return result
+
+    assert run(db_path, monkeypatch, scenario) == (None, RegisterCountry.waiting_for_desc.state)
+    assert stored_keys(db_path) == [fsm_storage.storage_key(OTHER_KEY)]
@@ -0,0 +1,99 @@
+import asyncio
+
+import metrics
+from metrics import Counter, Gauge, Histogram, MetricsServer, instrument_module
+
+
+def test_counter_and_gauge_render_prometheus_text():
+    counter = Counter("test_requests_total", "Запросы", ["kind"])
+    counter.inc(kind="turn")
+    counter.inc(2, kind="turn")
+    counter.inc(kind='он "сказал"')
+    gauge = Gauge("test_queue_depth", "Очередь")
+    gauge.set(3)
+
+    assert list(counter.render()) == [
+        "# HELP test_requests_total Запросы",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{kind="turn"} 3',
+        'test_requests_total{kind="он \\"сказал\\""} 1',
+    ]
+    assert list(gauge.render())[-1] == "test_queue_depth 3"
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("test_seconds", "Время", buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 7):
+        histogram.observe(value)
+
+    assert list(histogram.render())[2:] == [
+        'test_seconds_bucket{le="0.1"} 2',
+        'test_seconds_bucket{le="1.0"} 3',
+        'test_seconds_bucket{le="+Inf"} 4',
+        "test_seconds_sum 7.65",
+        "test_seconds_count 4",
+    ]
+
+
+def test_time_decorator_observes_failures():
+    histogram = Histogram("test_call_seconds", "Вызовы", ["function"])
+
+    @histogram.time(function="sync")
+    def sync_call():
+        return 1
+
+    @histogram.time(function="async")
+    async def failing_call():
+        raise ValueError
+
+    assert sync_call() == 1
+    try:
+        asyncio.run(failing_call())
+    except ValueError:
+        pass
+    assert histogram._values[("sync",)][0][0] == 1
+    assert sum(histogram._values[("async",)][0]) == 1
+
+
+def test_instrument_module_wraps_public_coroutines():
+    histogram = Histogram("test_module_seconds", "Функции модуля", ["function"])
+
+    async def public():
+        return "ok"
+
+    async def _private():
+        return "ok"
+
+    public.__module__ = _private.__module__ = "fake_module"
+    namespace = {"__name__": "fake_module", "public": public, "_private": _private}
+    instrument_module(namespace, histogram, "function")
+
+    assert asyncio.run(namespace["public"]()) == "ok"
+    assert namespace["_private"] is _private
+    assert list(histogram._values) == [("public",)]
+
+
+def test_server_serves_registry():
+    Counter("test_server_hits_total", "Проверка сервера").inc()
+
+    async def get(path):
+        reader, writer = await asyncio.open_connection("127.0.0.1", server._server.sockets[0].getsockname()[1])
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        return response.decode("utf-8")
+
+    async def main():
+        await server.start()
+        try:
+            return await get("/metrics"), await get("/")
+        finally:
+            await server.stop()
+
+    server = MetricsServer("127.0.0.1", 0)
+    found, not_found = asyncio.run(main())
+    assert found.startswith("HTTP/1.1 200 OK")
+    assert "test_server_hits_total 1" in found
+    assert "# TYPE llm_queue_wait_seconds histogram" in found
+    assert found.endswith(metrics.registry.render())
+    assert not_found.startswith("HTTP/1.1 404")
@@ -0,0 +1,93 @@
+from prompt_builder import PromptBuilder, PromptSection, TokenCounter, split_sentences, summarize_turns
+
+
+class WordCounter(TokenCounter):
+    """
+    Токен — слово: бюджеты в тестах считаются в уме.
+    """
+
+    def __init__(self):
+        super().__init__(tokenizer_name="")
+
+    def _count(self, text: str) -> int:
+        return len(text.split())
+
+
+def fit(max_tokens, *sections):
+    return PromptBuilder(max_tokens, WordCounter()).fit(list(sections))
+
+
+def test_sections_within_budget_are_kept():
+    sections = fit(100, PromptSection("system", ["один два"]), PromptSection("rag", ["три", "четыре"], 1, keep="head"))
+    assert sections["rag"].kept == ["три", "четыре"]
+    assert not sections["rag"].trimmed
+
+
+def test_section_trimmed_to_own_budget_keeps_head():
+    sections = fit(100, PromptSection("rag", ["а б", "в г", "д е"], 1, max_tokens=4, keep="head"))
+    assert sections["rag"].kept == ["а б", "в г"]
+    assert sections["rag"].tokens == 4
+
+
+def test_lowest_priority_is_cut_first():
+    def sections(max_tokens):
+        return fit(
+            max_tokens,
+            PromptSection("system", ["с с"]),
+            PromptSection("country", ["к к", "к к"], priority=1, keep="head"),
+            PromptSection("rag", ["р р", "р р"], priority=3, keep="head"),
+        )
+
+    fitted = sections(8)
+    assert fitted["country"].kept == ["к к", "к к"]
+    assert fitted["rag"].kept == ["р р"]
+    fitted = sections(4)
+    assert fitted["system"].kept == ["с с"]
+    assert fitted["country"].kept == ["к к"]
+    assert fitted["rag"].kept == []
+
+
+def test_history_keeps_tail_and_summarizes_dropped_turns():
+    history = [
+        "Игрок: Строим стены у реки. Много высоких стен вокруг города.",
+        "Ассистент: Стены растут.",
+        "Игрок: Что соседи?",
+    ]
+    sections = fit(100, PromptSection("history", history, 2, max_tokens=14, keep="tail", summarize=summarize_turns))
+    section = sections["history"]
+    assert section.kept == history[1:]
+    assert section.summary == "Ранее в летописи: Игрок: Строим стены у реки."
+    assert section.text.startswith(section.summary)
+    assert section.tokens == 14
+
+
+def test_mandatory_sections_are_never_cut():
+    sections = fit(2, PromptSection("system", ["очень длинный системный промпт"]), PromptSection("message", ["ход"]))
+    assert sections["system"].kept == ["очень длинный системный промпт"]
+    assert sections["message"].kept == ["ход"]
+
+
+def test_split_sentences():
+    assert split_sentences("Первое. Второе! Третье?  ") == ["Первое.", "Второе!", "Третье?"]
+
+
+def test_token_counter_without_tokenizer_estimates_and_caches():
+    counter = TokenCounter(tokenizer_name="")
+    counter.load()
+    assert counter.tokenizer is None
+    assert counter.count("Держава у великой реки") > 0
+    assert counter.count.cache_info().misses == 1
+    counter.count("Держава у великой реки")
+    assert counter.count.cache_info().hits == 1
+
+
+def test_dialog_context_session_text_is_prompt_prefix():
+    from model_handler import ModelHandler
+
+    history = ["Игрок: Строим стены.", "Ассистент: Стены растут."]
+    prompt, prefix, session_text = ModelHandler._build_dialog_context(
+        history, "Что соседи?", "Ты летописец.", "Египет", "Держава у реки. Народ пашет.", "Справка о соседях"
+    )
+    assert prompt.startswith(session_text) and session_text.startswith(prefix)
+    assert session_text.endswith("Ассистент: Стены растут.\n")
+    assert prompt.endswith("Игрок: Что соседи?\nАссистент:")
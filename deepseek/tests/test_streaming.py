@@ -0,0 +1,60 @@
+import random
+
+from utils import (
+    SHORT_STOP_STRINGS,
+    StopStringScanner,
+    StreamingResponseCleaner,
+    clean_ai_response,
+    has_stop_string,
+)
+
+REPLY = "Рассуждаю о стенах.</think>\n\nСтены растут, государь.\nИгрок: А ров?\nАссистент: Ров копают."
+
+
+def chunks(text, rng):
+    pieces, start = [], 0
+    while start < len(text):
+        size = rng.randint(1, 6)
+        pieces.append(text[start : start + size])
+        start += size
+    return pieces
+
+
+def test_cleaner_shows_growing_prefix_of_final_answer():
+    rng = random.Random(1)
+    cleaner = StreamingResponseCleaner()
+    shown = []
+    for piece in chunks(REPLY, rng):
+        shown.append(cleaner.feed(piece))
+    assert shown[-1] == clean_ai_response(REPLY) == "Стены растут, государь."
+    assert all(shown[-1].startswith(visible) for visible in shown)
+    # Рассуждения до </think> не показываются даже частично
+    assert not any("Рассуждаю" in visible or "think" in visible for visible in shown)
+
+
+def test_cleaner_without_think_tag():
+    waiting = StreamingResponseCleaner()
+    streaming = StreamingResponseCleaner(wait_for_think=False)
+    for cleaner in (waiting, streaming):
+        cleaner.feed("Стены растут.\nИгр")
+    assert waiting.visible() == ""
+    # Хвост «Игр» похож на начало метки и придерживается
+    assert streaming.visible() == "Стены растут."
+    assert streaming.feed("ок: А ров?") == "Стены растут."
+
+
+def test_stop_scanner_stops_where_has_stop_string_would():
+    rng = random.Random(2)
+    words = ["Стены", " ", "\n", "Игрок:", "Вопрос:", "</think>", "&lt;/think&gt;", "Иг", "рок:", "ров"]
+    for _ in range(300):
+        text = "".join(rng.choices(words, k=rng.randint(0, 12)))
+        wait_for_think = rng.random() < 0.5
+        scanner = StopStringScanner(SHORT_STOP_STRINGS, wait_for_think)
+        fed = ""
+        for piece in chunks(text, rng):
+            fed += piece
+            hit = scanner.feed(piece)
+            assert hit == has_stop_string(fed, SHORT_STOP_STRINGS, wait_for_think), repr(fed)
+            if hit:
+                # Генерация строки на этом останавливается
+                break
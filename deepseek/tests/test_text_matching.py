@@ -0,0 +1,65 @@
+import random
+import re
+
+from text_matching import AhoCorasick, CountryMatcher, trie_regex
+
+
+def naive_matches(patterns, text):
+    return sorted(
+        (start, start + len(pattern), pattern)
+        for pattern in patterns
+        for start in range(len(text) - len(pattern) + 1)
+        if text.startswith(pattern, start)
+    )
+
+
+def test_automaton_finds_same_matches_as_naive_search():
+    rng = random.Random(1)
+    for _ in range(200):
+        patterns = {"".join(rng.choices("абв", k=rng.randint(1, 4))) for _ in range(rng.randint(1, 8))}
+        text = "".join(rng.choices("абвг", k=rng.randint(0, 30)))
+        automaton = AhoCorasick({pattern: pattern.upper() for pattern in patterns})
+        matches = list(automaton.iter_matches(text))
+        assert sorted((start, end, pattern) for start, end, pattern, _ in matches) == naive_matches(patterns, text)
+        assert all(value == pattern.upper() for _, _, pattern, value in matches)
+
+
+def test_add_and_remove_after_search():
+    automaton = AhoCorasick({"хетт": 1})
+    assert [m[2] for m in automaton.iter_matches("хетты и хатти")] == ["хетт"]
+    automaton.add("хатт", 2)
+    automaton.remove("хетт")
+    assert [m[2] for m in automaton.iter_matches("хетты и хатти")] == ["хатт"]
+    assert "хетт" not in automaton and len(automaton) == 1
+
+
+def test_find_longest_drops_overlaps():
+    automaton = AhoCorasick({"ас": 1, "асс": 2, "ассирия": 3, "рия": 4})
+    assert [m[2] for m in automaton.find_longest("ассирия и ас")] == ["ассирия", "ас"]
+
+
+def test_country_matcher_finds_case_forms():
+    matcher = CountryMatcher([("египет", "египет"), ("эллада", "эллада")])
+    assert matcher.find_all("войско египта у границ эллады") == [(7, 11, "египет"), (23, 28, "эллада")]
+
+
+def test_country_matcher_prefers_closer_form():
+    # «египе» — полное название второй страны: оно важнее усечённой формы «египет»
+    matcher = CountryMatcher([("египет", "египет"), ("египе", "другая")])
+    assert matcher.find_all("египет") == [(0, 6, "египет")]
+    assert matcher.find_all("египе") == [(0, 5, "другая")]
+
+
+def test_trie_regex_matches_like_alternation():
+    rng = random.Random(2)
+    for _ in range(200):
+        words = ["".join(rng.choices("аб.+", k=rng.randint(1, 4))) for _ in range(rng.randint(1, 6))]
+        text = "".join(rng.choices("аб.+в", k=rng.randint(0, 20)))
+        # Обычная альтернатива, где длинные слова идут раньше, тоже находит самое длинное
+        alternation = re.compile("|".join(map(re.escape, sorted(set(words), key=len, reverse=True))))
+        assert re.compile(trie_regex(words)).findall(text) == alternation.findall(text)
+
+
+def test_trie_regex_skips_empty_words():
+    pattern = re.compile(r"\b" + trie_regex(["", "смартфон", "смарт"]), re.IGNORECASE)
+    assert pattern.findall("Смартфоны и смарт-часы") == ["Смартфон", "смарт"]
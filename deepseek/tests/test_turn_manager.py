@@ -0,0 +1,65 @@
+import asyncio
+
+from turn_manager import TurnManager
+
+
+def test_single_message_of_idle_player_is_not_delayed():
+    async def main():
+        manager = TurnManager(debounce_ms=5000)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        turn = await manager.collect(1, "Строим стены")
+        elapsed = loop.time() - started
+        manager.finish(turn)
+        return turn, elapsed, manager.stats()
+
+    turn, elapsed, stats = asyncio.run(main())
+    assert turn.text == "Строим стены"
+    assert elapsed < 0.5
+    assert stats == {"active": 0, "merged": 0, "rejected": 0}
+
+
+def test_messages_during_generation_form_next_turn():
+    async def main():
+        manager = TurnManager(debounce_ms=20, max_pending=2)
+        first = await manager.collect(1, "Строим стены")
+        assert manager.is_busy(1)
+        # Пока первый ход генерируется, два сообщения копятся в следующий, третье не помещается
+        second = asyncio.create_task(manager.collect(1, "Копаем ров"))
+        await asyncio.sleep(0)
+        merged = await manager.collect(1, "И башни")
+        accepts = manager.accepts(1)
+        await asyncio.sleep(0.05)
+        assert not second.done()
+        manager.finish(first)
+        turn = await second
+        manager.finish(turn)
+        return merged, accepts, turn, manager.stats(), manager._users
+
+    merged, accepts, turn, stats, users = asyncio.run(main())
+    assert merged is None
+    assert not accepts
+    assert turn.messages == ["Копаем ров", "И башни"]
+    assert turn.text == "Копаем ров\nИ башни"
+    assert stats["merged"] == 1
+    assert users == {}
+
+
+def test_next_turn_waits_for_pause_after_generation():
+    async def main():
+        manager = TurnManager(debounce_ms=100)
+        loop = asyncio.get_running_loop()
+        first = await manager.collect(1, "Строим стены")
+        second = asyncio.create_task(manager.collect(1, "Копаем ров"))
+        await asyncio.sleep(0)
+        manager.finish(first)
+        # Игрок дописывает сразу после ответа: сообщение успевает в тот же ход
+        await asyncio.sleep(0.03)
+        await manager.collect(1, "И башни")
+        sent_at = loop.time()
+        turn = await second
+        return turn, loop.time() - sent_at
+
+    turn, waited = asyncio.run(main())
+    assert turn.messages == ["Копаем ров", "И башни"]
+    assert waited >= 0.09
@@ -0,0 +1,177 @@
+import re
+from collections import deque
+
+
+def trie_regex(words) -> str:
+    """
+    Регулярное выражение (без флагов и якорей), совпадающее с любым из слов words.
+    Строится по префиксному дереву: общие начала слов проверяются один раз,
+    а необязательное продолжение жадное — из вложенных слов находится самое длинное.
+    """
+    trie = {}
+    for word in words:
+        if not word:
+            continue
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    return _trie_node_regex(trie)
+
+
+def _trie_node_regex(node) -> str:
+    branches = [re.escape(char) + _trie_node_regex(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ""
+    if "" in node:
+        return "(?:" + "|".join(branches) + ")?"
+    return branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+
+
+class AhoCorasick:
+    """
+    Автомат Ахо — Корасик: находит все вхождения всех шаблонов в тексте за один проход,
+    за время, не зависящее от числа шаблонов.
+    Шаблоны можно добавлять и удалять по одному: бор дополняется на месте,
+    а суффиксные ссылки пересчитываются один раз перед следующим поиском.
+    """
+
+    def __init__(self, patterns=None):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]  # шаблон, который заканчивается в этом узле
+        self._output_link = [0]  # ближайший по суффиксным ссылкам узел, где заканчивается шаблон
+        self._values = {}
+        self._linked = True
+        for pattern, value in (patterns or {}).items():
+            self.add(pattern, value)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, pattern):
+        return pattern in self._values
+
+    def get(self, pattern, default=None):
+        return self._values.get(pattern, default)
+
+    def add(self, pattern: str, value=None):
+        if not pattern:
+            raise ValueError("Пустой шаблон")
+        node = 0
+        for char in pattern:
+            child = self._goto[node].get(char)
+            if child is None:
+                child = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+                self._output_link.append(0)
+                self._goto[node][char] = child
+            node = child
+        if self._output[node] is None:
+            self._output[node] = pattern
+            self._linked = False
+        self._values[pattern] = value
+
+    def remove(self, pattern: str):
+        """
+        Удаляет шаблон; узлы бора остаются, но больше ничего не находят.
+        """
+        if pattern not in self._values:
+            return
+        del self._values[pattern]
+        node = 0
+        for char in pattern:
+            node = self._goto[node][char]
+        self._output[node] = None
+        self._linked = False
+
+    def _link(self):
+        """
+        Суффиксные ссылки обходом бора в ширину.
+        """
+        queue = deque()
+        for child in self._goto[0].values():
+            self._fail[child] = 0
+            self._output_link[child] = 0
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[child] = fail
+                self._output_link[child] = fail if self._output[fail] is not None else self._output_link[fail]
+                queue.append(child)
+        self._linked = True
+
+    def iter_matches(self, text: str):
+        """
+        Все вхождения: (начало, конец, шаблон, значение), в порядке концов вхождений.
+        """
+        if not self._linked:
+            self._link()
+        goto, fail, output, output_link = self._goto, self._fail, self._output, self._output_link
+        node = 0
+        for end, char in enumerate(text, start=1):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            match = node if output[node] is not None else output_link[node]
+            while match:
+                pattern = output[match]
+                yield end - len(pattern), end, pattern, self._values[pattern]
+                match = output_link[match]
+
+    def find_longest(self, text: str):
+        """
+        Вхождения без пересечений: из пересекающихся остаётся самое длинное (при равной длине — левое).
+        Результат упорядочен по началу.
+        """
+        chosen = []
+        for match in sorted(self.iter_matches(text), key=lambda m: (m[0] - m[1], m[0])):
+            if all(match[1] <= other[0] or other[1] <= match[0] for other in chosen):
+                chosen.append(match)
+        return sorted(chosen)
+
+
+class CountryMatcher:
+    """
+    Поиск упоминаний стран в тексте (в нижнем регистре) по ключам названий и синонимов.
+    Кроме полного ключа ищутся усечённые формы без одной и двух последних букв — так находятся
+    падежные формы («египта», «элладу»). Если одна форма подходит нескольким странам,
+    выигрывает полное совпадение, затем вариант, добавленный раньше.
+    """
+
+    def __init__(self, variants=()):
+        self.automaton = AhoCorasick()
+        self._order = 0
+        for variant, key in variants:
+            self.add(variant, key)
+
+    @staticmethod
+    def forms(variant: str):
+        return [variant, variant[:-1], variant[:-2]] if len(variant) > 3 else [variant]
+
+    def add(self, variant: str, key: str):
+        """
+        Добавляет вариант поиска variant страны с ключом key.
+        """
+        for rank, form in enumerate(self.forms(variant)):
+            if not form:
+                continue
+            priority = (rank, self._order)
+            current = self.automaton.get(form)
+            if current is None or priority < current[0]:
+                self.automaton.add(form, (priority, key))
+        self._order += 1
+
+    def find_all(self, text: str):
+        """
+        Упоминания стран: список (начало, конец, ключ страны) по порядку в тексте,
+        пересекающиеся упоминания разрешены в пользу самого длинного.
+        """
+        return [(start, end, value[1]) for start, end, _, value in self.automaton.find_longest(text)]
@@ -0,0 +1,302 @@
+import copy
+import logging
+import time
+
+import torch
+from transformers import (
+    AsyncTextIteratorStreamer,
+    AutoModelForCausalLM,
+    AutoTokenizer,
+    LogitsProcessor,
+    LogitsProcessorList,
+    StoppingCriteriaList,
+)
+
+from backends import InferenceBackend
+from batch_scheduler import GenerationResult
+from config import (
+    EARLY_STOP,
+    GAME_PROMPT,
+    MODEL_NAME,
+    PREFIX_CACHE_COUNTRY_BLOCKS,
+    PREFIX_CACHE_MAX_MB,
+    RPG_PROMPT,
+    SESSION_CACHE_MAX_MB,
+    STREAM_WAIT_FOR_THINK,
+)
+from prefix_cache import PrefixCache, PrefixCacheEntry, SessionCache
+from stopping import SentinelStoppingCriteria
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KWARGS = dict(do_sample=True, temperature=0.7, top_p=0.95)
+
+
+class TokenBudgetLogitsProcessor(LogitsProcessor):
+    """
+    Принудительно завершает (EOS) строки пачки, исчерпавшие свой бюджет новых токенов.
+    Так в одном model.generate уживаются запросы с разными max_new_tokens.
+    """
+
+    def __init__(self, prompt_length, budgets, eos_token_id):
+        self.prompt_length = prompt_length
+        self.budgets = budgets
+        self.eos_token_id = eos_token_id
+
+    def __call__(self, input_ids, scores):
+        generated = input_ids.shape[1] - self.prompt_length
+        for row, budget in enumerate(self.budgets):
+            if generated >= budget:
+                scores[row, :] = -float("inf")
+                scores[row, self.eos_token_id] = 0
+        return scores
+
+
+class FirstTokenTimer(LogitsProcessor):
+    """
+    Запоминает момент, когда модель выдала логиты первого нового токена, — конец префилла.
+    """
+
+    def __init__(self):
+        self.first_token_at = None
+
+    def __call__(self, input_ids, scores):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        return scores
+
+
+class TransformersBackend(InferenceBackend):
+    """
+    Локальная модель transformers в процессе бота: пакетная генерация с паддингом слева,
+    кэши KV-состояний общих префиксов и диалогов игроков, ранняя остановка по стоп-меткам.
+    """
+
+    name = "transformers"
+
+    def __init__(self, model_name=MODEL_NAME):
+        super().__init__()
+        self.model_name = model_name
+        self._initialize_model()
+        self.prefix_cache = PrefixCache(PREFIX_CACHE_MAX_MB * 1024**2)
+        self.session_cache = SessionCache(SESSION_CACHE_MAX_MB * 1024**2)
+        # Статические системные промпты префиллим заранее, RPG_PROMPT достраивается поверх GAME_PROMPT
+        for prefix in (GAME_PROMPT, RPG_PROMPT + "\n"):
+            self._prefill_prefix(prefix)
+
+    def create_streamer(self):
+        return AsyncTextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+    def invalidate_session(self, user_id: int):
+        self.session_cache.invalidate(user_id)
+
+    def _initialize_model(self):
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        # Для пакетной генерации промпты выравниваются паддингом слева
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.model = AutoModelForCausalLM.from_pretrained(
+            self.model_name,
+            device_map="auto",
+            torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+            use_flash_attention_2=False,
+        )
+
+        # Log device information
+        device_info = f"Модель использует устройство: {self.model.device}"
+        logger.info(device_info)
+        cuda_available = torch.cuda.is_available()
+        logger.info(f"CUDA доступен: {cuda_available}")
+
+        if cuda_available:
+            cuda_device_count = torch.cuda.device_count()
+            cuda_device_name = torch.cuda.get_device_name(0) if cuda_device_count > 0 else "Нет"
+            logger.info(f"Количество GPU: {cuda_device_count}")
+            logger.info(f"Название GPU: {cuda_device_name}")
+            logger.info(f"Текущее использование GPU памяти: {torch.cuda.memory_allocated() / 1024**2:.2f} МБ")
+            logger.info(
+                f"Максимальная доступная GPU память: {torch.cuda.get_device_properties(0).total_memory / 1024**2:.2f} МБ"
+            )
+
+    def _tokenize(self, text, add_special_tokens=True):
+        return self.tokenizer(text, return_tensors="pt", add_special_tokens=add_special_tokens)["input_ids"].to(
+            self.model.device
+        )
+
+    def _extend_entry(self, parent, text):
+        """
+        Считает KV-состояние для text, достраивая его поверх записи parent
+        (её текст должен быть началом text) или с нуля, если parent нет.
+        """
+        started = time.perf_counter()
+        if parent is not None:
+            new_ids = self._tokenize(text[len(parent.text) :], add_special_tokens=False)
+            past_key_values = copy.deepcopy(parent.past_key_values)
+        else:
+            new_ids = self._tokenize(text)
+            past_key_values = None
+        with torch.no_grad():
+            outputs = self.model(input_ids=new_ids, past_key_values=past_key_values, use_cache=True)
+        input_ids = torch.cat([parent.input_ids, new_ids], dim=1) if parent is not None else new_ids
+        prefill_seconds = time.perf_counter() - started + (parent.prefill_seconds if parent is not None else 0)
+        return PrefixCacheEntry(text, input_ids, outputs.past_key_values, prefill_seconds)
+
+    def _prefill_prefix(self, text):
+        """
+        Возвращает запись кэша префиксов для text. При промахе считает KV-состояние,
+        достраивая его поверх самого длинного уже закэшированного префикса.
+        """
+        entry = self.prefix_cache.get(text)
+        if entry is not None:
+            return entry
+        return self.prefix_cache.put(text, self._extend_entry(self.prefix_cache.longest_prefix(text), text))
+
+    def _prefill_session(self, user_id, text, base):
+        """
+        KV-состояние диалога игрока до нового хода. Если text продолжает закэшированный
+        диалог, префиллятся только новые строки истории, иначе — всё поверх base.
+        """
+        entry = self.session_cache.get(user_id)
+        if entry is not None and text.startswith(entry.text):
+            self.session_cache.record_hit(entry)
+            if entry.text == text:
+                return entry
+            base = entry
+        else:
+            self.session_cache.record_miss()
+            self.session_cache.invalidate(user_id)
+        if base is not None and not text.startswith(base.text):
+            base = None
+        if base is not None and base.text == text:
+            # Истории ещё нет — хватает кэша префиксов
+            return base
+        return self.session_cache.put(user_id, self._extend_entry(base, text))
+
+    def _generate_with_prefix(self, request):
+        """
+        Генерация одного запроса с переиспользованием KV-кэша префикса
+        и, если передан request.session, KV-кэша диалога игрока.
+        Возвращает None, если подходящего префикса нет.
+        """
+        started = time.perf_counter()
+        prompt, prefix = request.prompt, request.prefix
+        if prefix and PREFIX_CACHE_COUNTRY_BLOCKS and len(prefix) < len(prompt) and prompt.startswith(prefix):
+            entry = self._prefill_prefix(prefix)
+        else:
+            entry = self.prefix_cache.longest_prefix(prompt)
+        if entry is None:
+            self.prefix_cache.record_miss()
+        else:
+            self.prefix_cache.record_hit(entry)
+        if request.session is not None:
+            user_id, session_text = request.session
+            if len(session_text) < len(prompt) and prompt.startswith(session_text):
+                entry = self._prefill_session(user_id, session_text, entry)
+        if entry is None:
+            return None
+
+        suffix_ids = self._tokenize(prompt[len(entry.text) :], add_special_tokens=False)
+        input_ids = torch.cat([entry.input_ids, suffix_ids], dim=1)
+        stopping = self._stopping_criteria(input_ids.shape[1], [request])
+        timer = FirstTokenTimer()
+        with torch.no_grad():
+            outputs = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                # generate дописывает кэш на месте, поэтому отдаём ему копию
+                past_key_values=copy.deepcopy(entry.past_key_values),
+                max_new_tokens=request.max_new_tokens,
+                logits_processor=LogitsProcessorList([timer]),
+                stopping_criteria=StoppingCriteriaList([stopping]),
+                streamer=request.streamer,
+                eos_token_id=self.tokenizer.eos_token_id,
+                pad_token_id=self.tokenizer.pad_token_id,
+                **GENERATION_KWARGS,
+            )
+        self._record_stops([request], stopping.stopped_at)
+        return self._collect_results(
+            [request], outputs, input_ids.shape[1], [input_ids.shape[1]], stopping, timer, started
+        )[0]
+
+    def _generate_padded(self, requests):
+        started = time.perf_counter()
+        inputs = self.tokenizer([r.prompt for r in requests], return_tensors="pt", padding=True).to(self.model.device)
+        prompt_length = inputs["input_ids"].shape[1]
+        budgets = [r.max_new_tokens for r in requests]
+        budget_processor = TokenBudgetLogitsProcessor(prompt_length, budgets, self.tokenizer.eos_token_id)
+        stopping = self._stopping_criteria(prompt_length, requests)
+        timer = FirstTokenTimer()
+        with torch.no_grad():
+            outputs = self.model.generate(
+                **inputs,
+                max_new_tokens=max(budgets),
+                logits_processor=LogitsProcessorList([budget_processor, timer]),
+                stopping_criteria=StoppingCriteriaList([stopping]),
+                # Стример поддерживает только пачку из одного промпта
+                streamer=requests[0].streamer if len(requests) == 1 else None,
+                eos_token_id=self.tokenizer.eos_token_id,
+                pad_token_id=self.tokenizer.pad_token_id,
+                **GENERATION_KWARGS,
+            )
+        self._record_stops(requests, stopping.stopped_at)
+        prompt_tokens = inputs["attention_mask"].sum(dim=1).tolist()
+        return self._collect_results(requests, outputs, prompt_length, prompt_tokens, stopping, timer, started)
+
+    def _collect_results(self, requests, outputs, prompt_length, prompt_tokens, stopping, timer, started):
+        """
+        Вырезает из выхода generate только новые токены каждой строки (до стоп-метки, EOS или паддинга),
+        декодирует их один раз и собирает GenerationResult с токенами, причиной остановки и таймингами.
+        """
+        finished = time.perf_counter()
+        first_token_at = timer.first_token_at or finished
+        results = []
+        end_ids = {self.tokenizer.eos_token_id, self.tokenizer.pad_token_id}
+        for row, request in enumerate(requests):
+            new_ids = outputs[row, prompt_length:].tolist()
+            # Строка, остановленная по метке, дальше добивается паддингом, пока генерируются остальные
+            stopped_at = stopping.stopped_at[row]
+            if stopped_at is not None:
+                new_ids = new_ids[:stopped_at]
+            # Закончившая сама строка — EOS и паддинг за ним (pad может не совпадать с EOS)
+            end = next((i for i, token_id in enumerate(new_ids) if token_id in end_ids), None)
+            generated = new_ids[:end] if end is not None else new_ids
+            if stopped_at is not None:
+                stop_reason = "stop_string"
+            elif end is not None and len(generated) < request.max_new_tokens:
+                stop_reason = "eos"
+            else:
+                stop_reason = "length"
+            results.append(
+                GenerationResult(
+                    text=self.tokenizer.decode(generated, skip_special_tokens=True),
+                    prompt_tokens=prompt_tokens[row],
+                    generated_tokens=len(generated),
+                    stop_reason=stop_reason,
+                    queue_seconds=started - request.enqueued_at,
+                    prefill_seconds=first_token_at - started,
+                    decode_seconds=finished - first_token_at,
+                    token_ids=generated,
+                )
+            )
+        return results
+
+    def _stopping_criteria(self, prompt_length, requests):
+        stop_strings = [r.stop_strings if EARLY_STOP else None for r in requests]
+        return SentinelStoppingCriteria(self.tokenizer, prompt_length, stop_strings, STREAM_WAIT_FOR_THINK)
+
+    def generate_batch(self, requests):
+        """
+        Генерирует ответы на пачку запросов (GenerationRequest) одним вызовом model.generate.
+        У каждого запроса свой бюджет новых токенов, стоп-метки и, необязательно,
+        префикс для кэша префиксов, сессия для кэша диалога и стример.
+        Возвращает GenerationResult (только новый текст и метаданные) в том же порядке.
+
+        Одиночный запрос идёт через кэши KV-состояний: паддинг слева сдвигает позиции,
+        поэтому закэшированное состояние применимо только к пачке из одного промпта.
+        """
+        if len(requests) == 1:
+            result = self._generate_with_prefix(requests[0])
+            if result is not None:
+                return [result]
+        return self._generate_padded(requests)
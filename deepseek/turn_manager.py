@@ -0,0 +1,119 @@
+import asyncio
+import logging
+from typing import List, Optional
+
+from config import TURN_DEBOUNCE_MS, TURN_MAX_PENDING
+
+logger = logging.getLogger(__name__)
+
+
+class Turn:
+    """
+    Ход игрока, собранный из одного или нескольких сообщений подряд: text идёт в промпт одной репликой «Игрок:».
+    """
+
+    def __init__(self, user_id: int, messages: List[str]):
+        self.user_id = user_id
+        self.messages = messages
+        self.text = "\n".join(messages)
+
+
+class _UserTurns:
+    def __init__(self):
+        self.pending = []  # сообщения следующего хода
+        self.last_at = 0.0  # когда пришло последнее из них (время event loop)
+        self.collecting = False  # есть корутина, которая соберёт следующий ход
+        self.in_flight = False  # ход генерируется
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+
+class TurnManager:
+    """
+    Ходы игроков в диалоге с летописцем: у каждого игрока генерируется не больше одного хода за раз.
+    Сообщение свободного игрока сразу становится ходом. Сообщения, пришедшие, пока генерируется прошлый ход,
+    склеиваются в следующий ход вместе с теми, что пришли после него с паузой меньше debounce_ms;
+    его собирает хендлер первого из них, остальные хендлеры ничего не делают.
+    В очереди следующего хода не больше max_pending сообщений — на лишние хендлер отвечает, что летописец занят.
+    Все вызовы идут из event loop бота, поэтому проверки и изменения состояния не разделены await.
+    """
+
+    def __init__(self, debounce_ms: int = TURN_DEBOUNCE_MS, max_pending: int = TURN_MAX_PENDING):
+        self.debounce = debounce_ms / 1000
+        self.max_pending = max(1, max_pending)
+        self._users = {}
+        self.merged_messages = 0
+        self.rejected_messages = 0
+
+    def is_busy(self, user_id: int) -> bool:
+        """
+        Генерируется ли сейчас ход игрока.
+        """
+        user = self._users.get(user_id)
+        return user is not None and user.in_flight
+
+    def accepts(self, user_id: int) -> bool:
+        """
+        Есть ли место для сообщения в следующем ходе игрока: пока прошлый ход генерируется,
+        в следующий принимается не больше max_pending сообщений.
+        """
+        user = self._users.get(user_id)
+        return user is None or not user.in_flight or len(user.pending) < self.max_pending
+
+    async def collect(self, user_id: int, text: str) -> Optional[Turn]:
+        """
+        Добавляет сообщение к следующему ходу игрока. Хендлеру, чьё сообщение открыло ход, возвращает Turn:
+        сразу, если прошлый ход не генерируется, иначе — когда он закончен и новых сообщений не было debounce_ms.
+        После генерации хендлер вызывает finish().
+        Остальным возвращает None: их сообщение уйдёт в этот ход. Место нужно проверить accepts().
+        """
+        loop = asyncio.get_running_loop()
+        user = self._users.setdefault(user_id, _UserTurns())
+        user.pending.append(text)
+        user.last_at = loop.time()
+        if user.collecting:
+            self.merged_messages += 1
+            return None
+
+        user.collecting = True
+        try:
+            waited = not user.idle.is_set()
+            await user.idle.wait()
+            # Одиночное сообщение свободного игрока не ждёт; очередь, скопившаяся за генерацию, ждёт паузы
+            if waited or len(user.pending) > 1:
+                while (delay := user.last_at + self.debounce - loop.time()) > 0:
+                    await asyncio.sleep(delay)
+            messages, user.pending = user.pending, []
+            user.in_flight = True
+            user.idle.clear()
+        finally:
+            user.collecting = False
+        if len(messages) > 1:
+            logger.info(f"Ход игрока {user_id} собран из {len(messages)} сообщений")
+        return Turn(user_id, messages)
+
+    def finish(self, turn: Turn):
+        """
+        Ход сгенерирован (или не удался): следующий ход игрока может начинаться.
+        """
+        user = self._users.get(turn.user_id)
+        if user is None:
+            return
+        user.in_flight = False
+        user.idle.set()
+        if not user.pending and not user.collecting:
+            del self._users[turn.user_id]
+
+    def reject(self, user_id: int):
+        self.rejected_messages += 1
+        logger.info(f"Сообщение игрока {user_id} отклонено: летописец ещё пишет, очередь хода полна")
+
+    def stats(self) -> dict:
+        return {
+            "active": sum(user.in_flight for user in self._users.values()),
+            "merged": self.merged_messages,
+            "rejected": self.rejected_messages,
+        }
+
+
+turn_manager = TurnManager()
@@ -1,12 +1,22 @@
 import asyncio
 import logging
 import re
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 
 logger = logging.getLogger(__name__)
 
 TELEGRAM_MAX_LENGTH = 4096
 
 
+def estimate_tokens(text: str) -> int:
+    """
+    Грубая оценка числа токенов без токенизатора: около трёх символов русского текста на токен.
+    """
+    return (len(text) + 2) // 3
+
+
 def split_long_message(text: str, max_length: int = TELEGRAM_MAX_LENGTH):
     """
     Разбивает длинный текст на части не длиннее max_length символов.
@@ -55,6 +65,77 @@ async def send_html(bot, chat_id, text: str, **kwargs):
             await bot.send_message(chat_id, part, **kwargs)
 
 
+class StreamingAnswer:
+    """
+    Ответ, который растёт по мере генерации: первое сообщение уходит с первым видимым текстом,
+    дальше оно редактируется не чаще раза в min_interval секунд (лимиты Telegram на правки).
+    Текст длиннее лимита разбивается по split_long_message: готовые части больше не правятся,
+    растёт только последняя. Промежуточные правки идут без разметки, итоговая — в HTML.
+    """
+
+    def __init__(self, message, min_interval: float = 1.5, typing_task=None, **kwargs):
+        self.message = message
+        self.min_interval = min_interval
+        self.typing_task = typing_task
+        self.kwargs = kwargs
+        self.sent = []  # пары (сообщение, текст в нём)
+        self.last_edit = 0.0
+
+    async def update(self, text: str):
+        if not text.strip() or time.monotonic() - self.last_edit < self.min_interval:
+            return
+        await self._render(text)
+
+    async def finish(self, text: str):
+        if not self.sent:
+            if self.typing_task:
+                self.typing_task.cancel()
+            await answer_html(self.message, text, **self.kwargs)
+            return
+        await self._render(text, parse_mode="HTML")
+
+    async def _render(self, text: str, parse_mode=None):
+        parts = split_long_message(text)
+        for i, part in enumerate(parts):
+            if i < len(self.sent):
+                sent_message, sent_text = self.sent[i]
+                if sent_text == part and parse_mode is None:
+                    continue
+                await self._call(sent_message.edit_text, part, parse_mode)
+                self.sent[i] = (sent_message, part)
+            else:
+                # Клавиатуру можно приложить только к новому сообщению, не к правке
+                kwargs = self.kwargs if not self.sent else {}
+                if self.typing_task:
+                    self.typing_task.cancel()
+                sent_message = await self._call(self.message.answer, part, parse_mode, **kwargs)
+                self.sent.append((sent_message, part))
+        # После итогового форматирования частей может стать меньше — лишние удаляем
+        for sent_message, _ in self.sent[len(parts) :]:
+            await sent_message.delete()
+        del self.sent[len(parts) :]
+        self.last_edit = time.monotonic()
+
+    @staticmethod
+    async def _call(method, text, parse_mode, **kwargs):
+        for attempt in range(3):
+            try:
+                return await method(text, parse_mode=parse_mode, **kwargs)
+            except TelegramRetryAfter as e:
+                logger.warning(f"Telegram просит подождать {e.retry_after} с перед правкой сообщения")
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                if "message is not modified" in str(e):
+                    return None
+                if parse_mode is None:
+                    raise
+                logger.warning(
+                    f"Не удалось отправить сообщение в HTML: {str(e)}. Пробуем отправить без форматирования."
+                )
+                parse_mode = None
+        return await method(text, parse_mode=parse_mode, **kwargs)
+
+
 async def keep_typing(bot, chat_id):
     """
     Периодически показывает статус "печатает..." для чат-бота.
@@ -69,25 +150,129 @@ async def keep_typing(bot, chat_id):
         logger.error(f"Ошибка в keep_typing: {str(e)}", exc_info=True)
 
 
+THINK_CLOSE_TAGS = ("</think>", "&lt;/think&gt;")
+NON_SPACE = re.compile(r"\S")
+# Метки, с которых модель начинает выдумывать следующие реплики: ответ на них заканчивается
+TURN_MARKERS = ("Игрок:", "Вопрос:")
+
+# Стоп-метки для разных типов вызовов: в диалоге модель обрывается на выдуманной реплике,
+# в коротких ответах (аспекты, ивенты, описания) — ещё и на первом переводе строки
+DIALOG_STOP_STRINGS = TURN_MARKERS
+SHORT_STOP_STRINGS = TURN_MARKERS + ("\n",)
+
+
+def find_answer_start(text: str):
+    """
+    Индекс начала ответа после первого закрывающего тега рассуждений или None, если тега нет.
+    """
+    for close_tag in THINK_CLOSE_TAGS:
+        close_idx = text.find(close_tag)
+        if close_idx != -1:
+            return close_idx + len(close_tag)
+    return None
+
+
+def find_turn_marker(text: str) -> int:
+    """
+    Индекс первой метки из TURN_MARKERS в тексте или -1.
+    """
+    found = [idx for idx in (text.find(marker) for marker in TURN_MARKERS) if idx != -1]
+    return min(found) if found else -1
+
+
+def has_stop_string(text: str, stops, wait_for_think: bool = True) -> bool:
+    """
+    Встретилась ли в ответе (после </think>, если модель рассуждает) стоп-метка
+    с непустым текстом перед ней. Всё, что после такой метки, clean_ai_response всё равно отрежет.
+    """
+    start = find_answer_start(text)
+    if start is None:
+        if wait_for_think:
+            return False
+        start = 0
+    body = text[start:].lstrip()
+    for stop in stops:
+        idx = body.find(stop)
+        if idx > 0 and body[:idx].strip():
+            return True
+    return False
+
+
+class StopStringScanner:
+    """
+    Инкрементальный has_stop_string для генерации по кускам: feed() дописывает кусок и говорит,
+    встретилась ли уже стоп-метка. Каждый кусок просматривается один раз (с хвостом длиной в метку
+    перед ним), поэтому проверка всего ответа линейна по его длине, а не квадратична.
+    """
+
+    def __init__(self, stops, wait_for_think: bool = True):
+        self.stops = tuple(stops)
+        self.wait_for_think = wait_for_think
+        self.text = ""
+        self.hit = False
+        self._tag_rank = None  # индекс найденного тега в THINK_CLOSE_TAGS (меньше — приоритетнее)
+        self._tag_scanned = 0  # до какого символа искались теги
+        self._tag_end = None
+        self._start = None  # начало ответа: после тега или, без ожидания тега, 0
+        self._body_start = None  # первый непробельный символ ответа
+        self._scanned = 0  # до какого символа искались метки
+        self._skipped = set()  # метки, чьё первое вхождение стоит в самом начале ответа
+
+    def feed(self, chunk: str) -> bool:
+        if self.hit:
+            return True
+        self.text += chunk
+        start = self._answer_start()
+        if start is None:
+            return False
+        if start != self._start:
+            # Начало ответа сдвинулось (нашёлся тег) — ответ просматривается заново
+            self._start, self._body_start, self._scanned, self._skipped = start, None, start, set()
+        if self._body_start is None:
+            match = NON_SPACE.search(self.text, self._start)
+            if match is None:
+                return False
+            self._body_start = match.start()
+        for stop in self.stops:
+            if stop in self._skipped:
+                continue
+            idx = self.text.find(stop, max(self._body_start, self._scanned - len(stop) + 1))
+            if idx == self._body_start:
+                # Как has_stop_string: значимо только первое вхождение, и перед ним должен быть текст
+                self._skipped.add(stop)
+            elif idx != -1:
+                self.hit = True
+        self._scanned = len(self.text)
+        return self.hit
+
+    def _answer_start(self):
+        # find_answer_start по новым символам: берётся самый приоритетный из встретившихся тегов
+        ranks = range(len(THINK_CLOSE_TAGS) if self._tag_rank is None else self._tag_rank)
+        for rank in ranks:
+            tag = THINK_CLOSE_TAGS[rank]
+            idx = self.text.find(tag, max(0, self._tag_scanned - len(tag) + 1))
+            if idx != -1:
+                self._tag_rank, self._tag_end = rank, idx + len(tag)
+                break
+        self._tag_scanned = len(self.text)
+        if self._tag_rank is not None:
+            return self._tag_end
+        return None if self.wait_for_think else 0
+
+
 def clean_ai_response(text: str, separator: str = None) -> str:
     """
-    Возвращает текст между первым <think> или </think> (исключая тег)
-    и первым 'Игрок:' (не включая саму метку).
+    Возвращает ответ модели без рассуждений: текст после первого </think>
+    (если тега нет — с начала) и до первой метки 'Игрок:' или 'Вопрос:' (не включая саму метку).
     Если separator задан, дополнительно обрезает результат по нему (не включая separator).
     Если что-то осталось — возвращает это (strip).
     Если ничего не найдено — возвращает исходный текст.
     """
-    end = -1
-    for close_tag in ("</think>", "&lt;/think&gt;"):
-        open_idx = text.find(close_tag)
-        if open_idx != -1:
-            end = open_idx
-            break
-
-    # ищем "Игрок:" до закрывающего тега
-    remaining = text[:end] if end != -1 else text
-    key = "Игрок:"
-    close_idx = remaining.find(key)
+    start = find_answer_start(text) or 0
+
+    # ищем "Игрок:" после закрывающего тега
+    remaining = text[start:]
+    close_idx = find_turn_marker(remaining)
     if close_idx != -1:
         result = remaining[:close_idx].strip()
     else:
@@ -103,6 +288,49 @@ def clean_ai_response(text: str, separator: str = None) -> str:
     return result if result else text.strip()
 
 
+class StreamingResponseCleaner:
+    """
+    Инкрементальный clean_ai_response для потоковой генерации.
+    Копит куски текста и отдаёт ту часть ответа, которую уже можно показать игроку:
+    рассуждения до </think> не показываются никогда (при wait_for_think текст скрыт,
+    пока тег не встретится), хвост, похожий на начало метки, придерживается,
+    после 'Игрок:' или 'Вопрос:' видимый текст больше не растёт.
+    """
+
+    def __init__(self, wait_for_think: bool = True):
+        self.wait_for_think = wait_for_think
+        self.text = ""
+
+    def feed(self, chunk: str) -> str:
+        self.text += chunk
+        return self.visible()
+
+    def visible(self) -> str:
+        start = find_answer_start(self.text)
+        if start is None:
+            if self.wait_for_think:
+                return ""
+            start = 0
+
+        body = self.text[start:]
+        close_idx = find_turn_marker(body)
+        if close_idx != -1:
+            return body[:close_idx].strip()
+        markers = TURN_MARKERS if start else TURN_MARKERS + THINK_CLOSE_TAGS
+        return body[: len(body) - _partial_marker_length(body, markers)].strip()
+
+
+def _partial_marker_length(text: str, markers) -> int:
+    # Длина самого длинного хвоста text, с которого может начинаться одна из меток
+    longest = 0
+    for marker in markers:
+        for size in range(min(len(marker) - 1, len(text)), longest, -1):
+            if marker.startswith(text[-size:]):
+                longest = size
+                break
+    return longest
+
+
 def stars_to_bold(text):
     # Заменяем все **text** на <b>text</b>
     return re.sub(r"\*\*(.+?)\*\*", r"<b>\1</b>", text)
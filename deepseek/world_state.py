@@ -0,0 +1,140 @@
+import logging
+
+from text_matching import CountryMatcher
+
+logger = logging.getLogger(__name__)
+
+
+class WorldState:
+    """
+    Копия мира игры в памяти процесса: страны игроков, их описания, значения аспектов и синонимы стран.
+    Загружается из базы один раз (database._world), дальше функции записи database.py обновляют её
+    сразу после commit (write-through), и чтения мира в базу не ходят.
+    hits — сколько чтений обслужено из памяти, misses — сколько потребовало загрузки из базы.
+    """
+
+    def __init__(self):
+        self.users = {}  # user_id -> {"country", "country_key", "country_desc", код аспекта: значение}
+        self.countries = {}  # country_key -> название страны
+        self.synonyms = {}  # synonym_key -> (синоним, country_key)
+        self.loaded = False
+        # Растёт при каждой записи: загрузка, пересёкшаяся с записью, не устанавливается
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._views = {}
+        # Автомат поиска стран в тексте: дополняется при новых странах и синонимах,
+        # пересобирается только когда страна у игрока сменилась или пропала
+        self._matcher = None
+
+    def install(self, version: int, users: dict, countries: dict, synonyms: dict) -> bool:
+        """
+        Устанавливает прочитанное из базы, если с начала чтения (version) ничего не записывалось.
+        """
+        if version != self.version:
+            return False
+        self.users, self.countries, self.synonyms = users, countries, synonyms
+        self._views = {}
+        self._matcher = None
+        self.loaded = True
+        logger.info(f"Мир загружен в память: {len(users)} игроков, {len(synonyms)} синонимов")
+        return True
+
+    def invalidate(self):
+        """
+        Забыть всё: следующее чтение загрузит мир из базы заново.
+        """
+        self.loaded = False
+        self.users, self.countries, self.synonyms = {}, {}, {}
+        self._matcher = None
+        self._changed()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "users": len(self.users), "synonyms": len(self.synonyms)}
+
+    def _changed(self):
+        self.version += 1
+        self._views = {}
+
+    # ==== Запись (вызывается после commit) ====
+
+    def update_user(self, user_id: int, create: bool = True, **fields):
+        """
+        Повторяет INSERT ... ON CONFLICT DO UPDATE (create=True) или UPDATE (create=False) строки user_states.
+        """
+        self._changed()
+        row = self.users.get(user_id)
+        if row is None:
+            if not create:
+                return
+            row = self.users[user_id] = {"country": None, "country_key": None, "country_desc": None}
+        old_key = row["country_key"]
+        row.update(fields)
+        new_key = row["country_key"]
+        if self._matcher is not None and new_key != old_key:
+            if old_key is not None:
+                self._matcher = None
+            else:
+                self._matcher.add(new_key, new_key)
+
+    def set_country_name(self, key: str, name: str, replace: bool = True):
+        self._changed()
+        if replace or key not in self.countries:
+            self.countries[key] = name
+
+    def add_synonym(self, synonym_key: str, synonym: str, key: str):
+        self._changed()
+        if synonym_key not in self.synonyms:
+            self.synonyms[synonym_key] = (synonym, key)
+            if self._matcher is not None:
+                self._matcher.add(synonym_key, key)
+
+    # ==== Производные представления; пересчитываются после записи ====
+
+    def _view(self, name, build):
+        if name not in self._views:
+            self._views[name] = build()
+        return self._views[name]
+
+    def active(self):
+        """
+        Игроки с выбранной страной: список (user_id, строка) по возрастанию user_id, как в таблице.
+        """
+        return self._view(
+            "active", lambda: [(uid, row) for uid, row in sorted(self.users.items()) if row["country"] is not None]
+        )
+
+    def user_id_by_country_key(self, key: str):
+        index = self._view("by_key", lambda: self._first_user_by_key())
+        return index.get(key)
+
+    def _first_user_by_key(self):
+        index = {}
+        for uid, row in sorted(self.users.items()):
+            if row["country_key"] is not None:
+                index.setdefault(row["country_key"], uid)
+        return index
+
+    def search_variants(self):
+        """
+        Варианты поиска страны в тексте: (ключ названия или синонима, каноническое название).
+        """
+        return self._view(
+            "variants",
+            lambda: [(row["country_key"], row["country"].strip()) for _, row in self.active()]
+            + [(skey, self.countries[key]) for skey, (_, key) in self.synonyms.items() if key in self.countries],
+        )
+
+    def country_matcher(self) -> CountryMatcher:
+        """
+        Автомат по тем же вариантам, что search_variants; находит ключи стран.
+        """
+        if self._matcher is None:
+            self._matcher = CountryMatcher(
+                [(row["country_key"], row["country_key"]) for _, row in self.active()]
+                + [(skey, key) for skey, (_, key) in self.synonyms.items() if key in self.countries]
+            )
+        return self._matcher
+
+
+world_state = WorldState()